@@ -0,0 +1,115 @@
+"""
+Measure file hashing throughput (MB/s) for every strategy in client.hash_utils.
+
+Run from the project root:
+
+    python -m benchmarks.hash_throughput
+    python -m benchmarks.hash_throughput --sizes 1M 256M 2G --algorithms sha256 blake2b
+    python -m benchmarks.hash_throughput --chunking
+
+"legacy-4k" is the old implementation (f.read(4096) in a loop), kept here
+as the baseline the other strategies are compared against. --chunking also
+measures chunk_file (content-defined chunks, for chunked uploads) with every
+chunker that is installed ("chunk-numpy", "chunk-python").
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from client import hash_utils
+from client.hash_utils import CHUNKERS, STRATEGIES, SUPPORTED_ALGORITHMS, calculate_file_hash, chunk_file
+
+_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    # "64M" -> 67108864
+    text = text.strip().upper()
+    if text and text[-1] in _UNITS:
+        return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(text)
+
+
+def legacy_hash(file_path: str, algorithm: str) -> str:
+    sha = hashlib.new(algorithm)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def make_file(directory: str, size: int) -> str:
+    path = os.path.join(directory, f"bench_{size}.bin")
+    block = os.urandom(min(size, 1024 * 1024)) or b""
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            part = block[: size - written]
+            f.write(part)
+            written += len(part)
+    return path
+
+
+def best_time(func: Callable[[], object], repeat: int) -> float:
+    # Best of `repeat` runs (the file is in the page cache after the first run)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def available_chunkers() -> List[str]:
+    return [chunker for chunker in CHUNKERS if chunker != "numpy" or hash_utils.numpy is not None]
+
+
+def run(sizes: List[int], algorithms: List[str], repeat: int, chunking: bool = False) -> List[Dict[str, object]]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = make_file(tmp, size)
+            for algorithm in algorithms:
+                runners = {"legacy-4k": lambda: legacy_hash(path, algorithm)}
+                for strategy in STRATEGIES:
+                    runners[strategy] = (
+                        lambda strategy=strategy: calculate_file_hash(path, algorithm, strategy)
+                    )
+                if chunking:
+                    for chunker in available_chunkers():
+                        runners[f"chunk-{chunker}"] = (
+                            lambda chunker=chunker: chunk_file(path, algorithm, chunker=chunker)
+                        )
+                for name, func in runners.items():
+                    seconds = best_time(func, repeat)
+                    results.append({
+                        "size": size,
+                        "algorithm": algorithm,
+                        "strategy": name,
+                        "seconds": seconds,
+                        "mb_per_s": size / (1024 * 1024) / seconds if seconds else float("inf"),
+                    })
+            os.remove(path)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["4K", "1M", "64M", "256M"])
+    parser.add_argument("--algorithms", nargs="+", default=list(SUPPORTED_ALGORITHMS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--chunking", action="store_true", help="also measure content-defined chunking")
+    args = parser.parse_args()
+
+    results = run([parse_size(s) for s in args.sizes], args.algorithms, args.repeat, args.chunking)
+
+    print(f"{'size':>12} {'algorithm':>10} {'strategy':>12} {'MB/s':>10}")
+    for row in results:
+        print(f"{row['size']:>12} {row['algorithm']:>10} {row['strategy']:>12} {row['mb_per_s']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
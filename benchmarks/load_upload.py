@@ -0,0 +1,155 @@
+"""
+Load test: uploads/s of the server for different numbers of worker processes.
+
+Needs a reachable MinIO (MINIO_ENDPOINT etc., like the server itself).
+Run from the project root:
+
+    python -m benchmarks.load_upload
+    python -m benchmarks.load_upload --workers 1 2 4 8 --clients 32 --files 2000 --size 64K
+
+For every worker count a server is started with `python -m server.serve`
+on a fresh index, `--files` random files are sent with PUT /assets/<hash>
+from `--clients` concurrent connections, and the server is stopped again.
+With --url an already running server is tested instead (once).
+"""
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from benchmarks.hash_throughput import parse_size
+
+_sessions = threading.local()
+
+
+def _session() -> requests.Session:
+    # One keep-alive connection per client thread
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = requests.Session()
+        _sessions.session = session
+    return session
+
+
+def wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if requests.get(f"{url}/readyz", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"server at {url} did not start")
+        time.sleep(0.1)
+
+
+def put_file(url: str, content: bytes) -> bool:
+    file_hash = hashlib.sha256(content).hexdigest()
+    response = _session().put(
+        f"{url}/assets/{file_hash}",
+        data=content,
+        headers={"X-File-Name": "load.bin", "Content-Type": "application/octet-stream"},
+        timeout=60,
+    )
+    return response.status_code == 200
+
+
+def run_load(url: str, files: int, size: int, clients: int) -> Dict[str, float]:
+    # Unique content per run, so every upload really reaches the storage
+    payloads = [os.urandom(size) for _ in range(files)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(lambda content: put_file(url, content), payloads))
+    seconds = time.perf_counter() - start
+
+    # Every file must be in the (shared) index, whichever worker stored it
+    hashes = [hashlib.sha256(content).hexdigest() for content in payloads]
+    indexed = 0
+    for first in range(0, len(hashes), 1000):
+        response = requests.post(f"{url}/exists", json={"hashes": hashes[first:first + 1000]}, timeout=30)
+        indexed += len(response.json()["existing"])
+
+    return {
+        "seconds": seconds,
+        "uploads_per_s": files / seconds,
+        "mb_per_s": files * size / (1024 * 1024) / seconds,
+        "errors": results.count(False),
+        "indexed": indexed,
+    }
+
+
+def start_server(workers: int, port: int, backend: str, index_db: str) -> subprocess.Popen:
+    env = dict(os.environ, INDEX_DB_FILE=index_db)
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "server.serve",
+            "--workers", str(workers),
+            "--port", str(port),
+            "--backend", backend,
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def run(
+    worker_counts: List[int],
+    files: int,
+    size: int,
+    clients: int,
+    port: int,
+    backend: str,
+    url: Optional[str] = None,
+) -> List[Dict[str, float]]:
+    if url is not None:
+        return [{"workers": 0, **run_load(url, files, size, clients)}]
+
+    results = []
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            server = start_server(workers, port, backend, os.path.join(tmp, "index.db"))
+            server_url = f"http://127.0.0.1:{port}"
+            try:
+                wait_until_up(server_url)
+                results.append({"workers": workers, **run_load(server_url, files, size, clients)})
+            finally:
+                server.terminate()
+                server.wait()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--size", default="64K")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--backend", default="auto")
+    parser.add_argument("--url", default=None, help="test a running server instead")
+    args = parser.parse_args()
+
+    results = run(
+        args.workers, args.files, parse_size(args.size), args.clients, args.port, args.backend, args.url
+    )
+
+    print(f"{'workers':>8} {'uploads/s':>10} {'MB/s':>8} {'errors':>7} {'indexed':>8}")
+    for row in results:
+        print(
+            f"{row['workers']:>8} {row['uploads_per_s']:>10.1f} {row['mb_per_s']:>8.1f}"
+            f" {row['errors']:>7} {row['indexed']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
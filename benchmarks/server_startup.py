@@ -0,0 +1,72 @@
+"""
+Measure the cold-start time of a server worker.
+
+Run from the project root:
+
+    python -m benchmarks.server_startup
+    python -m benchmarks.server_startup --repeat 20
+
+Every run is a fresh Python process (like a new worker) and reports:
+- import: importing server.main
+- create_app: building the Flask app (no network or disk access)
+- ready: until the storage is connected and the index is open
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# Runs in the child process and prints its timings as JSON
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from server import main
+imported = time.perf_counter()
+main.create_app(warmup=False)
+created = time.perf_counter()
+ready = None
+if sys.argv[1] == "1":
+    main.get_assets_index()
+    main.get_upload_sessions()
+    main.get_storage()
+    ready = time.perf_counter() - start
+print(json.dumps({"import": imported - start, "create_app": created - start, "ready": ready}))
+"""
+
+
+def measure_once(with_ready: bool) -> Dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, "-c", _CHILD, "1" if with_ready else "0"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(repeat: int, with_ready: bool) -> Dict[str, float]:
+    runs: List[Dict[str, float]] = [measure_once(with_ready) for _ in range(repeat)]
+    return {
+        key: statistics.median(run[key] for run in runs)
+        for key in ("import", "create_app", "ready")
+        if runs[0][key] is not None
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--no-ready", action="store_true", help="don't connect to the storage")
+    args = parser.parse_args()
+
+    results = run(args.repeat, not args.no_ready)
+
+    print(f"{'phase':>12} {'median ms':>10}")
+    for phase, seconds in results.items():
+        print(f"{phase:>12} {seconds * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+Benchmark suite: hashing, scanning, state persistence, upload throughput and
+catalog queries.
+
+Run from the project root:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --scale quick --only hash scan
+    python -m benchmarks.suite --output new.json --compare old.json
+
+Every benchmark works on synthetic data in a temporary directory:
+- hash: calculate_file_hash over a tree of small files and over huge files
+- scan: DirectoryWatcher.scan_once on a deep tree of small files, cold
+  (empty state: every file is hashed), warm (stat fingerprints only) and
+  warm with skip_unchanged_dirs (unchanged directories are not listed)
+- state: StateManager.mark_uploaded of 10k / 100k / 1M entries with the
+  client's write-behind settings, then lookups of random entries
+- upload: Uploader.upload_many against the Flask app on a local port,
+  with an in-memory storage backend (no MinIO, no disk writes)
+- catalog: AssetIndex.query pages (100 entries) over a catalog of
+  synthetic assets: first page, by extension, a size range, a deep page
+
+Results are written as a flat JSON list of {benchmark, case, metric, value}
+plus the commit / machine they were measured on, so runs of two commits can
+be compared with --compare (higher is better for every metric).
+"""
+import argparse
+import collections
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.hash_throughput import best_time, make_file, parse_size
+
+# Sizes of the synthetic data per --scale
+SCALES = {
+    "quick": {
+        "small_files": 2000,
+        "small_size": "4K",
+        "huge_size": "16M",
+        "depth": 3,
+        "fanout": 4,
+        "state_entries": [10_000],
+        "upload_files": 500,
+        "upload_size": "16K",
+        "catalog_assets": 20_000,
+    },
+    "full": {
+        "small_files": 20000,
+        "small_size": "4K",
+        "huge_size": "256M",
+        "depth": 5,
+        "fanout": 4,
+        "state_entries": [10_000, 100_000, 1_000_000],
+        "upload_files": 5000,
+        "upload_size": "64K",
+        "catalog_assets": 1_000_000,
+    },
+}
+
+BENCHMARKS = ("hash", "scan", "state", "upload", "catalog")
+
+
+def result(benchmark: str, case: str, metric: str, value: float) -> Dict[str, object]:
+    return {"benchmark": benchmark, "case": case, "metric": metric, "value": value}
+
+
+def make_tree(root: str, files: int, size: int, depth: int, fanout: int) -> List[str]:
+    """
+    Create `files` files of `size` random-ish bytes, spread evenly over a
+    tree of directories `depth` levels deep with `fanout` sub-directories
+    each. Returns the file paths.
+    """
+    directories = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [os.path.join(parent, f"d{i}") for parent in level for i in range(fanout)]
+        directories.extend(level)
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    # Unique content per file (so nothing is deduplicated by accident)
+    rng = random.Random(0)
+    block = rng.randbytes(size)
+    paths = []
+    for i in range(files):
+        path = os.path.join(directories[i % len(directories)], f"file_{i}.bin")
+        with open(path, "wb") as f:
+            f.write(i.to_bytes(8, "big") + block[8:])
+        paths.append(path)
+    return paths
+
+
+def age_directories(root: str, seconds: float = 3600) -> None:
+    # Directory mtimes in the past, as on a tree that exists for a while
+    # (freshly changed directories are never cached by skip_unchanged_dirs)
+    then = time.time() - seconds
+    for directory, _, _ in os.walk(root):
+        os.utime(directory, (then, then))
+
+
+def bench_hash(tmp: str, scale: dict, repeat: int) -> List[Dict[str, object]]:
+    from client.hash_utils import calculate_file_hash
+
+    small_size = parse_size(scale["small_size"])
+    small = make_tree(os.path.join(tmp, "hash_small"), scale["small_files"], small_size, 1, 8)
+
+    def hash_small():
+        for path in small:
+            calculate_file_hash(path)
+
+    seconds = best_time(hash_small, repeat)
+    results = [
+        result("hash", "small_files", "files_per_s", len(small) / seconds),
+        result("hash", "small_files", "mb_per_s", len(small) * small_size / (1024 * 1024) / seconds),
+    ]
+
+    huge_size = parse_size(scale["huge_size"])
+    huge_dir = os.path.join(tmp, "hash_huge")
+    os.makedirs(huge_dir)
+    path = make_file(huge_dir, huge_size)
+    seconds = best_time(lambda: calculate_file_hash(path), repeat)
+    results.append(result("hash", f"huge_file_{scale['huge_size']}", "mb_per_s", huge_size / (1024 * 1024) / seconds))
+    os.remove(path)
+    return results
+
+
+def bench_scan(tmp: str, scale: dict, hash_workers: int) -> List[Dict[str, object]]:
+    from client.state_manager import StateManager
+    from client.watcher import DirectoryWatcher
+
+    root = os.path.join(tmp, "scan")
+    files = make_tree(
+        root, scale["small_files"], parse_size(scale["small_size"]), scale["depth"], scale["fanout"]
+    )
+    age_directories(root)
+    state = StateManager(
+        state_path=os.path.join(tmp, "scan_state.db"), flush_every=500, flush_interval_ms=2000
+    )
+
+    def timed_scan(skip_unchanged_dirs: bool) -> float:
+        watcher = DirectoryWatcher(
+            root,
+            state,
+            recursive=True,
+            hash_workers=hash_workers,
+            skip_unchanged_dirs=skip_unchanged_dirs,
+        )
+        start = time.perf_counter()
+        watcher.scan_once()
+        return time.perf_counter() - start
+
+    results = []
+    # cold: every file is hashed and marked; the second skip_unchanged_dirs
+    # scan is the first one that can use the directory cache
+    for case, skip_dirs in (("cold", False), ("warm", False), ("warm_dirs_listed", True), ("warm_dirs_cached", True)):
+        seconds = timed_scan(skip_dirs)
+        results.append(result("scan", case, "files_per_s", len(files) / seconds))
+    state.close()
+    return results
+
+
+def bench_state(tmp: str, scale: dict) -> List[Dict[str, object]]:
+    from client.state_manager import StateManager
+
+    results = []
+    for entries in scale["state_entries"]:
+        path = os.path.join(tmp, f"state_{entries}.db")
+        state = StateManager(state_path=path, flush_every=500, flush_interval_ms=2000)
+        fingerprint = [4096, 1_700_000_000_000_000_000, 0, 2049]
+        start = time.perf_counter()
+        for i in range(entries):
+            fingerprint[2] = i
+            state.mark_uploaded(f"/data/photos/{i // 1000}/IMG_{i}.jpg", f"{i:064x}", fingerprint)
+        state.flush()
+        seconds = time.perf_counter() - start
+        results.append(result("state", f"mark_{entries}", "marks_per_s", entries / seconds))
+
+        rng = random.Random(entries)
+        lookups = 10_000
+        start = time.perf_counter()
+        for _ in range(lookups):
+            i = rng.randrange(entries)
+            fingerprint[2] = i
+            state.is_unchanged(f"/data/photos/{i // 1000}/IMG_{i}.jpg", fingerprint)
+        seconds = time.perf_counter() - start
+        results.append(result("state", f"lookup_{entries}", "lookups_per_s", lookups / seconds))
+        state.close()
+        os.remove(path)
+    return results
+
+
+class _MemoryStorage:
+    # Storage backend that keeps nothing: only the throughput of the HTTP
+    # path, hashing and the index is measured
+    bucket = "memory"
+
+    def connect(self) -> None:
+        pass
+
+    def put_stream(self, object_name, stream, content_type) -> None:
+        # Read to EOF, where HashVerifyingReader checks the hash
+        while stream.read(1024 * 1024):
+            pass
+
+    def put_bytes(self, object_name, data, content_type) -> None:
+        pass
+
+
+def bench_upload(tmp: str, scale: dict) -> List[Dict[str, object]]:
+    import logging
+
+    from werkzeug.serving import make_server
+
+    from client.hash_utils import calculate_file_hash
+    from client.uploader import Uploader
+    from server import main
+    from server.index_store import AssetIndex, ChunkStore, UploadSessionStore
+
+    # No access log line per request
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    db = os.path.join(tmp, "upload_index.db")
+    resources = ("_storage", "_assets_index", "_upload_sessions", "_chunk_store")
+    saved = {name: getattr(main, name) for name in resources}
+    main._storage = _MemoryStorage()
+    main._upload_sessions = UploadSessionStore(db)
+    main._chunk_store = ChunkStore(db)
+    server = make_server("127.0.0.1", 0, main.create_app(warmup=False), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    size = parse_size(scale["upload_size"])
+    files = make_tree(os.path.join(tmp, "upload"), scale["upload_files"], size, 1, 8)
+    items = [(path, calculate_file_hash(path)) for path in files]
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    results = []
+    try:
+        # "single": one request per file, "batch": small files packed together
+        for case, batch_file_size in (("single", 0), ("batch", None)):
+            # A fresh index per case, so the files are new to the server every time
+            main._assets_index = AssetIndex(os.path.join(tmp, f"index_{case}.db"))
+            uploader = Uploader(url) if batch_file_size is None else Uploader(url, batch_file_size=batch_file_size)
+            start = time.perf_counter()
+            uploaded = uploader.upload_many(items)
+            seconds = time.perf_counter() - start
+            uploader.close()
+            if not all(r.success for r in uploaded):
+                raise RuntimeError(f"upload benchmark ({case}): some uploads failed")
+            results.append(result("upload", case, "files_per_s", len(items) / seconds))
+            results.append(result("upload", case, "mb_per_s", len(items) * size / (1024 * 1024) / seconds))
+    finally:
+        server.shutdown()
+        for name, value in saved.items():
+            setattr(main, name, value)
+    return results
+
+
+def bench_catalog(tmp: str, scale: dict) -> List[Dict[str, object]]:
+    from server.index_store import AssetIndex
+
+    index = AssetIndex(os.path.join(tmp, "catalog.db"))
+    assets = scale["catalog_assets"]
+    extensions = ("jpg", "png", "mp4", "pdf", "txt")
+    rng = random.Random(assets)
+    for start in range(0, assets, 10_000):
+        batch = []
+        for i in range(start, min(start + 10_000, assets)):
+            ext = extensions[i % len(extensions)]
+            batch.append((
+                f"{i:064x}",
+                {"bucket": "assets", "object_name": f"{i:064x}.{ext}"},
+                {
+                    "filename": f"IMG_{i}.{ext}",
+                    "size": rng.randrange(1, 100 * 1024 * 1024),
+                    "content_type": f"application/x-{ext}",
+                    "client_id": f"client-{i % 20}",
+                },
+            ))
+        index.insert_many_if_absent(batch)
+
+    # The page before the last one, as a client paging through would reach it
+    last = collections.deque(index.query(limit=assets), maxlen=101)[0]
+    cases = {
+        "first_page": {},
+        "by_extension": {"extension": "png"},
+        "size_range": {"min_size": 10 * 1024 * 1024, "max_size": 11 * 1024 * 1024},
+        "deep_page": {"after": (last["first_seen"], last["hash"])},
+    }
+    results = []
+    for case, query in cases.items():
+        queries = 200
+        start = time.perf_counter()
+        for _ in range(queries):
+            list(index.query(**query, limit=100))
+        seconds = time.perf_counter() - start
+        results.append(result("catalog", case, "queries_per_s", queries / seconds))
+    index.close()
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scale_name: str, only: List[str], repeat: int = 3, hash_workers: int = 1) -> Dict[str, object]:
+    scale = SCALES[scale_name]
+    runners: Dict[str, Callable[[str], List[Dict[str, object]]]] = {
+        "hash": lambda tmp: bench_hash(tmp, scale, repeat),
+        "scan": lambda tmp: bench_scan(tmp, scale, hash_workers),
+        "state": lambda tmp: bench_state(tmp, scale),
+        "upload": lambda tmp: bench_upload(tmp, scale),
+        "catalog": lambda tmp: bench_catalog(tmp, scale),
+    }
+    results = []
+    for name in BENCHMARKS:
+        if name not in only:
+            continue
+        with tempfile.TemporaryDirectory() as tmp:
+            results.extend(runners[name](tmp))
+    return {
+        "commit": _git_commit(),
+        "scale": scale_name,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def compare(old: Dict[str, object], new: Dict[str, object]) -> List[Dict[str, object]]:
+    # Change of every metric measured in both runs (positive = faster)
+    before = {(r["benchmark"], r["case"], r["metric"]): r["value"] for r in old["results"]}
+    rows = []
+    for r in new["results"]:
+        key = (r["benchmark"], r["case"], r["metric"])
+        if key in before and before[key]:
+            rows.append({**r, "old": before[key], "change": r["value"] / before[key] - 1})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="full")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per hash measurement (best is kept)")
+    parser.add_argument("--hash-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    report = run(args.scale, args.only, args.repeat, args.hash_workers)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    print(f"commit {report['commit']}, scale {report['scale']}, {report['cpus']} CPUs")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        print(f"{'benchmark':>10} {'case':>18} {'metric':>14} {'old':>12} {'new':>12} {'change':>8}")
+        for row in compare(old, report):
+            print(
+                f"{row['benchmark']:>10} {row['case']:>18} {row['metric']:>14}"
+                f" {row['old']:>12.1f} {row['value']:>12.1f} {row['change']:>+8.1%}"
+            )
+    else:
+        print(f"{'benchmark':>10} {'case':>18} {'metric':>14} {'value':>12}")
+        for row in report["results"]:
+            print(f"{row['benchmark']:>10} {row['case']:>18} {row['metric']:>14} {row['value']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
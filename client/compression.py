@@ -0,0 +1,91 @@
+"""
+Transfer compression of uploads (Content-Encoding: zstd / gzip).
+
+Only the bytes on the wire are compressed: hashes are always computed over
+the original content, and the server stores the decompressed file.
+"""
+import os
+import zlib
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+# Encodings this client can produce, in order of preference
+SUPPORTED_ENCODINGS = (["zstd"] if zstandard is not None else []) + ["gzip"]
+
+# Formats that are already compressed: compressing them again only costs CPU
+INCOMPRESSIBLE_EXTENSIONS = frozenset({
+    # images
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".heif", ".avif", ".jxl",
+    # audio / video
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac", ".wma",
+    ".mp4", ".m4v", ".mov", ".mkv", ".avi", ".webm", ".wmv",
+    # archives
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".lz4",
+    # zip based documents / packages
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".jar", ".apk",
+    ".pdf",
+})
+
+# Smaller files gain nothing worth the extra header bytes
+MIN_COMPRESS_SIZE = 1024
+
+# zstd level 3 / gzip level 6: fast enough to keep up with a WAN link
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+
+READ_SIZE = 1024 * 1024
+
+
+def choose_encoding(server_encodings: Iterable[str]) -> Optional[str]:
+    # The server's most preferred encoding that this client supports
+    for encoding in server_encodings:
+        if encoding in SUPPORTED_ENCODINGS:
+            return encoding
+    return None
+
+
+def is_compressible(file_path: str, size: int) -> bool:
+    _, ext = os.path.splitext(file_path)
+    return size >= MIN_COMPRESS_SIZE and ext.lower() not in INCOMPRESSIBLE_EXTENSIONS
+
+
+def _compressor(encoding: str):
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    if encoding == "gzip":
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    raise ValueError(f"unsupported content encoding: {encoding}")
+
+
+def iter_compressed(stream: BinaryIO, encoding: str, stats: Optional[dict] = None) -> Iterator[bytes]:
+    """
+    Yields the compressed content of `stream`, READ_SIZE bytes of input at a
+    time (pass it as a request body: it is sent with chunked encoding).
+
+    :param stats: if given, "in" / "out" are set to the bytes read / produced
+    """
+    compressor = _compressor(encoding)
+    bytes_in = bytes_out = 0
+    while True:
+        data = stream.read(READ_SIZE)
+        if not data:
+            break
+        bytes_in += len(data)
+        out = compressor.compress(data)
+        if out:
+            bytes_out += len(out)
+            yield out
+    out = compressor.flush()
+    bytes_out += len(out)
+    if stats is not None:
+        stats["in"], stats["out"] = bytes_in, bytes_out
+    yield out
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
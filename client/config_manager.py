@@ -1,6 +1,7 @@
 import os
 import json
-from typing import Any, Dict
+import socket
+from typing import Any, Dict, List, Optional
 
 # Path to the configuration directory and file
 CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".config", "asset_client")
@@ -54,6 +55,121 @@ class ConfigManager:
     def get_watch_directory(self) -> str:
         return self.config.get("watch_directory","")
     
+    # A function that returns how often (in seconds) the watcher should hash
+    # every file again even if its size/mtime did not change ("paranoid" mode).
+    # None (the default) means: trust the stat fingerprints.
+    def get_paranoid_interval(self) -> Optional[float]:
+        value = self.config.get("paranoid_rehash_interval")
+        return float(value) if value is not None else None
+
+    # Functions that return what the watcher scans: sub-directories too or
+    # not, and .gitignore-style patterns of files / directories to skip
+    # ("exclude", on top of the defaults unless "use_default_ignores" is
+    # false) or of the only files to pick up ("include").
+    def get_recursive(self) -> bool:
+        return bool(self.config.get("recursive", False))
+
+    def get_exclude_patterns(self) -> List[str]:
+        return list(self.config.get("exclude", []))
+
+    def get_include_patterns(self) -> List[str]:
+        return list(self.config.get("include", []))
+
+    def get_use_default_ignores(self) -> bool:
+        return bool(self.config.get("use_default_ignores", True))
+
+    # A function that returns every directory the client watches, each with
+    # its own settings: "priority" (share of the hashing / upload threads
+    # and bandwidth when several roots have work, default 1), "recursive",
+    # "exclude", "include" and "use_default_ignores" (defaults: the global
+    # settings above). Entries of "watch_roots" may also be plain paths.
+    # Without "watch_roots" the single watch_directory is the only root.
+    def get_watch_roots(self) -> List[Dict[str, Any]]:
+        roots = self.config.get("watch_roots") or [self.get_watch_directory()]
+        result = []
+        for root in roots:
+            if isinstance(root, str):
+                root = {"path": root}
+            priority = float(root.get("priority", 1))
+            if priority <= 0:
+                raise ValueError(f"watch root priority must be positive: {root['path']}")
+            result.append({
+                "path": root["path"],
+                "priority": priority,
+                "recursive": bool(root.get("recursive", self.get_recursive())),
+                "exclude": list(root.get("exclude", self.get_exclude_patterns())),
+                "include": list(root.get("include", self.get_include_patterns())),
+                "use_default_ignores": bool(root.get("use_default_ignores", self.get_use_default_ignores())),
+            })
+        return result
+
+    # A function that returns the max upload rate of the whole client in
+    # megabits per second (None = unlimited), shared by all watch roots.
+    def get_upload_limit_mbps(self) -> Optional[float]:
+        value = self.config.get("upload_limit_mbps")
+        return float(value) if value else None
+
+    # A function that returns whether directories whose mtime did not change
+    # since the last scan are skipped without listing them. Much faster on
+    # huge trees, but a file edited in place is then only noticed by events
+    # or by the paranoid rehash.
+    def get_skip_unchanged_dirs(self) -> bool:
+        return bool(self.config.get("skip_unchanged_dirs", False))
+
+    # A function that returns whether the watcher should use file system
+    # events (inotify) instead of scanning every few seconds.
+    def get_use_events(self) -> bool:
+        return bool(self.config.get("use_events", True))
+
+    # Functions that return the size of the scan pipeline:
+    # how many files are hashed at the same time, how many upload batches
+    # are handled at the same time, how many files are uploaded at the same
+    # time, and how many files may wait between two stages.
+    def get_hash_workers(self) -> int:
+        return int(self.config.get("hash_workers") or os.cpu_count() or 1)
+
+    def get_upload_workers(self) -> int:
+        return int(self.config.get("upload_workers", 2))
+
+    def get_max_in_flight_uploads(self) -> int:
+        return int(self.config.get("max_in_flight_uploads", 8))
+
+    def get_queue_size(self) -> int:
+        return int(self.config.get("queue_size", 256))
+
+    # Files at least this big are uploaded in content-defined chunks
+    # (None = off, since chunking costs CPU time on every upload).
+    def get_chunked_upload_min_size(self) -> Optional[int]:
+        value = self.config.get("chunked_upload_min_size")
+        return int(value) if value is not None else None
+
+    # Name of this client in the server's catalog (sent as X-Client-Id);
+    # the host name unless "client_id" is set.
+    def get_client_id(self) -> str:
+        return str(self.config.get("client_id") or socket.gethostname())
+
+    # Compress compressible files (text, CSV, logs, databases, ...) on the
+    # wire, if the server supports it. Costs client CPU; off for fast LANs.
+    def get_compression(self) -> bool:
+        return bool(self.config.get("compression", True))
+
+    # Functions that return the logging settings: the log level ("DEBUG" also
+    # shows every skipped file) and how often (in seconds) the upload
+    # statistics are logged (0 = only when the client stops).
+    def get_log_level(self) -> str:
+        return str(self.config.get("log_level", "INFO")).upper()
+
+    def get_stats_interval(self) -> float:
+        return float(self.config.get("stats_interval", 60))
+
+    # Functions that return the write-behind settings of the state database:
+    # buffered marks are written after this many uploads / milliseconds.
+    def get_state_flush_every(self) -> int:
+        return int(self.config.get("state_flush_every", 500))
+
+    def get_state_flush_interval_ms(self) -> int:
+        return int(self.config.get("state_flush_interval_ms", 2000))
+
     # A function that updates the watch directory and saves the configuration.
     def set_watch_directory(self, path:str) -> None:
         self.config["watch_directory"] = path
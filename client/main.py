@@ -1,39 +1,116 @@
+import logging
+import threading
+
 from .config_manager import ConfigManager
+from .metrics import StatsReporter
 from .state_manager import StateManager
 from .watcher import DirectoryWatcher
+from .scanner import IgnoreRules
+from .scheduler import Scheduler
 from .uploader import Uploader
-import time
 
 
 def main():
     # Load configuration (server URL, watch directory, etc.)
     config = ConfigManager()
+    logging.basicConfig(level=config.get_log_level(), format="%(asctime)s %(levelname)s %(message)s")
 
     print("=== Client configuration ===")
     print("Server URL:     ", config.get_server_url())
-    print("Watch directory:", config.get_watch_directory())
+    watch_roots = config.get_watch_roots()
+    for root in watch_roots:
+        print("Watch directory:", root["path"], f"(priority {root['priority']:g})")
 
-    # Load client state (which files were already uploaded)
-    state = StateManager()
+    # Load client state (which files were already uploaded).
+    # Marks are buffered and written in batches; on a crash at most one
+    # batch is lost, and those files are simply uploaded again (server dedups them).
+    state = StateManager(
+        flush_every=config.get_state_flush_every(),
+        flush_interval_ms=config.get_state_flush_interval_ms(),
+    )
 
-    # Create uploader that knows how to talk to the server
-    uploader = Uploader(server_url=config.get_server_url())
+    # Hashing and upload threads shared by all watch roots, handed out
+    # fairly by priority, and one bandwidth limit for the whole client
+    upload_limit = config.get_upload_limit_mbps()
+    scheduler = Scheduler(
+        hash_workers=config.get_hash_workers(),
+        upload_workers=config.get_max_in_flight_uploads(),
+        bandwidth_limit=upload_limit * 125_000 if upload_limit else None,
+    )
 
-    # Create a watcher for the configured directory
-    watcher = DirectoryWatcher(
-        watch_directory=config.get_watch_directory(),
+    # Create uploader that knows how to talk to the server
+    # (keeps a pool of keep-alive connections, uploads several files at once)
+    uploader = Uploader(
+        server_url=config.get_server_url(),
         state_manager=state,
-        recursive=False,   # or True if you want sub-directories
-        uploader=uploader, # now watcher is connected to the server through uploader
+        max_in_flight=config.get_max_in_flight_uploads(),
+        chunked_threshold=config.get_chunked_upload_min_size(),
+        client_id=config.get_client_id(),
+        compression=config.get_compression(),
+        scheduler=scheduler,
     )
+    hash_algorithm = uploader.negotiate_hash_algorithm()
+    print("Hash algorithm: ", hash_algorithm)
+
+    # Create a watcher for every configured directory
+    watchers = [
+        DirectoryWatcher(
+            watch_directory=root["path"],
+            state_manager=state,
+            recursive=root["recursive"],
+            uploader=uploader, # now watcher is connected to the server through uploader
+            paranoid_interval=config.get_paranoid_interval(),
+            hash_workers=config.get_hash_workers(),
+            upload_workers=config.get_upload_workers(),
+            queue_size=config.get_queue_size(),
+            hash_algorithm=hash_algorithm,
+            ignore_rules=IgnoreRules(
+                exclude=root["exclude"],
+                include=root["include"],
+                use_defaults=root["use_default_ignores"],
+            ),
+            skip_unchanged_dirs=config.get_skip_unchanged_dirs(),
+            scheduler=scheduler,
+            priority=root["priority"],
+        )
+        for root in watch_roots
+    ]
+
+    # Totals (files scanned / hashed / uploaded, MB/s, latencies) in the log
+    stats = StatsReporter(config.get_stats_interval())
+    if config.get_stats_interval() > 0:
+        stats.start()
 
-    print("\n=== Scanning for files (press Ctrl+C to stop) ===")
+    print("\n=== Watching for files (press Ctrl+C to stop) ===")
+    # Every watcher reacts to file system events when the OS supports it
+    # (inotify), otherwise scans again every few seconds.
+    threads = [
+        threading.Thread(
+            target=watcher.watch,
+            kwargs={"poll_interval": 5, "use_events": config.get_use_events()},
+            name=f"watch-{index}",
+            daemon=True,
+        )
+        for index, watcher in enumerate(watchers)
+    ]
+    for thread in threads:
+        thread.start()
     try:
-        while True:
-            watcher.scan_once()
-            time.sleep(5)  # Afew seconds to wait befor scanning again.
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1.0)
     except KeyboardInterrupt:
-        print("\nStopping watcher, bye!")
+        print("\nStopping watchers, bye!")
+    finally:
+        for watcher in watchers:
+            watcher.stop()
+        for thread in threads:
+            thread.join()
+        # Finish running uploads, then write buffered state before exiting
+        scheduler.shutdown()
+        uploader.close()
+        state.close()
+        stats.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+import logging
+import threading
+from typing import Optional
+
+from common.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+# ===== Client metrics =====
+
+FILES_SCANNED = Counter("files_scanned")
+# reason: unchanged (same stat fingerprint), same_hash (touched, same
+# content), on_server (the server already had the content = dedup hit)
+FILES_SKIPPED = Counter("files_skipped", ("reason",))
+FILES_HASHED = Counter("files_hashed")
+BYTES_HASHED = Counter("bytes_hashed")
+HASH_SECONDS = Histogram("hash_seconds")
+SCAN_SECONDS = Histogram("scan_seconds")
+# result: ok / failed
+UPLOADS = Counter("uploads", ("result",))
+BYTES_UPLOADED = Counter("bytes_uploaded")
+# stage: in (content of compressed uploads) / out (what was sent for it)
+BYTES_SENT_COMPRESSED = Counter("bytes_sent_compressed", ("stage",))
+# kind: file (one request per file, whatever the upload mode) / batch
+UPLOAD_SECONDS = Histogram("upload_seconds", ("kind",))
+# Time upload threads waited for the bandwidth limit (see scheduler.TokenBucket)
+THROTTLED_SECONDS = Counter("throttled_seconds")
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:g}s"
+
+
+def format_stats() -> str:
+    """
+    One line with the totals since the client started, e.g.
+    scanned=120000 skipped(unchanged=119000 same_hash=3 on_server=10)
+    hashed=987 (1.2 GB, 410.5 MB/s) uploaded=977 (1.1 GB) failed=0
+    upload p50<=0.1s p95<=1s scan p50<=2.5s compression=4.2x
+    (latencies are histogram bucket bounds, not exact values; compression
+    is the ratio over the uploads that were compressed)
+    """
+    hash_seconds = HASH_SECONDS.sum()
+    hashed_mb = BYTES_HASHED.value() / (1024 * 1024)
+    hash_rate = f"{hashed_mb / hash_seconds:.1f} MB/s" if hash_seconds else "- MB/s"
+    upload_p50 = max(
+        (q for q in (UPLOAD_SECONDS.quantile(0.5, kind=kind) for kind in ("file", "batch")) if q is not None),
+        default=None,
+    )
+    upload_p95 = max(
+        (q for q in (UPLOAD_SECONDS.quantile(0.95, kind=kind) for kind in ("file", "batch")) if q is not None),
+        default=None,
+    )
+    compressed_in = BYTES_SENT_COMPRESSED.value(stage="in")
+    compressed_out = BYTES_SENT_COMPRESSED.value(stage="out")
+    compression = f"{compressed_in / compressed_out:.1f}x" if compressed_out else "-"
+    return (
+        f"scanned={int(FILES_SCANNED.value())} "
+        f"skipped(unchanged={int(FILES_SKIPPED.value(reason='unchanged'))} "
+        f"same_hash={int(FILES_SKIPPED.value(reason='same_hash'))} "
+        f"on_server={int(FILES_SKIPPED.value(reason='on_server'))}) "
+        f"hashed={int(FILES_HASHED.value())} ({hashed_mb:.1f} MB, {hash_rate}) "
+        f"uploaded={int(UPLOADS.value(result='ok'))} ({BYTES_UPLOADED.value() / (1024 * 1024):.1f} MB) "
+        f"failed={int(UPLOADS.value(result='failed'))} "
+        f"upload p50<={_format_seconds(upload_p50)} p95<={_format_seconds(upload_p95)} "
+        f"scan p50<={_format_seconds(SCAN_SECONDS.quantile(0.5))} "
+        f"compression={compression}"
+    )
+
+
+class StatsReporter:
+    """
+    Logs format_stats() every `interval` seconds on a background thread,
+    and once more when stopped.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stats", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            logger.info("[STATS] %s", format_stats())
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        logger.info("[STATS] %s", format_stats())
@@ -0,0 +1,99 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the input for one worker
+_DONE = object()
+
+
+class Stage(NamedTuple):
+    """
+    One step of a pipeline.
+
+    :param name: used for thread names (shows up in tracebacks / debuggers)
+    :param func: called once per item; its return value is passed on to the
+        next stage. Returning None drops the item.
+    :param workers: number of threads running `func` concurrently
+    :param batch_size: if set, `func` gets a list of up to this many items
+        (whatever is already waiting in the queue, it never waits for more)
+    """
+    name: str
+    func: Callable[[Any], Optional[Any]]
+    workers: int = 1
+    batch_size: Optional[int] = None
+
+
+def run_pipeline(source: Iterable[Any], stages: List[Stage], queue_size: int = 64) -> None:
+    """
+    Push every item of `source` through `stages`, each stage on its own
+    worker threads, connected by bounded queues.
+
+    The source is consumed on the calling thread. Because every queue holds
+    at most `queue_size` items, a slow stage (e.g. uploads) makes the earlier
+    stages wait instead of piling up items in memory.
+
+    Exceptions raised by a stage function are logged and the item is dropped,
+    so one bad file never stalls the whole pipeline.
+    """
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+    threads: List[List[threading.Thread]] = []
+
+    for index, stage in enumerate(stages):
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(stages) else None
+        stage_threads = [
+            threading.Thread(
+                target=_worker,
+                args=(stage, inbox, outbox),
+                name=f"{stage.name}-{n}",
+                daemon=True,
+            )
+            for n in range(max(1, stage.workers))
+        ]
+        for thread in stage_threads:
+            thread.start()
+        threads.append(stage_threads)
+
+    try:
+        for item in source:
+            queues[0].put(item)
+    finally:
+        # Shut the stages down in order: once all workers of a stage are done,
+        # nothing new can reach the next stage.
+        for index, stage_threads in enumerate(threads):
+            for _ in stage_threads:
+                queues[index].put(_DONE)
+            for thread in stage_threads:
+                thread.join()
+
+
+def _worker(stage: Stage, inbox: queue.Queue, outbox: Optional[queue.Queue]) -> None:
+    done = False
+    while not done:
+        item = inbox.get()
+        if item is _DONE:
+            return
+
+        if stage.batch_size:
+            batch = [item]
+            while len(batch) < stage.batch_size:
+                try:
+                    item = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+            item = batch
+
+        try:
+            result = stage.func(item)
+        except Exception as e:
+            logger.error("%s failed for %r: %s", stage.name, item, e)
+            continue
+        if result is not None and outbox is not None:
+            outbox.put(result)
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Pattern, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Files that are never worth uploading: OS metadata, Office lock files,
+# temp files and downloads that are still being written
+DEFAULT_EXCLUDE_PATTERNS = [
+    "desktop.ini",
+    "Thumbs.db",
+    ".DS_Store",
+    "~$*",
+    "*.tmp",
+    "*.part",
+    "*.crdownload",
+]
+
+# A directory whose mtime is this close to the start of the scan may still
+# get new entries within the same mtime tick, so it is not cached
+_RACY_MTIME_NS = 2_000_000_000
+
+
+class _Rule(NamedTuple):
+    regex: Pattern
+    negate: bool
+    dir_only: bool
+
+
+def _translate(pattern: str) -> str:
+    # gitignore glob -> regex body ("*" and "?" never match "/", "**" does)
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                i += 2
+                if i < n and pattern[i] == "/":
+                    # "**/" = zero or more directories
+                    out.append("(?:.*/)?")
+                    i += 1
+                else:
+                    out.append(".*")
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            # A "]" right after "[" (or "[!") is part of the class
+            first = i + 2 if pattern.startswith("[!", i) else i + 1
+            end = pattern.find("]", first + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end + 1
+                continue
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def _compile(pattern: str) -> Optional[_Rule]:
+    pattern = pattern.rstrip()
+    if not pattern or pattern.startswith("#"):
+        return None
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    # Like .gitignore: a pattern with a "/" is relative to the watch
+    # directory, a plain name matches at any depth
+    anchored = "/" in pattern
+    body = _translate(pattern.lstrip("/"))
+    if not anchored:
+        body = "(?:.*/)?" + body
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    return _Rule(re.compile(body, flags), negate, dir_only)
+
+
+def _compile_all(patterns: Iterable[str]) -> List[_Rule]:
+    return [rule for rule in map(_compile, patterns) if rule is not None]
+
+
+def _last_match(rules: List[_Rule], rel_path: str, is_dir: bool) -> bool:
+    # The last matching rule wins ("!" rules re-include)
+    matched = False
+    for rule in rules:
+        # Only rules that would flip the current result have to be tried
+        if rule.negate != matched or (rule.dir_only and not is_dir):
+            continue
+        if rule.regex.fullmatch(rel_path):
+            matched = not rule.negate
+    return matched
+
+
+class IgnoreRules:
+    """
+    Decides which files the watcher skips, with .gitignore-style patterns.
+
+    Paths are relative to the watch directory and use "/" as separator.
+    - exclude: matching files are skipped, matching directories are not
+      entered at all ("name/" only matches directories, "!pattern"
+      re-includes, the last matching pattern wins)
+    - include: if given, only files matching one of these are picked up
+      (e.g. "*.jpg", "photos/**")
+    """
+
+    def __init__(
+        self,
+        exclude: Optional[List[str]] = None,
+        include: Optional[List[str]] = None,
+        use_defaults: bool = True,
+    ) -> None:
+        """
+        :param exclude: patterns of files / directories to skip
+        :param include: patterns of the only files to pick up (None = all)
+        :param use_defaults: also skip DEFAULT_EXCLUDE_PATTERNS
+        """
+        exclude_patterns = (DEFAULT_EXCLUDE_PATTERNS if use_defaults else []) + list(exclude or [])
+        include_patterns = list(include or [])
+        self._exclude = _compile_all(exclude_patterns)
+        self._include = _compile_all(include_patterns)
+        # Changes whenever the rules change (cached scans of other rules are not reused)
+        self.signature = hashlib.sha1(
+            json.dumps([exclude_patterns, include_patterns]).encode("utf-8")
+        ).hexdigest()
+
+    def ignores_dir(self, rel_path: str) -> bool:
+        return _last_match(self._exclude, rel_path, is_dir=True)
+
+    def ignores_file(self, rel_path: str) -> bool:
+        if _last_match(self._exclude, rel_path, is_dir=False):
+            return True
+        return bool(self._include) and not _last_match(self._include, rel_path, is_dir=False)
+
+    def ignores_path(self, rel_path: str, is_dir: bool = False) -> bool:
+        # A single path (e.g. reported by an event): its parent directories count too
+        parts = rel_path.split("/")
+        for end in range(1, len(parts)):
+            if self.ignores_dir("/".join(parts[:end])):
+                return True
+        return self.ignores_dir(rel_path) if is_dir else self.ignores_file(rel_path)
+
+
+class ScannedDir(NamedTuple):
+    # What a directory looked like when it was last listed
+    mtime_ns: int
+    subdirs: List[str]
+
+
+class Scanner:
+    """
+    Walks a directory tree with os.scandir and yields the files to check.
+
+    The file type comes from the directory listing itself and the stat
+    result of each file is taken once and handed on, so a file costs one
+    stat() call. Ignored directories are never entered.
+
+    With a directory cache (see skip_unchanged_dirs in the watcher),
+    a directory whose mtime did not change since it was listed is not
+    listed again: no file was added, removed or renamed in it. Only its
+    sub-directories (known from the cache) are checked, one stat() each.
+    Files changed in place don't change the directory mtime, so such
+    edits are only noticed by event mode or a paranoid rehash.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        recursive: bool = False,
+        rules: Optional[IgnoreRules] = None,
+        dir_cache: Optional[Dict[str, ScannedDir]] = None,
+    ) -> None:
+        """
+        :param root: directory to scan
+        :param recursive: if True, walk sub-directories as well
+        :param rules: files / directories to skip (None = skip nothing)
+        :param dir_cache: directories listed by an earlier scan
+            (None = list every directory)
+        """
+        self.root = root
+        self.recursive = recursive
+        self.rules = rules
+        self.dir_cache = dir_cache
+        # Directories listed by this scan, to be saved as the next dir_cache
+        self.listed: Dict[str, ScannedDir] = {}
+        self.skipped_dirs = 0
+
+    def iter_files(self, directory: Optional[str] = None) -> Iterator[Tuple[str, os.stat_result]]:
+        """
+        Yields (file_path, stat_result) for every file that is not ignored,
+        in the root directory (or in `directory`, which must be inside it).
+        """
+        start = directory or self.root
+        if not os.path.isdir(start):
+            # If the watch directory does not exist or is not a directory,
+            # just return an empty iterator
+            return
+        rel_start = "" if start == self.root else os.path.relpath(start, self.root).replace(os.sep, "/")
+        scan_started_ns = time.time_ns()
+
+        pending = [(start, rel_start)]
+        while pending:
+            path, rel_path = pending.pop()
+
+            if self.dir_cache is not None:
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                except OSError as e:
+                    logger.warning("Skipping directory (cannot stat): %s (%s)", path, e)
+                    continue
+                cached = self.dir_cache.get(path)
+                if cached is not None and cached.mtime_ns == mtime_ns:
+                    self.skipped_dirs += 1
+                    for name in cached.subdirs:
+                        pending.append((os.path.join(path, name), self._join(rel_path, name)))
+                    continue
+
+            subdirs = []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        rel_entry = self._join(rel_path, entry.name)
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self.recursive and not (self.rules and self.rules.ignores_dir(rel_entry)):
+                                    subdirs.append(entry.name)
+                                    pending.append((entry.path, rel_entry))
+                            elif entry.is_file():
+                                if self.rules and self.rules.ignores_file(rel_entry):
+                                    continue
+                                # Yield each file one-by-one instead of building a full list in memory
+                                yield entry.path, entry.stat()
+                        except OSError as e:
+                            # The entry was removed while we were listing the directory
+                            logger.warning("Skipping file (cannot stat): %s (%s)", entry.path, e)
+            except OSError as e:
+                logger.warning("Skipping directory (cannot list): %s (%s)", path, e)
+                continue
+
+            if self.dir_cache is not None and mtime_ns < scan_started_ns - _RACY_MTIME_NS:
+                self.listed[path] = ScannedDir(mtime_ns, subdirs)
+
+    @staticmethod
+    def _join(rel_path: str, name: str) -> str:
+        return f"{rel_path}/{name}" if rel_path else name
@@ -0,0 +1,218 @@
+"""
+Work shared by all watch roots of one client process.
+
+Every watch root has its own DirectoryWatcher, but hashing and uploading
+run on one shared pool of threads each (FairExecutor), so the number of
+concurrent disk reads / uploads doesn't grow with the number of roots.
+Waiting work is started in weighted-fair order: a root with a few small
+files is served right away even while another root has a bulk import
+queued. All uploads also share one bandwidth limit (TokenBucket).
+"""
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional
+
+from .metrics import THROTTLED_SECONDS
+
+# Cost (in bytes) added to every task, so empty / tiny files still count
+TASK_OVERHEAD = 64 * 1024
+
+
+class TokenBucket:
+    """
+    Limits how many bytes per second all threads together may send.
+
+    Tokens (bytes) refill at `rate` per second up to `burst`. A thread that
+    takes more than there is goes into debt and sleeps until the debt is
+    paid back, so the long-run rate never exceeds `rate` no matter how many
+    threads share the bucket. Safe to use from several threads.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        """
+        :param rate: bytes per second
+        :param burst: max bytes that may be sent at once after an idle
+            period (default: one second worth of `rate`)
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else self.rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> float:
+        """
+        Take `amount` bytes, sleeping if the limit is reached.
+
+        :return: seconds slept
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+            THROTTLED_SECONDS.inc(wait)
+        return wait
+
+
+class ThrottledReader:
+    """
+    File-like request body that takes tokens from a TokenBucket for every
+    block read. It has a length, so requests still sends Content-Length
+    (and http.client reads it block by block).
+    """
+
+    def __init__(self, stream: BinaryIO, bucket: TokenBucket, length: int) -> None:
+        self.stream = stream
+        self.bucket = bucket
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        if data:
+            self.bucket.consume(len(data))
+        return data
+
+
+def throttle(chunks: Iterable[bytes], bucket: TokenBucket) -> Iterator[bytes]:
+    # Same as ThrottledReader, for generator bodies (sent with chunked encoding)
+    for chunk in chunks:
+        bucket.consume(len(chunk))
+        yield chunk
+
+
+class FairExecutor:
+    """
+    A thread pool whose waiting tasks belong to queues (watch roots) and are
+    started in weighted-fair order instead of first-come first-served.
+
+    Every task has a cost (bytes) and every queue a weight (its priority).
+    Start-time fair queueing: a task's start tag is the later of the current
+    virtual time and the finish tag of the previous task of its queue; its
+    finish tag is start + cost / weight. The task with the smallest start
+    tag runs next. A queue that has been idle starts at the current virtual
+    time, so it isn't stuck behind the backlog of a busy queue, and over
+    time every busy queue gets bytes in proportion to its weight.
+    """
+
+    def __init__(self, workers: int, name: str = "fair") -> None:
+        """
+        :param workers: number of threads running tasks
+        :param name: prefix of the thread names
+        """
+        self.workers = max(1, workers)
+        self._heap: List[tuple] = []
+        self._weights: Dict[str, float] = {}
+        self._last_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._shutdown = False
+        self._cond = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def set_weight(self, key: str, weight: float) -> None:
+        # Queues without a weight have weight 1
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        with self._cond:
+            self._weights[key] = float(weight)
+
+    def submit(self, key: str, cost: int, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        Run fn(*args, **kwargs) on one of the threads, charged to queue `key`.
+
+        :param cost: size of the work in bytes (e.g. the file size)
+        :return: a Future with the result of fn
+        """
+        future: Future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            start = max(self._virtual_time, self._last_finish.get(key, 0.0))
+            self._last_finish[key] = start + (max(cost, 0) + TASK_OVERHEAD) / self._weights.get(key, 1.0)
+            heapq.heappush(self._heap, (start, next(self._seq), future, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def pending(self) -> int:
+        # Tasks waiting for a thread
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap and not self._shutdown:
+                    self._cond.wait()
+                if not self._heap:
+                    return
+                start, _, future, fn, args, kwargs = heapq.heappop(self._heap)
+                self._virtual_time = max(self._virtual_time, start)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait: bool = True) -> None:
+        # Waiting tasks still run; new ones are refused
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+class Scheduler:
+    """
+    The hashing pool, the upload pool and the bandwidth limit shared by the
+    watchers of all watch roots (see DirectoryWatcher / Uploader `scheduler`).
+    """
+
+    def __init__(
+        self,
+        hash_workers: int = 1,
+        upload_workers: int = 8,
+        bandwidth_limit: Optional[float] = None,
+        burst: Optional[float] = None,
+    ) -> None:
+        """
+        :param hash_workers: files hashed at the same time, over all roots
+        :param upload_workers: uploads running at the same time, over all roots
+        :param bandwidth_limit: max upload bytes per second, over all roots
+            (None = no limit)
+        :param burst: see TokenBucket
+        """
+        self.hashing = FairExecutor(hash_workers, "hash")
+        self.uploads = FairExecutor(upload_workers, "upload")
+        self.bandwidth = TokenBucket(bandwidth_limit, burst) if bandwidth_limit else None
+
+    def add_root(self, root: str, priority: float = 1) -> None:
+        # A root with priority 4 gets 4x the share of a root with priority 1
+        # when both have work waiting
+        self.hashing.set_weight(root, priority)
+        self.uploads.set_weight(root, priority)
+
+    def shutdown(self) -> None:
+        self.hashing.shutdown()
+        self.uploads.shutdown()
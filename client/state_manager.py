@@ -1,63 +1,253 @@
 import os
 import json
-from typing import Any, Dict
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 # Path to the state directory and file.
 # According to Linux conventions, state (user data) should be under:  ~/.local/share/<app_name>
 STATE_DIR = os.path.join(os.path.expanduser("~"), ".local", "share", "asset_client")
-STATE_FILE = os.path.join(STATE_DIR, "state.json")
+# Older versions kept the whole state in state.json next to it;
+# that file is imported into the database automatically on first start.
+STATE_FILE = os.path.join(STATE_DIR, "state.db")
+
+_SQLITE_HEADER = b"SQLite format 3\0"
+
+# A cheap "did this file change?" signature: [size, mtime_ns, inode, device]
+Fingerprint = List[int]
+
+
+def make_fingerprint(st: os.stat_result) -> Fingerprint:
+    """
+    Build a fingerprint from a stat result.
+
+    If any of these values differ from the last upload, the file content
+    may have changed and has to be hashed again.
+    """
+    return [st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev]
+
+
+def _fingerprint_to_text(fingerprint: Optional[Fingerprint]) -> Optional[str]:
+    # Stored as text: inode numbers may not fit in a signed 64-bit SQLite INTEGER
+    if fingerprint is None:
+        return None
+    return ":".join(str(value) for value in fingerprint)
 
 
 class StateManager:
     """
     Manages the client state between runs.
     Responsibilities:
-    - Ensure a state file exists
-    - Load state from disk on startup
-    - Save state back to disk after changes
+    - Ensure a state database exists (SQLite in WAL mode)
+    - Migrate the old state.json file into it
     - Track which files have already been uploaded
+
+    Every change is a small transaction, so the cost of an upload does not
+    depend on how many files are tracked, and a crash can never leave a
+    half-written state behind.
+
+    Write-behind mode (flush_every > 1 or flush_interval_ms set):
+    marks are kept in memory and written in one transaction after
+    `flush_every` marks, after `flush_interval_ms` milliseconds, or when
+    flush()/close() is called. If the client crashes, at most the marks of
+    the last unflushed batch are lost; those files are hashed and uploaded
+    again on the next start and the server dedups them by hash.
     """
 
-    def __init__(self, state_path: str = STATE_FILE) -> None:
+    def __init__(
+        self,
+        state_path: str = STATE_FILE,
+        legacy_path: Optional[str] = None,
+        flush_every: int = 1,
+        flush_interval_ms: Optional[int] = None,
+    ) -> None:
+        """
+        :param state_path: path of the SQLite state database
+        :param legacy_path: old JSON state file to import (by default the
+            file next to state_path with a .json extension)
+        :param flush_every: write buffered marks once this many are pending
+            (1 = write every mark immediately)
+        :param flush_interval_ms: write buffered marks once the oldest one
+            is this old (None = no time limit)
+        """
         self.state_path = state_path
-        # This dictionary will hold all state data in memory
-        self.state: Dict[str, Any] = {}
+        if legacy_path is None:
+            legacy_path = os.path.splitext(state_path)[0] + ".json"
+        self.legacy_path = legacy_path
+        self.flush_every = max(1, flush_every)
+        self.flush_interval_ms = flush_interval_ms
+        # Marks not written yet: file_path -> (file_hash, fingerprint text)
+        self._pending: Dict[str, Tuple[str, Optional[str]]] = {}
+        self._pending_since: Optional[float] = None
+        # The watcher hashes/uploads on several threads at once
+        self._lock = threading.RLock()
         self._load_or_create_default()
 
     def _load_or_create_default(self) -> None:
-        #Loads the state file if it exists.
-        #If it does not exist — creates the directory and a default state file.
+        #Opens the state database.
+        #If it does not exist — creates the directory and an empty database.
 
         # Make sure the state directory exists
-        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
-
-        if not os.path.exists(self.state_path):
-            # Default empty state
-            self.state = {
-                # Mapping: file_path (str) -> file_hash (str)
-                "uploaded_files": {}
-            }
-            self._save()
-        else:
-            # Load existing state
-            with open(self.state_path, "r", encoding="utf-8") as f:
-                self.state = json.load(f)
-
-    def _save(self) -> None:
-        #Writes the current state to state.json.
-        with open(self.state_path, "w", encoding="utf-8") as f:
-            json.dump(self.state, f, indent=2, ensure_ascii=False)
-
-    def mark_uploaded(self, file_path: str, file_hash: str) -> None:
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+
+        # Old JSON state at the database path itself: move it out of the way first
+        legacy_entries = None
+        if self._is_legacy_json(self.state_path):
+            os.replace(self.state_path, self.state_path + ".migrated")
+            legacy_entries = self._read_legacy_json(self.state_path + ".migrated")
+
+        self._conn = sqlite3.connect(self.state_path, check_same_thread=False, isolation_level=None)
+        # WAL: readers don't block the writer and a commit only appends to the log
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploaded_files (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                fingerprint TEXT
+            ) WITHOUT ROWID
+            """
+        )
+        # Resumable uploads in progress: file_path -> server upload id
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                upload_id TEXT NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+
+        # Directories listed by the last scan (see Scanner): path -> mtime and
+        # sub-directories, for the ignore rules / recursion of `signature`
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scanned_dirs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                subdirs TEXT NOT NULL,
+                signature TEXT NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+
+        # Old JSON state next to the database: import it, then rename it
+        if legacy_entries is None and self._is_legacy_json(self.legacy_path):
+            legacy_entries = self._read_legacy_json(self.legacy_path)
+            self.mark_uploaded_many(legacy_entries)
+            os.replace(self.legacy_path, self.legacy_path + ".migrated")
+        elif legacy_entries is not None:
+            self.mark_uploaded_many(legacy_entries)
+
+        if legacy_entries is not None:
+            logger.info("[STATE] Imported %s entries from the old JSON state file", len(legacy_entries))
+
+    @staticmethod
+    def _is_legacy_json(path: str) -> bool:
+        # An empty file (e.g. a crash while the database was being created)
+        # is opened by SQLite as a new database
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return False
+        with open(path, "rb") as f:
+            return f.read(len(_SQLITE_HEADER)) != _SQLITE_HEADER
+
+    @staticmethod
+    def _read_legacy_json(path: str) -> List[Tuple[str, str, Optional[Fingerprint]]]:
+        with open(path, "r", encoding="utf-8") as f:
+            old_state = json.load(f)
+
+        fingerprints = old_state.get("file_fingerprints", {})
+        return [
+            (file_path, file_hash, fingerprints.get(file_path))
+            for file_path, file_hash in old_state.get("uploaded_files", {}).items()
+        ]
+
+    def mark_uploaded(
+        self,
+        file_path: str,
+        file_hash: str,
+        fingerprint: Optional[Fingerprint] = None,
+    ) -> None:
         """
         Marks a file as uploaded by storing its hash in the state.
 
         :param file_path: full path to the file
         :param file_hash: hash of the file content (e.g. sha256 string)
+        :param fingerprint: stat fingerprint taken before the file was hashed
+            (None means the next scan has to hash the file again)
+        """
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending[file_path] = (file_hash, _fingerprint_to_text(fingerprint))
+            self.flush_if_due()
+
+    def flush_if_due(self) -> None:
+        # Writes the buffered marks if there are enough of them, or they are old enough
+        with self._lock:
+            if not self._pending:
+                return
+            if len(self._pending) >= self.flush_every:
+                self.flush()
+            elif self.flush_interval_ms is not None:
+                age_ms = (time.monotonic() - self._pending_since) * 1000
+                if age_ms >= self.flush_interval_ms:
+                    self.flush()
+
+    def flush(self) -> None:
+        # Writes all buffered marks to the database in one transaction
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [(path, h, fp) for path, (h, fp) in self._pending.items()]
+            self._write_rows(rows)
+            self._pending.clear()
+            self._pending_since = None
+
+    def mark_uploaded_many(self, entries: Iterable[Tuple[str, str, Optional[Fingerprint]]]) -> None:
         """
-        self.state.setdefault("uploaded_files", {})
-        self.state["uploaded_files"][file_path] = file_hash
-        self._save()
+        Marks many files as uploaded in one atomic transaction
+        (written immediately, regardless of the write-behind settings).
+
+        :param entries: (file_path, file_hash, fingerprint) tuples
+        """
+        rows = [
+            (file_path, file_hash, _fingerprint_to_text(fingerprint))
+            for file_path, file_hash, fingerprint in entries
+        ]
+        with self._lock:
+            self._write_rows(rows)
+            # The new values replace any older buffered ones
+            for file_path, _, _ in rows:
+                self._pending.pop(file_path, None)
+
+    def _write_rows(self, rows: List[Tuple[str, str, Optional[str]]]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO uploaded_files (path, hash, fingerprint) VALUES (?, ?, ?)",
+                    rows,
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _get_row(self, file_path: str) -> Optional[Tuple[str, Optional[str]]]:
+        with self._lock:
+            pending = self._pending.get(file_path)
+            if pending is not None:
+                return pending
+            return self._conn.execute(
+                "SELECT hash, fingerprint FROM uploaded_files WHERE path = ?", (file_path,)
+            ).fetchone()
 
     def is_uploaded(self, file_path: str, file_hash: str) -> bool:
         """
@@ -67,11 +257,88 @@ class StateManager:
         - same path
         - same hash (content)
         """
-        uploaded_files = self.state.get("uploaded_files", {})
-        saved_hash = uploaded_files.get(file_path)
-        return saved_hash == file_hash
+        row = self._get_row(file_path)
+        return row is not None and row[0] == file_hash
+
+    def is_unchanged(self, file_path: str, fingerprint: Fingerprint) -> bool:
+        """
+        Checks if a file was already uploaded and its stat fingerprint
+        did not change since then, so there is no need to hash it again.
+        """
+        row = self._get_row(file_path)
+        return row is not None and row[1] is not None and row[1] == _fingerprint_to_text(fingerprint)
 
     def get_uploaded_files(self) -> Dict[str, str]:
         #Returns the dictionary of uploaded files: { file_path: file_hash }
+        with self._lock:
+            files = dict(self._conn.execute("SELECT path, hash FROM uploaded_files"))
+            files.update((path, h) for path, (h, _) in self._pending.items())
+            return files
+
+    def get_upload_session(self, file_path: str, file_hash: str) -> Optional[str]:
+        """
+        Returns the id of an unfinished resumable upload of this exact
+        content, or None if there is none.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash, upload_id FROM upload_sessions WHERE path = ?", (file_path,)
+            ).fetchone()
+        if row is None or row[0] != file_hash:
+            return None
+        return row[1]
+
+    def save_upload_session(self, file_path: str, file_hash: str, upload_id: str) -> None:
+        # Remembers a resumable upload so it can continue after a restart
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO upload_sessions (path, hash, upload_id) VALUES (?, ?, ?)",
+                (file_path, file_hash, upload_id),
+            )
+
+    def clear_upload_session(self, file_path: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM upload_sessions WHERE path = ?", (file_path,))
+
+    def get_scanned_dirs(self, signature: str) -> Dict[str, Tuple[int, List[str]]]:
+        # Returns {directory: (mtime_ns, sub-directory names)} saved with this signature
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, mtime_ns, subdirs FROM scanned_dirs WHERE signature = ?", (signature,)
+            ).fetchall()
+        return {path: (mtime_ns, json.loads(subdirs)) for path, mtime_ns, subdirs in rows}
+
+    def save_scanned_dirs(
+        self,
+        signature: str,
+        dirs: Dict[str, Tuple[int, List[str]]],
+        forget: Iterable[str] = (),
+    ) -> None:
+        """
+        Saves the directories listed by a scan in one transaction.
+
+        :param signature: ignore rules / recursion the directories were listed with
+        :param dirs: {directory: (mtime_ns, sub-directory names)}
+        :param forget: directories that must be listed again next time
+            (e.g. a file in them failed to upload)
+        """
+        rows = [(path, mtime_ns, json.dumps(subdirs), signature) for path, (mtime_ns, subdirs) in dirs.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("DELETE FROM scanned_dirs WHERE path = ?", [(path,) for path in forget])
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO scanned_dirs (path, mtime_ns, subdirs, signature) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
 
-        return self.state.get("uploaded_files", {}).copy()
+    def close(self) -> None:
+        # Writes buffered marks and closes the database
+        # (the WAL is checkpointed into the main file)
+        with self._lock:
+            self.flush()
+            self._conn.close()
@@ -1,13 +1,385 @@
+import json
+import logging
+import mimetypes
 import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import quote
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from .compression import choose_encoding, compress_bytes, is_compressible, iter_compressed
+from .hash_utils import DEFAULT_ALGORITHM, SUPPORTED_ALGORITHMS, chunk_file
+from .metrics import BYTES_SENT_COMPRESSED, BYTES_UPLOADED, UPLOAD_SECONDS, UPLOADS
+from .scheduler import Scheduler, ThrottledReader, throttle
+from .state_manager import StateManager
+
+logger = logging.getLogger(__name__)
+
+# Max number of hashes sent in one /exists request (the server's limit)
+EXISTS_BATCH_SIZE = 1000
+
+# (connect, read) timeouts of an upload; the read timeout is per socket read,
+# not for the whole transfer, so big files don't time out
+UPLOAD_TIMEOUT = (10, 60)
+
+# Files at least this big are sent in chunks through a resumable upload session
+RESUMABLE_THRESHOLD = 64 * 1024 * 1024
+
+# Max number of chunk hashes sent in one /chunks/missing request
+MISSING_CHUNKS_BATCH_SIZE = 1000
+
+# The server verifies big resumable / chunked uploads in the background
+# (complete / manifest answer 202): how often (seconds) and for how long the
+# client asks for the result
+COMPLETE_POLL_INTERVAL = 2.0
+COMPLETE_POLL_TIMEOUT = 3600.0
+
+# Default number of uploads running at the same time (and of pooled connections)
+MAX_IN_FLIGHT = 8
+
+# Small files are packed into batch requests (POST /upload/batch):
+# files up to BATCH_FILE_SIZE bytes, at most BATCH_MAX_FILES files and
+# BATCH_MAX_BYTES bytes per request
+BATCH_FILE_SIZE = 256 * 1024
+BATCH_MAX_FILES = 200
+BATCH_MAX_BYTES = 8 * 1024 * 1024
+
+# Length prefix of every record header in a batch body
+BATCH_HEADER_LENGTH = struct.Struct(">I")
+
+
+class UploadResult(NamedTuple):
+    # Outcome of one file of Uploader.upload_many
+    file_path: str
+    file_hash: str
+    success: bool
 
 
 class Uploader:
     #Responsible for sending files to the remote server over HTTP.
 
-    def __init__(self, server_url: str) -> None:
+    def __init__(
+        self,
+        server_url: str,
+        hash_algorithm: str = DEFAULT_ALGORITHM,
+        state_manager: Optional[StateManager] = None,
+        resumable_threshold: int = RESUMABLE_THRESHOLD,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        pool_size: Optional[int] = None,
+        batch_file_size: int = BATCH_FILE_SIZE,
+        batch_max_files: int = BATCH_MAX_FILES,
+        batch_max_bytes: int = BATCH_MAX_BYTES,
+        chunked_threshold: Optional[int] = None,
+        client_id: Optional[str] = None,
+        compression: bool = True,
+        scheduler: Optional[Scheduler] = None,
+    ) -> None:
+        """
+        :param server_url: base URL of the server
+        :param hash_algorithm: algorithm the file hashes were computed with
+        :param state_manager: where resumable upload sessions are remembered,
+            so they survive a client restart (optional)
+        :param resumable_threshold: files at least this big use resumable uploads
+        :param max_in_flight: max number of uploads running at the same time
+            (shared by all upload_many calls)
+        :param pool_size: number of keep-alive connections kept open to the
+            server (default: max_in_flight)
+        :param batch_file_size: files up to this size are sent in batches
+        :param batch_max_files: max number of files in one batch request
+        :param batch_max_bytes: max total size of one batch request
+        :param chunked_threshold: files at least this big are uploaded as
+            content-defined chunks, so after an edit only the changed chunks
+            are sent (None = off; chunking costs CPU time)
+        :param client_id: sent as X-Client-Id with every request, so the
+            server's catalog records who uploaded each asset
+        :param compression: compress compressible files on the wire, with an
+            encoding the server advertises (see negotiate_hash_algorithm)
+        :param scheduler: if given, uploads run on its shared upload pool
+            (in fair order between watch roots, see upload_many `root`)
+            and are throttled by its bandwidth limit; max_in_flight then
+            only sizes the connection pool
+        """
         # Make sure there is no trailing slash at the end of the URL
         self.server_url = server_url.rstrip("/")
+        # Algorithm the file hashes were computed with (sent with every upload)
+        self.hash_algorithm = hash_algorithm
+        self.state_manager = state_manager
+        self.resumable_threshold = resumable_threshold
+        self.max_in_flight = max(1, max_in_flight)
+        self.batch_file_size = batch_file_size
+        self.batch_max_files = batch_max_files
+        self.batch_max_bytes = batch_max_bytes
+        self.chunked_threshold = chunked_threshold
+        self.compression = compression
+        self.scheduler = scheduler
+        # Content-Encoding of compressed uploads (None = send raw bytes)
+        self.content_encoding: Optional[str] = None
+        # Set to False when the server turns out not to support batches / chunks
+        self.batch_supported = True
+        self.chunked_supported = True
+
+        # One session for all requests: connections are kept alive and reused
+        # instead of a new TCP (and TLS) handshake per file
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size or self.max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if client_id:
+            self.session.headers["X-Client-Id"] = client_id
+
+        # Created on first use by upload_many (unless a scheduler is given)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def negotiate_hash_algorithm(self) -> str:
+        """
+        Ask the server which hash algorithms it accepts and pick one.
+
+        The server lists its algorithms in order of preference, so all clients
+        end up with the same choice and dedup keeps working between them.
+        Old servers without /capabilities only know sha256.
+        The transfer compression (self.content_encoding) is picked from the
+        same answer; old servers get raw bytes.
+
+        :return: the chosen algorithm (also stored in self.hash_algorithm)
+        """
+        url = f"{self.server_url}/capabilities"
+        chosen = DEFAULT_ALGORITHM
+        try:
+            response = self.session.get(url, timeout=10)
+            if response.status_code == 200:
+                capabilities = response.json()
+                for algorithm in capabilities.get("hash_algorithms", []):
+                    if algorithm in SUPPORTED_ALGORITHMS:
+                        chosen = algorithm
+                        break
+                if self.compression:
+                    self.content_encoding = choose_encoding(capabilities.get("compression", []))
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Could not get server capabilities, using %s (%s)", chosen, e)
+
+        self.hash_algorithm = chosen
+        return chosen
+
+    def find_existing(self, file_hashes: Iterable[str]) -> Set[str]:
+        """
+        Ask the server which of these hashes it already stores,
+        so their bytes don't have to be sent at all.
+
+        If the server can't be asked (old server, network error) an empty set
+        is returned and the files are simply uploaded as usual.
+
+        :return: the subset of file_hashes already stored on the server
+        """
+        url = f"{self.server_url}/exists"
+        hashes = list(dict.fromkeys(file_hashes))
+        existing: Set[str] = set()
+
+        for start in range(0, len(hashes), EXISTS_BATCH_SIZE):
+            batch = hashes[start:start + EXISTS_BATCH_SIZE]
+            try:
+                response = self.session.post(url, json={"hashes": batch}, timeout=10)
+                if response.status_code != 200:
+                    return existing
+                existing.update(response.json().get("existing", []))
+            except (requests.RequestException, ValueError) as e:
+                logger.warning("Could not ask the server for existing hashes (%s)", e)
+                return existing
+        return existing
+
+    def upload_many(
+        self,
+        items: Iterable[Tuple[str, str]],
+        on_result: Optional[Callable[[UploadResult], None]] = None,
+        root: Optional[str] = None,
+    ) -> List[UploadResult]:
+        """
+        Upload many files concurrently (at most max_in_flight requests at a
+        time, also across several threads calling upload_many).
+        Small files are packed into batch requests (see upload_batch).
+
+        :param items: (file_path, file_hash) pairs
+        :param on_result: called with each UploadResult as soon as that file
+            is done (on the calling thread)
+        :param root: watch root the uploads are charged to in the
+            scheduler's fair sharing (only used with a scheduler)
+        :return: the results in completion order
+        """
+        if self.scheduler is None and self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="upload")
+
+        # Every task returns a list of results: one file, or one batch of small files
+        futures = {}
+        for group, size in self._group_small_files(items):
+            func, args = (self._upload_one, group[0]) if len(group) == 1 else (self.upload_batch, (group,))
+            if self.scheduler is not None:
+                future = self.scheduler.uploads.submit(root or "", size, func, *args)
+            else:
+                future = self._executor.submit(func, *args)
+            futures[future] = group
+
+        results = []
+        for future in as_completed(futures):
+            try:
+                group_results = future.result()
+            except Exception as e:
+                logger.error("Upload of %s file(s) crashed: %s", len(futures[future]), e)
+                group_results = [UploadResult(path, h, False) for path, h in futures[future]]
+            for result in group_results:
+                UPLOADS.inc(result="ok" if result.success else "failed")
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+        return results
+
+    def _upload_one(self, file_path: str, file_hash: str) -> List[UploadResult]:
+        with UPLOAD_SECONDS.time(kind="file"):
+            success = self.upload_file(file_path, file_hash)
+        if success:
+            try:
+                BYTES_UPLOADED.inc(os.path.getsize(file_path))
+            except OSError:
+                pass
+        return [UploadResult(file_path, file_hash, success)]
+
+    def _group_small_files(self, items: Iterable[Tuple[str, str]]) -> List[Tuple[List[Tuple[str, str]], int]]:
+        """
+        Split items into groups: every file bigger than batch_file_size is a
+        group of its own, small files are packed together (up to
+        batch_max_files files / batch_max_bytes bytes per group).
+        Returns (group, total size in bytes) pairs.
+        """
+        groups: List[Tuple[List[Tuple[str, str]], int]] = []
+        batch: List[Tuple[str, str]] = []
+        batch_bytes = 0
+        for file_path, file_hash in items:
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                size = None  # upload_file reports the error
+            if not self.batch_supported or size is None or size > self.batch_file_size:
+                groups.append(([(file_path, file_hash)], size or 0))
+                continue
+            if batch and (len(batch) >= self.batch_max_files or batch_bytes + size > self.batch_max_bytes):
+                groups.append((batch, batch_bytes))
+                batch, batch_bytes = [], 0
+            batch.append((file_path, file_hash))
+            batch_bytes += size
+        if batch:
+            groups.append((batch, batch_bytes))
+        return groups
+
+    def _throttle(self, size: int) -> None:
+        # Wait until `size` bytes may be sent under the shared bandwidth limit
+        if self.scheduler is not None and self.scheduler.bandwidth is not None:
+            self.scheduler.bandwidth.consume(size)
+
+    def upload_batch(self, items: List[Tuple[str, str]]) -> List[UploadResult]:
+        """
+        Upload many small files in one request (POST /upload/batch).
+
+        Each file becomes one record of the body:
+        [4-byte big-endian header length][JSON header][content].
+        If the server doesn't support batches, the files are uploaded one by one;
+        a batch bigger than the server accepts (413) is sent in halves.
+
+        :param items: (file_path, file_hash) pairs of small files
+        :return: one UploadResult per item
+        """
+        # Failed until the server says otherwise
+        results = [UploadResult(file_path, file_hash, False) for file_path, file_hash in items]
+        records = []
+        sent = []  # indexes into items of the files in the request body
+        sizes = {}
+        compressible = False
+        for index, (file_path, file_hash) in enumerate(items):
+            try:
+                with open(file_path, "rb") as f:
+                    content = f.read()
+            except OSError as e:
+                logger.error("Could not open file for upload: %s (%s)", file_path, e)
+                continue
+            header = json.dumps({
+                "hash": file_hash,
+                "hash_algorithm": self.hash_algorithm,
+                "name": os.path.basename(file_path),
+                "size": len(content),
+                "content_type": mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+            }).encode("utf-8")
+            records += [BATCH_HEADER_LENGTH.pack(len(header)), header, content]
+            sent.append(index)
+            sizes[index] = len(content)
+            compressible = compressible or is_compressible(file_path, len(content))
+
+        response = None
+        if sent:
+            body = b"".join(records)
+            headers = {"Content-Type": "application/x-asset-batch"}
+            encoding = self.content_encoding if compressible else None
+            if encoding:
+                compressed = compress_bytes(body, encoding)
+                if len(compressed) < len(body):
+                    BYTES_SENT_COMPRESSED.inc(len(body), stage="in")
+                    BYTES_SENT_COMPRESSED.inc(len(compressed), stage="out")
+                    body = compressed
+                    headers["Content-Encoding"] = encoding
+            try:
+                self._throttle(len(body))
+                with UPLOAD_SECONDS.time(kind="batch"):
+                    response = self.session.post(
+                        f"{self.server_url}/upload/batch",
+                        data=body,
+                        headers=headers,
+                        timeout=UPLOAD_TIMEOUT,
+                    )
+            except requests.RequestException as e:
+                logger.error("HTTP request failed for a batch of %s files: %s", len(sent), e)
+
+        if response is not None and response.status_code == 415 and "Content-Encoding" in headers:
+            # The server no longer accepts this encoding: send raw bytes from now on
+            logger.warning("Server refused %s compression, sending uncompressed", headers["Content-Encoding"])
+            self.content_encoding = None
+            return self.upload_batch(items)
+
+        if response is not None and response.status_code in (404, 405):
+            # Old server without batch uploads
+            self.batch_supported = False
+            return [UploadResult(path, h, self.upload_file(path, h)) for path, h in items]
+
+        if response is not None and response.status_code == 413:
+            # Bigger than this server accepts in one batch: send it in halves
+            # (a single file on its own)
+            logger.warning("Batch of %d files too big for the server, splitting it", len(items))
+            if len(items) == 1:
+                return [UploadResult(path, h, self.upload_file(path, h)) for path, h in items]
+            half = len(items) // 2
+            return self.upload_batch(items[:half]) + self.upload_batch(items[half:])
+
+        statuses: List[dict] = []
+        if response is not None and response.status_code == 200:
+            statuses = response.json().get("results", [])
+        elif response is not None:
+            logger.error("Batch upload failed: %s %s", response.status_code, response.text)
+
+        for index, status in zip(sent, statuses):
+            file_path, file_hash = items[index]
+            if status.get("status") in ("ok", "already_exists"):
+                logger.info("[UPLOADED] %s (batch)", file_path)
+                BYTES_UPLOADED.inc(sizes[index])
+                results[index] = UploadResult(file_path, file_hash, True)
+            else:
+                logger.error("Upload failed for %s: %s", file_path, status.get('status'))
+        return results
+
+    def close(self) -> None:
+        # Stops the upload threads and closes the pooled connections
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
 
     def upload_file(self, file_path: str, file_hash: str) -> bool:
         """
@@ -17,29 +389,295 @@ class Uploader:
         :param file_hash: hash of the file content (sha256 string)
         :return: True if upload succeeded, False otherwise
         """
-        url = f"{self.server_url}/upload"
-
         try:
-            with open(file_path, "rb") as f:
-                files = {
-                    # field name "file" must match what the server expects
-                    "file": (os.path.basename(file_path), f)
-                }
-                data = {
-                    # field name "hash" must match what the server expects
-                    "hash": file_hash
-                }
-                response = requests.post(url, files=files, data=data, timeout=10)
+            file_size = os.path.getsize(file_path)
         except OSError as e:
-            print(f"[ERROR] Could not open file for upload: {file_path} ({e})")
+            logger.error("Could not open file for upload: %s (%s)", file_path, e)
             return False
+        if (
+            self.chunked_threshold is not None
+            and self.chunked_supported
+            and file_size >= self.chunked_threshold
+        ):
+            result = self.upload_file_chunked(file_path, file_hash)
+            if result is not None:
+                return result
+        if file_size >= self.resumable_threshold:
+            return self.upload_file_resumable(file_path, file_hash, file_size)
+
+        url = f"{self.server_url}/assets/{file_hash}"
+        headers = {
+            # header values must be ASCII, so the name is percent-encoded
+            "X-File-Name": quote(os.path.basename(file_path)),
+            "X-Hash-Algorithm": self.hash_algorithm,
+            "Content-Type": mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+        }
+
+        encoding = self.content_encoding if is_compressible(file_path, file_size) else None
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        stats: dict = {}
+
+        try:
+            with open(file_path, "rb") as f:
+                # Passing the file object (or the generator compressing it)
+                # streams it: the file is never fully in memory
+                body = iter_compressed(f, encoding, stats) if encoding else f
+                bandwidth = self.scheduler.bandwidth if self.scheduler is not None else None
+                if bandwidth is not None:
+                    body = throttle(body, bandwidth) if encoding else ThrottledReader(f, bandwidth, file_size)
+                response = self.session.put(url, data=body, headers=headers, timeout=UPLOAD_TIMEOUT)
         except requests.RequestException as e:
-            print(f"[ERROR] HTTP request failed for {file_path}: {e}")
+            # (checked first: RequestException is also an OSError)
+            logger.error("HTTP request failed for %s: %s", file_path, e)
+            return False
+        except OSError as e:
+            logger.error("Could not open file for upload: %s (%s)", file_path, e)
             return False
 
+        if stats:
+            BYTES_SENT_COMPRESSED.inc(stats["in"], stage="in")
+            BYTES_SENT_COMPRESSED.inc(stats["out"], stage="out")
+        if response.status_code == 415 and encoding:
+            # The server no longer accepts this encoding: send raw bytes from now on
+            logger.warning("Server refused %s compression, sending uncompressed", encoding)
+            self.content_encoding = None
+            return self.upload_file(file_path, file_hash)
         if response.status_code == 200:
-            print(f"[UPLOADED] {file_path}")
+            logger.info("[UPLOADED] %s", file_path)
+            return True
+        elif response.status_code == 202:
+            # Async ingest: the server has the content and stores it in the background
+            logger.info("[UPLOADED] %s (queued as job %s)", file_path, response.json().get("job_id"))
             return True
         else:
-            print(f"[ERROR] Upload failed for {file_path}: {response.status_code} {response.text}")
+            logger.error("Upload failed for %s: %s %s", file_path, response.status_code, response.text)
+            return False
+
+    def upload_file_chunked(self, file_path: str, file_hash: str) -> Optional[bool]:
+        """
+        Upload a file as content-defined chunks, sending only the chunks
+        the server doesn't have yet (e.g. all but the edited part of a file
+        that was uploaded before).
+
+        :return: True / False like upload_file, or None if the server has
+            no chunk support (the caller falls back to a normal upload)
+        """
+        try:
+            chunked_hash, chunks = chunk_file(file_path, self.hash_algorithm)
+        except OSError as e:
+            logger.error("Could not read file for upload: %s (%s)", file_path, e)
+            return False
+        if chunked_hash != file_hash:
+            # Changed since it was hashed; the next scan picks up the new content
+            logger.debug("[SKIP] %s changed while uploading", file_path)
+            return False
+
+        try:
+            missing: Set[str] = set()
+            unique_hashes = list(dict.fromkeys(chunk.hash for chunk in chunks))
+            for start in range(0, len(unique_hashes), MISSING_CHUNKS_BATCH_SIZE):
+                response = self.session.post(
+                    f"{self.server_url}/chunks/missing",
+                    json={"hashes": unique_hashes[start:start + MISSING_CHUNKS_BATCH_SIZE]},
+                    timeout=30,
+                )
+                if response.status_code in (404, 405):
+                    logger.info("Server has no chunked uploads, sending whole files")
+                    self.chunked_supported = False
+                    return None
+                response.raise_for_status()
+                missing.update(response.json()["missing"])
+
+            sent = 0
+            with open(file_path, "rb") as f:
+                for chunk in chunks:
+                    if chunk.hash not in missing:
+                        continue
+                    f.seek(chunk.offset)
+                    self._throttle(chunk.size)
+                    response = self.session.put(
+                        f"{self.server_url}/chunks/{chunk.hash}",
+                        data=f.read(chunk.size),
+                        headers={"X-Hash-Algorithm": self.hash_algorithm},
+                        timeout=UPLOAD_TIMEOUT,
+                    )
+                    if response.status_code != 200:
+                        logger.error("Chunk of %s failed: %s %s", file_path, response.status_code, response.text)
+                        return False
+                    # The same chunk may appear several times in one file
+                    missing.discard(chunk.hash)
+                    sent += chunk.size
+
+            response = self.session.post(
+                f"{self.server_url}/manifests",
+                json={
+                    "hash": file_hash,
+                    "hash_algorithm": self.hash_algorithm,
+                    "filename": os.path.basename(file_path),
+                    "size": sum(chunk.size for chunk in chunks),
+                    "chunks": [[chunk.hash, chunk.size] for chunk in chunks],
+                },
+                timeout=UPLOAD_TIMEOUT,
+            )
+            status = response.status_code
+            if status == 202:
+                status = self._wait_for_manifest(file_hash)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.error("HTTP request failed for %s: %s", file_path, e)
+            return False
+        except OSError as e:
+            logger.error("Could not read file for upload: %s (%s)", file_path, e)
+            return False
+
+        if status == 200:
+            logger.info("[UPLOADED] %s (chunked, sent %s bytes in %s chunks)", file_path, sent, len(chunks))
+            return True
+        logger.error("Upload failed for %s: %s", file_path, status)
+        return False
+
+    def _wait_for_manifest(self, file_hash: str) -> int:
+        """
+        Poll a manifest the server is still verifying.
+
+        :return: 200 if the asset was accepted, 400 if it was rejected,
+            another status if it failed (try again later)
+        """
+        deadline = time.monotonic() + COMPLETE_POLL_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(COMPLETE_POLL_INTERVAL)
+            response = self.session.get(f"{self.server_url}/manifests/{file_hash}", timeout=10)
+            if response.status_code != 200:
+                return response.status_code
+            status = response.json()["status"]
+            if status == "ok":
+                return 200
+            if status == "hash_mismatch":
+                return 400
+            if status != "verifying":
+                return 500
+        return 504
+
+    def upload_file_resumable(self, file_path: str, file_hash: str, file_size: int) -> bool:
+        """
+        Upload a big file chunk by chunk through an upload session.
+
+        The session id is kept in the state database, so if the upload is
+        interrupted (network error, client restart) the next attempt only
+        sends the chunks the server hasn't acknowledged yet.
+
+        :return: True if the server has the complete file, False otherwise
+        """
+        try:
+            session = self._resume_or_start_session(file_path, file_hash, file_size)
+            if session is None:
+                return False
+            if session.get("status") == "already_exists":
+                logger.info("[UPLOADED] %s (already on the server)", file_path)
+                return True
+
+            upload_id = session["upload_id"]
+            chunk_size = session["chunk_size"]
+            received = set(session["received"])
+            chunk_count = (file_size + chunk_size - 1) // chunk_size
+
+            with open(file_path, "rb") as f:
+                for index in range(chunk_count):
+                    if index in received:
+                        continue
+                    f.seek(index * chunk_size)
+                    data = f.read(chunk_size)
+                    self._throttle(len(data))
+                    response = self.session.put(
+                        f"{self.server_url}/uploads/{upload_id}/chunks/{index}",
+                        data=data,
+                        timeout=UPLOAD_TIMEOUT,
+                    )
+                    if response.status_code != 200:
+                        logger.error("Chunk %s of %s failed: %s %s", index, file_path, response.status_code, response.text)
+                        return False
+
+            response = self.session.post(f"{self.server_url}/uploads/{upload_id}/complete", timeout=UPLOAD_TIMEOUT)
+            status = response.status_code
+            if status == 202:
+                status = self._wait_for_completion(upload_id, file_hash)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            # (checked first: RequestException is also an OSError)
+            # The session is kept: the next attempt continues from here
+            logger.error("HTTP request failed for %s: %s", file_path, e)
             return False
+        except OSError as e:
+            logger.error("Could not read file for upload: %s (%s)", file_path, e)
+            return False
+
+        if status == 200:
+            logger.info("[UPLOADED] %s (resumable, %s chunks)", file_path, chunk_count)
+        else:
+            logger.error("Upload failed for %s: %s", file_path, status)
+
+        # Done, or rejected (e.g. the file changed while uploading): either way
+        # this session is over. Other errors (409 missing chunks, 5xx) keep it.
+        if status in (200, 400, 404) and self.state_manager is not None:
+            self.state_manager.clear_upload_session(file_path)
+        return status == 200
+
+    def _wait_for_completion(self, upload_id: str, file_hash: str) -> int:
+        """
+        Poll a session the server is still verifying until it is gone.
+
+        :return: 200 if the asset was accepted, 400 if it was rejected,
+            another status if the session is still open (try again later)
+        """
+        deadline = time.monotonic() + COMPLETE_POLL_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(COMPLETE_POLL_INTERVAL)
+            response = self.session.get(f"{self.server_url}/uploads/{upload_id}", timeout=10)
+            if response.status_code == 404:
+                # Session over: accepted if the asset is there now
+                response = self.session.head(f"{self.server_url}/assets/{file_hash}", timeout=10)
+                return 200 if response.status_code == 200 else 400
+            if response.status_code != 200:
+                return response.status_code
+            if response.json()["status"] == "open":
+                # Verification failed on the server (e.g. storage error): ask again
+                response = self.session.post(
+                    f"{self.server_url}/uploads/{upload_id}/complete", timeout=UPLOAD_TIMEOUT
+                )
+                if response.status_code != 202:
+                    return response.status_code
+        return 504
+
+    def _resume_or_start_session(self, file_path: str, file_hash: str, file_size: int) -> Optional[dict]:
+        # Returns the server's session status (or {"status": "already_exists"})
+        if self.state_manager is not None:
+            upload_id = self.state_manager.get_upload_session(file_path, file_hash)
+            if upload_id is not None:
+                response = self.session.get(f"{self.server_url}/uploads/{upload_id}", timeout=10)
+                if response.status_code == 200:
+                    status = response.json()
+                    logger.info("[RESUME] %s: %s chunks already on the server", file_path, len(status['received']))
+                    return status
+                # Unknown to the server (expired / completed): start over
+                self.state_manager.clear_upload_session(file_path)
+
+        response = self.session.post(
+            f"{self.server_url}/uploads",
+            json={
+                "hash": file_hash,
+                "hash_algorithm": self.hash_algorithm,
+                "filename": os.path.basename(file_path),
+                "size": file_size,
+                "content_type": mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+            },
+            timeout=10,
+        )
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code != 201:
+            logger.error("Could not start upload of %s: %s %s", file_path, response.status_code, response.text)
+            return None
+
+        session = response.json()
+        if self.state_manager is not None:
+            self.state_manager.save_upload_session(file_path, file_hash, session["upload_id"])
+        return session
@@ -1,19 +1,65 @@
+import logging
 import os
-from typing import Iterable, Optional
+import stat
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-from .state_manager import StateManager
-from .hash_utils import calculate_file_hash
-from .uploader import Uploader    
+from .state_manager import StateManager, Fingerprint, make_fingerprint
+from .hash_utils import DEFAULT_ALGORITHM, calculate_file_hash
+from .metrics import BYTES_HASHED, FILES_HASHED, FILES_SCANNED, FILES_SKIPPED, HASH_SECONDS, SCAN_SECONDS
+from .uploader import UploadResult, Uploader
+from .pipeline import Stage, run_pipeline
+from .scheduler import Scheduler
+from .scanner import IgnoreRules, ScannedDir, Scanner
+from .inotify import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_IGNORED,
+    IN_ISDIR,
+    IN_MODIFY,
+    IN_MOVED_TO,
+    IN_ONLYDIR,
+    IN_Q_OVERFLOW,
+    Inotify,
+    inotify_available,
+)
+
+logger = logging.getLogger(__name__)
+
+# Events the watcher subscribes to in event mode
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MODIFY | IN_CREATE | IN_ONLYDIR
+
+# Max time between checks of the stop flag while waiting for events
+_STOP_CHECK_INTERVAL = 1.0
+
+# Event mode: a file whose hash or upload failed is tried again after this
+# many seconds, doubled after every further failure up to the max
+_RETRY_DELAY = 5.0
+_RETRY_MAX_DELAY = 300.0
+
+# Max number of files one upload worker takes from the queue at once
+# (their hashes are checked with the server in a single request)
+_UPLOAD_BATCH_SIZE = 100
+
+# Files smaller than this are uploaded without asking the server first
+_EXISTS_CHECK_MIN_SIZE = 64 * 1024
 
 
 class DirectoryWatcher:
     """
     Watches a directory for files and reports new/changed files.
 
-    - It walks over all files in the watch directory.
-    - For each file, it calculates a hash.
+    - It walks over all files in the watch directory (see Scanner),
+      skipping files and directories matched by the ignore rules.
+    - Files whose stat fingerprint (size, mtime, inode) did not change since
+      the last upload are skipped without reading them.
+    - For every other file, it calculates a hash.
     - It checks with StateManager if this (path, hash) was already uploaded.
     - If not, it calls the handler method for new/changed files.
+
+    scan_once() runs walking, hashing and uploading as a pipeline, so disk
+    reads of one file overlap with the upload of another.
     """
 
     def __init__(
@@ -21,87 +67,421 @@ class DirectoryWatcher:
     watch_directory: str,
     state_manager: StateManager,
     recursive: bool = False,
-    uploader: Optional[Uploader] = None,) -> None:
+    uploader: Optional[Uploader] = None,
+    paranoid_interval: Optional[float] = None,
+    hash_workers: int = 1,
+    upload_workers: int = 1,
+    queue_size: int = 64,
+    hash_algorithm: str = DEFAULT_ALGORITHM,
+    ignore_rules: Optional[IgnoreRules] = None,
+    skip_unchanged_dirs: bool = False,
+    scheduler: Optional[Scheduler] = None,
+    priority: float = 1,) -> None:
         """
         :param watch_directory: directory to scan for files
         :param state_manager: StateManager instance to track uploaded files
         :param recursive: if True, walk sub-directories as well
         :param uploader: Uploader instance used to send files to the server
+        :param paranoid_interval: if set, hash every file again (ignoring the
+            stat fingerprints) once every this many seconds
+        :param hash_workers: number of threads hashing files concurrently
+        :param upload_workers: number of upload batches handled concurrently
+            (files within a batch are uploaded in parallel by the Uploader)
+        :param queue_size: max number of files waiting between two stages
+        :param hash_algorithm: algorithm used for file hashes (see hash_utils)
+        :param ignore_rules: files / directories to skip (None = the defaults,
+            see scanner.DEFAULT_EXCLUDE_PATTERNS)
+        :param skip_unchanged_dirs: don't list directories whose mtime did
+            not change since the last scan (much faster on huge trees, but
+            files edited in place are only noticed by events / paranoid mode)
+        :param scheduler: hashing / upload pools shared with the watchers of
+            other watch roots; this watcher's work is queued there under its
+            watch directory (hash_workers then only bounds how many of its
+            files wait for the shared pool at once)
+        :param priority: this root's weight in the scheduler's fair sharing
         """
         self.watch_directory = watch_directory
         self.state_manager = state_manager
         self.recursive = recursive
         self.uploader = uploader     
+        self.paranoid_interval = paranoid_interval
+        self.hash_workers = hash_workers
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
+        self.hash_algorithm = hash_algorithm
+        self.ignore_rules = ignore_rules if ignore_rules is not None else IgnoreRules()
+        self.skip_unchanged_dirs = skip_unchanged_dirs
+        self.scheduler = scheduler
+        if scheduler is not None:
+            scheduler.add_root(watch_directory, priority)
+        # Directories with a file that failed during the current scan
+        self._failed_dirs: Set[str] = set()
+        # Files that failed since the event loop last looked (to retry them)
+        self._failed_paths: Set[str] = set()
+        self._failed_lock = threading.Lock()
+        self._last_full_rehash: Optional[float] = None
+        self._stop_event = threading.Event()
 
 
-    def _iter_files(self) -> Iterable[str]:
+    def _iter_files(self, directory: Optional[str] = None) -> Iterable[Tuple[str, os.stat_result]]:
         """
-        Iterate over all files in the watch directory.
+        Iterate over all files in the watch directory (or in `directory`)
+        that are not ignored. Yields (file_path, stat_result) pairs.
 
         If recursive is False:
             - Only direct files inside the directory are returned.
         If recursive is True:
             - All files in sub-directories are also returned.
         """
-        if not os.path.isdir(self.watch_directory):
-            # If the watch directory does not exist or is not a directory,
-            # just return an empty iterator
-            return []
-
-        if not self.recursive:
-            # Non-recursive: only files directly in the directory
-            for name in os.listdir(self.watch_directory):
-                full_path = os.path.join(self.watch_directory, name)
-                if os.path.isfile(full_path):
-                    yield full_path
-        else:
-            # Recursive: walk through all sub-directories
-            for root, _, files in os.walk(self.watch_directory):
-                for name in files:
-                    # Yield each file path one-by-one instead of building a full list in memory
-                    yield os.path.join(root, name)
+        scanner = Scanner(self.watch_directory, self.recursive, self.ignore_rules)
+        return scanner.iter_files(directory)
+
+    def _relative_path(self, path: str) -> Optional[str]:
+        # Path relative to the watch directory, as used by the ignore rules
+        rel_path = os.path.relpath(path, self.watch_directory)
+        if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+            return None
+        return rel_path.replace(os.sep, "/")
+
+    def _mark_failed(self, path: str) -> None:
+        # The directory has to be listed again on the next scan
+        with self._failed_lock:
+            self._failed_dirs.add(os.path.dirname(path))
+            self._failed_paths.add(path)
+
+    def _take_failed_paths(self) -> Set[str]:
+        with self._failed_lock:
+            failed, self._failed_paths = self._failed_paths, set()
+        return failed
+
+    def _full_rehash_due(self) -> bool:
+        # Paranoid mode: every paranoid_interval seconds ignore the stat
+        # fingerprints and hash every file again.
+        if self.paranoid_interval is None:
+            return False
+        return (
+            self._last_full_rehash is None
+            or time.monotonic() - self._last_full_rehash >= self.paranoid_interval
+        )
 
     def scan_once(self) -> None:
 
         #Scan the directory and handle new/changed files.
-        print(f"Scanning directory: {self.watch_directory}")
+        logger.debug("Scanning directory: %s", self.watch_directory)
+        scan_started = time.perf_counter()
+        full_rehash = self._full_rehash_due()
+        if full_rehash:
+            self._last_full_rehash = time.monotonic()
+
+        # Every directory is listed in paranoid mode, and its result is cached again
+        signature = f"{self.ignore_rules.signature}:{int(self.recursive)}"
+        dir_cache = None
+        if self.skip_unchanged_dirs:
+            dir_cache = {}
+            if not full_rehash:
+                dir_cache = {
+                    path: ScannedDir(mtime_ns, subdirs)
+                    for path, (mtime_ns, subdirs) in self.state_manager.get_scanned_dirs(signature).items()
+                }
+        scanner = Scanner(self.watch_directory, self.recursive, self.ignore_rules, dir_cache)
+        self._failed_dirs = set()
+
+        # walk (this thread) -> hash workers -> upload workers,
+        # connected by bounded queues so memory stays flat on huge imports
+        run_pipeline(
+            self._iter_candidates(scanner, full_rehash),
+            [
+                Stage("hash", self._hash_stage, self.hash_workers),
+                Stage("upload", self._upload_stage, self.upload_workers, batch_size=_UPLOAD_BATCH_SIZE),
+            ],
+            queue_size=self.queue_size,
+        )
+        # Write-behind state: persist this scan's marks now
+        self.state_manager.flush()
+
+        if self.skip_unchanged_dirs:
+            # Only after the marks: a directory is skipped next time only if
+            # every file in it is known to be uploaded
+            failed = self._failed_dirs
+            self.state_manager.save_scanned_dirs(
+                signature,
+                {path: scanned for path, scanned in scanner.listed.items() if path not in failed},
+                forget=failed,
+            )
+            if scanner.skipped_dirs:
+                logger.debug("Skipped %s unchanged directories", scanner.skipped_dirs)
+        SCAN_SECONDS.observe(time.perf_counter() - scan_started)
+
+    def process_path(self, path: str) -> None:
+        """
+        Handle a single file that was reported by the event backend.
+        Paths that no longer exist or are not regular files are ignored.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            # Removed / renamed away before we got to it
+            return
+        if not stat.S_ISREG(st.st_mode):
+            return
+        rel_path = self._relative_path(path)
+        if rel_path is not None and self.ignore_rules.ignores_path(rel_path):
+            return
+
+        candidate = self._check_fingerprint(path, st, full_rehash=False)
+        if candidate is not None:
+            changed = self._hash_stage(candidate)
+            if changed is not None:
+                self._upload_stage([changed])
+
+    def _iter_candidates(self, scanner: Scanner, full_rehash: bool) -> Iterable[Tuple[str, Fingerprint]]:
+        # Files that have to be hashed: (path, fingerprint)
+        for path, st in scanner.iter_files():
+            FILES_SCANNED.inc()
+            candidate = self._check_fingerprint(path, st, full_rehash)
+            if candidate is not None:
+                yield candidate
+
+    def _check_fingerprint(
+        self, path: str, st: os.stat_result, full_rehash: bool
+    ) -> Optional[Tuple[str, Fingerprint]]:
+        # Take the fingerprint BEFORE hashing, so a file that changes while
+        # it is being hashed will look changed again on the next scan.
+        fingerprint = make_fingerprint(st)
+        if not full_rehash and self.state_manager.is_unchanged(path, fingerprint):
+            # Same size / mtime / inode as when it was uploaded: no need to read it
+            logger.debug("[SKIP] Already uploaded: %s", path)
+            FILES_SKIPPED.inc(reason="unchanged")
+            return None
+        return path, fingerprint
+
+    def _hash_stage(self, item: Tuple[str, Fingerprint]) -> Optional[Tuple[str, str, Fingerprint]]:
+        # Returns (path, hash, fingerprint) if the file has to be uploaded
+        path, fingerprint = item
+        try:
+            if self.scheduler is not None:
+                # Wait for a turn on the hashing threads shared by all roots
+                file_hash = self.scheduler.hashing.submit(
+                    self.watch_directory, fingerprint[0], self._hash_file, path
+                ).result()
+            else:
+                file_hash = self._hash_file(path)
+        except OSError as e:
+            # If the file cannot be read (permissions, removed, etc.), skip it
+            logger.warning("Skipping file (cannot read): %s (%s)", path, e)
+            self._mark_failed(path)
+            return None
+        FILES_HASHED.inc()
+        BYTES_HASHED.inc(fingerprint[0])
 
-        for path in self._iter_files():
+        if self.state_manager.is_uploaded(path, file_hash):
+            # File already uploaded with the same content (e.g. only touched),
+            # remember the new fingerprint so we don't hash it next time
+            logger.debug("[SKIP] Already uploaded: %s", path)
+            FILES_SKIPPED.inc(reason="same_hash")
+            self.state_manager.mark_uploaded(path, file_hash, fingerprint)
+            return None
+        # New or changed file
+        return path, file_hash, fingerprint
+
+    def _hash_file(self, path: str) -> str:
+        with HASH_SECONDS.time():
+            return calculate_file_hash(path, self.hash_algorithm)
+
+    def _upload_stage(self, items: List[Tuple[str, str, Fingerprint]]) -> None:
+        # Before sending any bytes, ask the server which of these contents it
+        # already has (e.g. uploaded by another client) and just mark those.
+        # Tiny files are cheaper to send than to ask about.
+        existing: Set[str] = set()
+        if self.uploader is not None:
+            to_check = [h for _, h, fp in items if fp[0] >= _EXISTS_CHECK_MIN_SIZE]
+            if to_check:
+                existing = self.uploader.find_existing(to_check)
+
+        new_items = []
+        for path, file_hash, fingerprint in items:
+            if file_hash in existing:
+                logger.debug("[EXISTS] Server already has the content of: %s", path)
+                FILES_SKIPPED.inc(reason="on_server")
+                self.state_manager.mark_uploaded(path, file_hash, fingerprint)
+            else:
+                new_items.append((path, file_hash, fingerprint))
+        if new_items:
+            self._handle_new_or_changed_files(new_items)
+
+    def watch(self, poll_interval: float = 5.0, debounce: float = 0.5, use_events: bool = True) -> None:
+        """
+        Keep watching the directory until stop() is called.
+
+        If inotify is available (Linux) the watcher reacts to kernel events
+        and uploads a file `debounce` seconds after the last write to it.
+        Otherwise (or if the event backend fails) it falls back to calling
+        scan_once() every `poll_interval` seconds.
+        """
+        self._stop_event.clear()
+        if use_events and inotify_available():
+            try:
+                self._watch_events(debounce)
+                return
+            except OSError as e:
+                logger.warning("Event watching failed, falling back to polling (%s)", e)
+        self._watch_polling(poll_interval)
+
+    def stop(self) -> None:
+        # Ask watch() to return (safe to call from another thread)
+        self._stop_event.set()
+
+    def _watch_polling(self, poll_interval: float) -> None:
+        while not self._stop_event.is_set():
+            self.scan_once()
+            # Failed files are simply tried again by the next scan
+            self._take_failed_paths()
+            self._stop_event.wait(poll_interval)
+
+    def _add_watches(self, notifier: Inotify, watches: Dict[int, str], directory: str) -> None:
+        # Watch `directory` (and, if recursive, every sub-directory below it)
+        pending = [directory]
+        while pending:
+            current = pending.pop()
             try:
-                file_hash = calculate_file_hash(path)
+                wd = notifier.add_watch(current, _WATCH_MASK)
             except OSError as e:
-                # If the file cannot be read (permissions, removed, etc.), skip it
-                print(f"Skipping file (cannot read): {path} ({e})")
+                if current == directory and not watches:
+                    raise
+                logger.warning("Skipping directory (cannot watch): %s (%s)", current, e)
                 continue
+            watches[wd] = current
+            if not self.recursive:
+                continue
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            rel_path = self._relative_path(entry.path)
+                            if rel_path is None or not self.ignore_rules.ignores_dir(rel_path):
+                                pending.append(entry.path)
+            except OSError:
+                pass
 
-            if self.state_manager.is_uploaded(path, file_hash):
-                # File already uploaded with the same content
-                print(f"[SKIP] Already uploaded: {path}")
-            else:
-                # New or changed file
-                self._handle_new_or_changed_file(path, file_hash)
+    def _watch_events(self, debounce: float) -> None:
+        with Inotify() as notifier:
+            watches: Dict[int, str] = {}
+            self._add_watches(notifier, watches, self.watch_directory)
+
+            # Events only tell us about changes from now on, so do one full scan
+            # for everything that happened while we were not watching.
+            self.scan_once()
+
+            # file path -> time when it is quiet enough to be handled
+            pending: Dict[str, float] = {}
+            # Files that failed (server down, unreadable, ...): nothing tells
+            # us when to try again, so path -> (time of the next try, failures)
+            retries: Dict[str, Tuple[float, int]] = {}
+            while not self._stop_event.is_set():
+                now = time.monotonic()
+                timeout = _STOP_CHECK_INTERVAL
+                if pending:
+                    timeout = min(timeout, max(0.0, min(pending.values()) - now))
+                if retries:
+                    timeout = min(timeout, max(0.0, min(due for due, _ in retries.values()) - now))
+
+                overflow = False
+                for event in notifier.read_events(timeout):
+                    if event.mask & IN_Q_OVERFLOW:
+                        overflow = True
+                        continue
+                    if event.mask & IN_IGNORED:
+                        # The watched directory was removed
+                        watches.pop(event.wd, None)
+                        continue
+                    directory = watches.get(event.wd)
+                    if directory is None or not event.name:
+                        continue
+                    path = os.path.join(directory, event.name)
 
+                    if event.mask & IN_ISDIR:
+                        rel_path = self._relative_path(path)
+                        if rel_path is not None and self.ignore_rules.ignores_path(rel_path, is_dir=True):
+                            continue
+                        if self.recursive and event.mask & (IN_CREATE | IN_MOVED_TO):
+                            # New sub-directory: watch it and pick up files that
+                            # were created in it before the watch was added
+                            self._add_watches(notifier, watches, path)
+                            for file_path, _ in self._iter_files(path):
+                                pending[file_path] = time.monotonic() + debounce
+                        continue
 
+                    if event.mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        pending[path] = time.monotonic() + debounce
+                    elif event.mask & IN_MODIFY and path in pending:
+                        # Still being written: wait until it is quiet again
+                        pending[path] = time.monotonic() + debounce
 
-    def _handle_new_or_changed_file(self, file_path: str, file_hash: str) -> None:
+                if not watches:
+                    raise OSError("watch directory is gone")
+
+                if overflow:
+                    # Events were lost: fall back to a full scan
+                    pending.clear()
+                    self.scan_once()
+                elif self._full_rehash_due():
+                    self.scan_once()
+
+                now = time.monotonic()
+                for path in [p for p, due in pending.items() if due <= now]:
+                    del pending[path]
+                    self.process_path(path)
+                retried = [p for p, (due, _) in retries.items() if due <= now and p not in pending]
+                for path in retried:
+                    self.process_path(path)
+                self._schedule_retries(retries, retried)
+                self.state_manager.flush_if_due()
+
+    def _schedule_retries(self, retries: Dict[str, Tuple[float, int]], retried: List[str]) -> None:
+        # Retried files that didn't fail again are done (uploaded, or gone);
+        # every failed file is tried again later, with exponential backoff
+        failed = self._take_failed_paths()
+        for path in retried:
+            if path not in failed:
+                retries.pop(path, None)
+        now = time.monotonic()
+        for path in failed:
+            failures = retries[path][1] + 1 if path in retries else 1
+            delay = min(_RETRY_MAX_DELAY, _RETRY_DELAY * 2 ** (failures - 1))
+            retries[path] = (now + delay, failures)
+            logger.debug("[RETRY] %s in %.0fs (failed %s times)", path, delay, failures)
+
+    def _handle_new_or_changed_files(self, items: List[Tuple[str, str, Fingerprint]]) -> None:
         """
-        Handle a new or changed file.
+        Handle new or changed files.
 
         For now:
-        - Upload the file to the server (if uploader is configured).
-        - If upload succeeds, mark it as uploaded in the state.
+        - Upload the files to the server (if uploader is configured),
+          several at a time (see Uploader.upload_many).
+        - Every file whose upload succeeds is marked as uploaded in the state
+          as soon as its own upload finishes.
         """
-        print(f"[NEW/CHANGED] {file_path}")
+        fingerprints = {}
+        for file_path, _, fingerprint in items:
+            logger.debug("[NEW/CHANGED] %s", file_path)
+            fingerprints[file_path] = fingerprint
 
         # If no uploader is provided, just mark as uploaded locally
-        if self.uploader is None:                        
-            self.state_manager.mark_uploaded(file_path, file_hash)
+        if self.uploader is None:
+            for file_path, file_hash, fingerprint in items:
+                self.state_manager.mark_uploaded(file_path, file_hash, fingerprint)
             return
 
-        # Try to upload the file
-        success = self.uploader.upload_file(file_path, file_hash)  
-        if success:
-            # Only mark as uploaded if the server accepted the file
-            self.state_manager.mark_uploaded(file_path, file_hash) 
-        else:
-            print(f"[WARN] Not marking as uploaded because upload failed: {file_path}")  # CHANGED
+        def on_result(result: UploadResult) -> None:
+            if result.success:
+                # Only mark as uploaded if the server accepted the file
+                self.state_manager.mark_uploaded(result.file_path, result.file_hash, fingerprints[result.file_path])
+            else:
+                logger.warning("Not marking as uploaded because upload failed: %s", result.file_path)
+                self._mark_failed(result.file_path)
+
+        self.uploader.upload_many(
+            [(path, file_hash) for path, file_hash, _ in items],
+            on_result=on_result,
+            root=self.watch_directory,
+        )
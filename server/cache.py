@@ -0,0 +1,290 @@
+"""
+Read cache of asset content in front of a remote storage (MinIO).
+
+Assets are addressed by their content hash, so they never change: a cached
+copy can't go stale and nothing is ever invalidated, entries only leave to
+make room. Two tiers, both least-recently-used first out:
+
+- memory: small objects (thumbnails, icons, small documents), bounded by
+  their total size
+- disk: bigger objects as files under one directory, bounded by their total
+  size. Files are written to a temporary name and renamed once complete, and
+  the directory is indexed again when a worker starts, so the cache survives
+  restarts. Worker processes share the directory but each keeps its own
+  index: with N workers it can grow to N times the limit.
+"""
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, NamedTuple, Optional, Tuple
+
+from .metrics import REGISTRY
+from .storage import ObjectInfo
+
+logger = logging.getLogger(__name__)
+
+CACHE_HITS = REGISTRY.counter("assets_read_cache_hits_total", "Downloads served from the read cache, by tier", ("tier",))
+CACHE_MISSES = REGISTRY.counter("assets_read_cache_misses_total", "Downloads not in the read cache")
+CACHE_EVICTIONS = REGISTRY.counter(
+    "assets_read_cache_evictions_total", "Objects removed from the read cache to make room, by tier", ("tier",)
+)
+
+# Temporary files of disk entries being filled (sub-directory of the cache),
+# and the age after which one is left over from a crashed worker (seconds)
+_TEMP_DIR = "tmp"
+_TEMP_MAX_AGE = 3600
+
+
+class CachedObject(NamedTuple):
+    info: ObjectInfo
+    # The content (memory tier) or the path of the file holding it (disk tier)
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+
+
+def iter_bytes(data: bytes, start: int, length: int) -> Iterator[bytes]:
+    # read_range of content held in memory
+    if length > 0:
+        yield data[start:start + length]
+
+
+class ReadCache:
+    """
+    Content-addressed cache of stored objects, keyed by the asset's hash.
+
+    get_asset looks an asset up with get() before asking the storage;
+    on a miss, read_through() wraps the storage read so the content is kept
+    on its way to the client. Revalidations (If-None-Match) are answered
+    before either, so they never fill the cache.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str],
+        memory_max_bytes: int,
+        memory_max_object_size: int,
+        disk_max_bytes: int,
+        disk_max_object_size: int,
+    ) -> None:
+        """
+        :param directory: where the disk tier keeps its files (None = no disk tier)
+        :param memory_max_bytes: total size of the memory tier (0 = off)
+        :param memory_max_object_size: objects up to this size go to memory
+        :param disk_max_bytes: total size of the disk tier (0 = off)
+        :param disk_max_object_size: bigger objects, up to this size, go to
+            disk; anything bigger is never cached
+        """
+        self.directory = directory if disk_max_bytes > 0 else None
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_max_object_size = min(memory_max_object_size, memory_max_bytes)
+        self.disk_max_bytes = disk_max_bytes if self.directory else 0
+        self.disk_max_object_size = min(disk_max_object_size, self.disk_max_bytes)
+        # hash -> (info, content) / (info, path), least recently used first
+        self._memory: "OrderedDict[str, Tuple[ObjectInfo, bytes]]" = OrderedDict()
+        self._disk: "OrderedDict[str, Tuple[ObjectInfo, str]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if self.directory is not None:
+            self._load_disk()
+
+    def tier_for(self, size: int) -> Optional[str]:
+        # "memory", "disk" or None (not cached)
+        if size <= self.memory_max_object_size:
+            return "memory"
+        if size <= self.disk_max_object_size:
+            return "disk"
+        return None
+
+    def _disk_path(self, key: str, object_name: str) -> str:
+        # <directory>/<first 2 hex digits>/<object name>: the extension keeps
+        # the content type across restarts, small directories stay fast
+        return os.path.join(self.directory, key[:2], object_name)
+
+    def _load_disk(self) -> None:
+        # Index the files left by earlier runs, oldest first
+        temp_dir = os.path.join(self.directory, _TEMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        for name in os.listdir(temp_dir):
+            # Other workers may be filling theirs right now
+            path = os.path.join(temp_dir, name)
+            try:
+                if time.time() - os.stat(path).st_mtime > _TEMP_MAX_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+        found = []
+        for current, dirs, files in os.walk(self.directory):
+            dirs[:] = [name for name in dirs if name != _TEMP_DIR]
+            for name in files:
+                path = os.path.join(current, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, name, path, st.st_size))
+        found.sort()
+        with self._lock:
+            for _, name, path, size in found:
+                self._add_disk(name.split(".", 1)[0], ObjectInfo(size, _guess_type(name)), path)
+        if found:
+            logger.info("[CACHE] %d cached objects (%d bytes) in %s", len(self._disk), self._disk_bytes, self.directory)
+
+    def get(self, key: str, object_name: str) -> Optional[CachedObject]:
+        """
+        The cached content of asset `key` (stored as `object_name`), or None.
+
+        A disk hit is a path: if the file is gone by the time it is opened
+        (evicted by another worker), call forget() and treat it as a miss.
+        """
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                self._memory.move_to_end(key)
+                CACHE_HITS.inc(tier="memory")
+                return CachedObject(item[0], data=item[1])
+            item = self._disk.get(key)
+            if item is not None:
+                self._disk.move_to_end(key)
+                CACHE_HITS.inc(tier="disk")
+                return CachedObject(item[0], path=item[1])
+
+        if self.directory is not None:
+            # Filled by another worker process since this one started
+            path = self._disk_path(key, object_name)
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                pass
+            else:
+                info = ObjectInfo(size, _guess_type(object_name))
+                with self._lock:
+                    self._add_disk(key, info, path)
+                CACHE_HITS.inc(tier="disk")
+                return CachedObject(info, path=path)
+
+        CACHE_MISSES.inc()
+        return None
+
+    def forget(self, key: str) -> None:
+        # Drops a disk entry whose file disappeared
+        with self._lock:
+            item = self._disk.pop(key, None)
+            if item is not None:
+                self._disk_bytes -= item[0].size
+
+    def read_through(
+        self,
+        key: str,
+        object_name: str,
+        info: ObjectInfo,
+        read_range: Callable[[int, int], Iterator[bytes]],
+    ) -> Callable[[int, int], Iterator[bytes]]:
+        """
+        Wraps read_range(start, length) of an asset that was not in the cache.
+
+        Small objects are read whole right away (a StorageError is raised
+        here) and kept in memory. For bigger ones, a read of the whole object
+        is written to the disk tier on its way to the client; range reads of
+        them go to the storage as they are.
+        """
+        tier = self.tier_for(info.size)
+        if tier == "memory":
+            data = b"".join(read_range(0, info.size))
+            if len(data) == info.size:
+                self.put_memory(key, info, data)
+            return lambda start, length: iter_bytes(data, start, length)
+        if tier == "disk":
+            def read(start: int, length: int) -> Iterator[bytes]:
+                if start == 0 and length == info.size:
+                    return self._tee_to_disk(key, object_name, info, read_range(start, length))
+                return read_range(start, length)
+            return read
+        return read_range
+
+    def put_memory(self, key: str, info: ObjectInfo, data: bytes) -> None:
+        if len(data) > self.memory_max_object_size:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = (info, data)
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.memory_max_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                CACHE_EVICTIONS.inc(tier="memory")
+
+    def _tee_to_disk(self, key: str, object_name: str, info: ObjectInfo, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        # Yields `chunks` and writes them to a temporary file on the way; the
+        # file becomes a cache entry only if the whole object went through
+        # (a client that disconnects early closes this generator)
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=os.path.join(self.directory, _TEMP_DIR))
+        except OSError as e:
+            logger.warning("[CACHE] Cannot create a cache file in %s: %s", self.directory, e)
+            yield from chunks
+            return
+        f = os.fdopen(fd, "wb")
+        written = 0
+        try:
+            for chunk in chunks:
+                if f is not None:
+                    try:
+                        f.write(chunk)
+                        written += len(chunk)
+                    except OSError as e:
+                        # e.g. disk full: keep serving, just don't cache it
+                        logger.warning("[CACHE] Cannot write %s to the cache: %s", object_name, e)
+                        f.close()
+                        f = None
+                yield chunk
+            if f is not None and written == info.size:
+                f.flush()
+                # A cache file must never be cut short by a crash: it would be
+                # served as the complete asset
+                os.fsync(f.fileno())
+                f.close()
+                f = None
+                self._commit_disk(key, object_name, info, temp_path)
+        finally:
+            if f is not None:
+                f.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _commit_disk(self, key: str, object_name: str, info: ObjectInfo, temp_path: str) -> None:
+        path = self._disk_path(key, object_name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning("[CACHE] Cannot add %s to the cache: %s", object_name, e)
+            return
+        with self._lock:
+            self._add_disk(key, info, path)
+
+    def _add_disk(self, key: str, info: ObjectInfo, path: str) -> None:
+        # Called with the lock held; evicts the least recently used files
+        if key in self._disk:
+            return
+        self._disk[key] = (info, path)
+        self._disk_bytes += info.size
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            _, (evicted, evicted_path) = self._disk.popitem(last=False)
+            self._disk_bytes -= evicted.size
+            CACHE_EVICTIONS.inc(tier="disk")
+            try:
+                # A download still sending it keeps its open file
+                os.remove(evicted_path)
+            except OSError:
+                pass
+
+
+def _guess_type(object_name: str) -> str:
+    # Same rule as for objects stored without a content type
+    return mimetypes.guess_type(object_name)[0] or "application/octet-stream"
@@ -0,0 +1,75 @@
+"""
+Compressed request bodies (Content-Encoding: zstd / gzip).
+
+Clients compress compressible files on the fly; the server decompresses
+the stream before it is hashed and stored, so hashes, dedup and stored
+objects are all about the original content. zstd needs the optional
+`zstandard` package; gzip is always available.
+"""
+import gzip
+import zlib
+from typing import BinaryIO, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+# Decompressed bytes produced per read when the caller asks for "everything"
+_READ_SIZE = 1024 * 1024
+
+
+class DecompressionError(Exception):
+    """Raised when a compressed body is corrupt or decompresses to more than allowed."""
+
+
+def supported_encodings() -> List[str]:
+    # In order of preference (advertised in /capabilities)
+    return (["zstd"] if zstandard is not None else []) + ["gzip"]
+
+
+class DecompressingReader:
+    """
+    Wraps a compressed stream and returns the decompressed content.
+
+    Every read returns at most the requested number of bytes, so a small
+    body that expands enormously ("zip bomb") never sits in memory; beyond
+    `max_size` decompressed bytes DecompressionError is raised.
+    """
+
+    def __init__(self, stream: BinaryIO, encoding: str, max_size: Optional[int] = None) -> None:
+        """
+        :param stream: the compressed body
+        :param encoding: "zstd" or "gzip" (see supported_encodings)
+        :param max_size: max decompressed size in bytes (None = no limit)
+        """
+        if encoding not in supported_encodings():
+            raise ValueError(f"unsupported content encoding: {encoding}")
+        if encoding == "zstd":
+            self._decoded = zstandard.ZstdDecompressor().stream_reader(stream)
+        else:
+            self._decoded = gzip.GzipFile(fileobj=stream, mode="rb")
+        self.max_size = max_size
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                data = self.read(_READ_SIZE)
+                if not data:
+                    return b"".join(chunks)
+                chunks.append(data)
+
+        try:
+            data = self._decoded.read(size)
+        except (OSError, EOFError, zlib.error) as e:
+            raise DecompressionError(f"invalid compressed body: {e}") from e
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                raise DecompressionError(f"invalid compressed body: {e}") from e
+            raise
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise DecompressionError(f"body decompresses to more than {self.max_size} bytes")
+        return data
@@ -0,0 +1,43 @@
+import hashlib
+import re
+from typing import BinaryIO
+
+_HEX_RE = re.compile(r"[0-9a-f]+")
+
+
+class HashMismatchError(Exception):
+    """Raised when uploaded content does not match the hash the client sent."""
+
+
+def is_valid_hash(file_hash: str, algorithm: str) -> bool:
+    # A lower-case hex digest of the right length for this algorithm
+    expected_length = hashlib.new(algorithm).digest_size * 2
+    return len(file_hash) == expected_length and _HEX_RE.fullmatch(file_hash) is not None
+
+
+class HashVerifyingReader:
+    """
+    Wraps an input stream and hashes everything read through it.
+
+    When the end of the stream is reached the digest is compared with the
+    expected hash and HashMismatchError is raised on a mismatch, *before*
+    the caller sees EOF. MinIO's put_object aborts the multipart upload
+    when its reader raises, so bad content is never committed.
+    """
+
+    def __init__(self, stream: BinaryIO, algorithm: str, expected_hash: str) -> None:
+        self.stream = stream
+        self.expected_hash = expected_hash
+        self.size = 0
+        self._hasher = hashlib.new(algorithm)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        if data:
+            self._hasher.update(data)
+            self.size += len(data)
+        elif self._hasher.hexdigest() != self.expected_hash:
+            raise HashMismatchError(
+                f"content hash {self._hasher.hexdigest()} does not match {self.expected_hash}"
+            )
+        return data
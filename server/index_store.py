@@ -0,0 +1,735 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """
+    Base class for the server's SQLite stores.
+
+    - The database runs in WAL mode: readers never block the writer, and
+      several processes (WSGI workers) can share the same file.
+    - Every thread gets its own connection, so request threads don't
+      serialise on one connection.
+    """
+
+    SCHEMA: List[str] = []
+    # Columns added after a table was first released: (table, column, definition).
+    # They are added to older databases on open, before the rest of SCHEMA_UPGRADE runs.
+    ADDED_COLUMNS: List[Tuple[str, str, str]] = []
+    # Statements that need the added columns (e.g. their indexes)
+    SCHEMA_UPGRADE: List[str] = []
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._conn()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        for table, column, definition in self.ADDED_COLUMNS:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                except sqlite3.OperationalError as e:
+                    # Another worker added it first
+                    if "duplicate column" not in str(e):
+                        raise
+        for statement in self.SCHEMA_UPGRADE:
+            conn.execute(statement)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy_json(self, json_path: str, import_func) -> None:
+        """
+        One-time import of an old JSON file: done in one transaction, then the
+        file is renamed to *.migrated. If several workers start at once, only
+        the first one finds the file.
+        """
+        if not os.path.exists(json_path):
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not os.path.exists(json_path):
+                conn.execute("ROLLBACK")
+                return
+            with open(json_path, "r", encoding="utf-8") as f:
+                import_func(conn, json.load(f))
+            os.replace(json_path, json_path + ".migrated")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        logger.info("[INDEX] Imported %s into %s", json_path, self.db_path)
+
+    def close(self) -> None:
+        # Closes the connection of the calling thread
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class AssetIndex(SQLiteStore):
+    """
+    Durable index of stored assets: file_hash -> where it is stored, plus
+    catalog metadata recorded when the asset was first uploaded (original
+    file name, extension, size, MIME type, uploading client, first-seen time).
+
+    Lookups are single primary-key reads, and adding an asset is a single
+    INSERT, so neither depends on the size of the catalog. Nothing is loaded
+    into memory on startup. Catalog queries (see query) walk one secondary
+    index in (first_seen, hash) order, so a page costs the same at any depth.
+    Assets indexed before the metadata existed have NULL metadata and
+    first_seen 0.
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS assets (
+            hash TEXT PRIMARY KEY,
+            bucket TEXT NOT NULL,
+            object_name TEXT NOT NULL,
+            hash_algorithm TEXT NOT NULL DEFAULT 'sha256'
+        ) WITHOUT ROWID
+        """,
+    ]
+
+    ADDED_COLUMNS = [
+        ("assets", "filename", "TEXT"),
+        ("assets", "extension", "TEXT"),
+        ("assets", "size", "INTEGER"),
+        ("assets", "content_type", "TEXT"),
+        ("assets", "client_id", "TEXT"),
+        ("assets", "first_seen", "REAL NOT NULL DEFAULT 0"),
+    ]
+
+    # One index per filter; each ends with the listing order, so a filtered
+    # page is a range scan that stops after `limit` rows
+    SCHEMA_UPGRADE = [
+        "CREATE INDEX IF NOT EXISTS assets_by_first_seen ON assets (first_seen, hash)",
+        "CREATE INDEX IF NOT EXISTS assets_by_extension ON assets (extension, first_seen, hash)",
+        "CREATE INDEX IF NOT EXISTS assets_by_content_type ON assets (content_type, first_seen, hash)",
+        "CREATE INDEX IF NOT EXISTS assets_by_client ON assets (client_id, first_seen, hash)",
+        "CREATE INDEX IF NOT EXISTS assets_by_filename ON assets (filename)",
+        "CREATE INDEX IF NOT EXISTS assets_by_size ON assets (size)",
+    ]
+
+    # Indexes of the range filters of query, and the most rows a range may
+    # match to be read through its own index and sorted; a wider range is
+    # checked while walking the first-seen order instead (it fills a page fast)
+    _RANGE_INDEXES = {
+        "content_type": "assets_by_content_type",
+        "filename": "assets_by_filename",
+        "size": "assets_by_size",
+    }
+    RANGE_SORT_LIMIT = 10000
+
+    # Fields of a catalog entry (see query)
+    CATALOG_COLUMNS = (
+        "hash", "bucket", "object_name", "hash_algorithm", "filename",
+        "extension", "size", "content_type", "client_id", "first_seen",
+    )
+
+    def __init__(self, db_path: str, legacy_json_path: Optional[str] = None) -> None:
+        """
+        :param db_path: path of the SQLite database
+        :param legacy_json_path: old assets_index.json to import on first start
+        """
+        super().__init__(db_path)
+        if legacy_json_path is not None:
+            self._import_legacy_json(legacy_json_path, self._import_entries)
+
+    @staticmethod
+    def _import_entries(conn: sqlite3.Connection, old_index: Dict[str, dict]) -> None:
+        conn.executemany(
+            "INSERT OR IGNORE INTO assets (hash, bucket, object_name, hash_algorithm) VALUES (?, ?, ?, ?)",
+            (
+                (h, e["bucket"], e["object_name"], e.get("hash_algorithm", "sha256"))
+                for h, e in old_index.items()
+            ),
+        )
+
+    def get(self, file_hash: str) -> Optional[dict]:
+        # Returns { "bucket", "object_name", "hash_algorithm" } or None
+        row = self._conn().execute(
+            "SELECT bucket, object_name, hash_algorithm FROM assets WHERE hash = ?", (file_hash,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"bucket": row[0], "object_name": row[1], "hash_algorithm": row[2]}
+
+    def __contains__(self, file_hash: object) -> bool:
+        return self._conn().execute(
+            "SELECT 1 FROM assets WHERE hash = ?", (file_hash,)
+        ).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+
+    def existing(self, file_hashes: Iterable[str]) -> Set[str]:
+        # Returns the subset of file_hashes that is in the index (one query)
+        hashes = [h for h in file_hashes if isinstance(h, str)]
+        found: Set[str] = set()
+        # SQLite limits the number of "?" parameters per statement
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(
+                row[0]
+                for row in self._conn().execute(f"SELECT hash FROM assets WHERE hash IN ({placeholders})", batch)
+            )
+        return found
+
+    _INSERT = (
+        "INSERT OR IGNORE INTO assets (hash, bucket, object_name, hash_algorithm, filename, "
+        "extension, size, content_type, client_id, first_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+
+    @staticmethod
+    def _insert_params(file_hash: str, entry: dict, metadata: Optional[dict], first_seen: float) -> tuple:
+        metadata = metadata or {}
+        _, ext = os.path.splitext(entry["object_name"])
+        return (
+            file_hash,
+            entry["bucket"],
+            entry["object_name"],
+            entry.get("hash_algorithm", "sha256"),
+            metadata.get("filename"),
+            ext[1:].lower() or None,
+            metadata.get("size"),
+            metadata.get("content_type"),
+            metadata.get("client_id"),
+            first_seen,
+        )
+
+    def insert_if_absent(self, file_hash: str, entry: dict, metadata: Optional[dict] = None) -> dict:
+        """
+        Adds an asset unless the hash is already indexed (atomic, also across
+        worker processes). Returns the entry that is in the index afterwards:
+        `entry` itself, or the one a concurrent upload of the same content
+        inserted first.
+
+        :param metadata: catalog fields of the first upload
+            { "filename", "size", "content_type", "client_id" } (all optional;
+            the extension comes from the object name)
+        """
+        cursor = self._conn().execute(self._INSERT, self._insert_params(file_hash, entry, metadata, time.time()))
+        if cursor.rowcount == 1:
+            return entry
+        return self.get(file_hash) or entry
+
+    def insert_many_if_absent(self, entries: List[Tuple[str, dict, Optional[dict]]]) -> None:
+        """
+        Adds many (file_hash, entry, metadata) in one transaction (one disk
+        sync instead of one per asset). Hashes that are already indexed keep
+        their entry, as with insert_if_absent.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                self._INSERT,
+                (self._insert_params(h, entry, metadata, now) for h, entry, metadata in entries),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def query(
+        self,
+        extension: Optional[str] = None,
+        content_type: Optional[str] = None,
+        content_type_prefix: Optional[str] = None,
+        client_id: Optional[str] = None,
+        filename_prefix: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        after: Optional[Tuple[float, str]] = None,
+        limit: int = 100,
+    ) -> Iterator[dict]:
+        """
+        Yields catalog entries (dicts with CATALOG_COLUMNS) in (first_seen,
+        hash) order, read from the database row by row.
+
+        :param extension: lower-case extension without the dot, e.g. "png"
+        :param content_type: exact MIME type
+        :param content_type_prefix: MIME type prefix, e.g. "image/"
+        :param client_id: uploading client
+        :param filename_prefix: original file names starting with this
+        :param min_size: / max_size: size range in bytes (inclusive)
+        :param since: / until: first-seen range (unix time, since <= t < until)
+        :param after: (first_seen, hash) of the last entry of the previous
+            page (keyset pagination: no OFFSET, so deep pages stay cheap)
+        :param limit: max number of entries
+        """
+        where: List[str] = []
+        params: List[object] = []
+        equality = [
+            (column, value)
+            for column, value in (("extension", extension), ("content_type", content_type), ("client_id", client_id))
+            if value is not None
+        ]
+        for column, value in equality:
+            where.append(f"{column} = ?")
+            params.append(value)
+
+        # column -> [(operator, value), ...]
+        ranges: Dict[str, List[Tuple[str, object]]] = {}
+        for column, prefix in (("content_type", content_type_prefix), ("filename", filename_prefix)):
+            if prefix:
+                # A range instead of LIKE, so an index can be used
+                ranges[column] = [(">=", prefix), ("<", prefix[:-1] + chr(ord(prefix[-1]) + 1))]
+        size_bounds = [(op, value) for op, value in ((">=", min_size), ("<=", max_size)) if value is not None]
+        if size_bounds:
+            ranges["size"] = size_bounds
+        # An equality filter's index already gives the order; otherwise a
+        # narrow range is cheaper through its own index
+        range_column = self._narrowest_range(ranges) if ranges and not equality else None
+        for column, bounds in ranges.items():
+            # "+column" keeps SQLite from picking the column's index
+            expression = column if column == range_column else f"+{column}"
+            for op, value in bounds:
+                where.append(f"{expression} {op} ?")
+                params.append(value)
+
+        if since is not None:
+            where.append("first_seen >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("first_seen < ?")
+            params.append(until)
+        if after is not None:
+            where.append("(first_seen, hash) > (?, ?)")
+            params.extend(after)
+
+        sql = f"SELECT {', '.join(self.CATALOG_COLUMNS)} FROM assets"
+        if range_column is not None:
+            sql += f" INDEXED BY {self._RANGE_INDEXES[range_column]}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY first_seen, hash LIMIT ?"
+        params.append(limit)
+
+        cursor = self._conn().execute(sql, params)
+        try:
+            for row in cursor:
+                yield dict(zip(self.CATALOG_COLUMNS, row))
+        finally:
+            cursor.close()
+
+    def _narrowest_range(self, ranges: Dict[str, List[Tuple[str, object]]]) -> Optional[str]:
+        # The range column matching the fewest rows, if at most RANGE_SORT_LIMIT
+        # (each count stops at the limit, so it costs a bounded index scan)
+        best, best_count = None, self.RANGE_SORT_LIMIT + 1
+        for column, bounds in ranges.items():
+            condition = " AND ".join(f"{column} {op} ?" for op, _ in bounds)
+            count = self._conn().execute(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM assets INDEXED BY {self._RANGE_INDEXES[column]} "
+                f"WHERE {condition} LIMIT ?)",
+                [value for _, value in bounds] + [self.RANGE_SORT_LIMIT + 1],
+            ).fetchone()[0]
+            if count < best_count:
+                best, best_count = column, count
+        return best
+
+
+class UploadSessionStore(SQLiteStore):
+    """
+    Open resumable upload sessions, shared by all worker processes.
+
+    session = { "hash", "hash_algorithm", "object_name", "size",
+                "chunk_size", "minio_upload_id", "parts": { "<index>": etag },
+                "filename", "content_type", "assembled", "verifying_until",
+                "part_object" }
+
+    "filename" / "content_type" are what the client sent, recorded in the
+    catalog when the upload completes (None for sessions of older versions).
+    "part_object" is the object the parts are joined into; it is renamed to
+    "object_name" only once its hash is checked (None for sessions of older
+    versions, which join straight into "object_name").
+
+    Completing a session (assemble, then hash the whole object) runs in the
+    background: "verifying_until" is the lease of the worker doing it, and
+    "assembled" is set once the storage has joined the parts, so a retry
+    after a crash only has to hash again.
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            upload_id TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            hash_algorithm TEXT NOT NULL,
+            object_name TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            minio_upload_id TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS upload_parts (
+            upload_id TEXT NOT NULL,
+            part_index INTEGER NOT NULL,
+            etag TEXT NOT NULL,
+            PRIMARY KEY (upload_id, part_index)
+        ) WITHOUT ROWID
+        """,
+    ]
+
+    ADDED_COLUMNS = [
+        ("upload_sessions", "assembled", "INTEGER NOT NULL DEFAULT 0"),
+        ("upload_sessions", "verifying_until", "REAL NOT NULL DEFAULT 0"),
+        ("upload_sessions", "filename", "TEXT"),
+        ("upload_sessions", "content_type", "TEXT"),
+        ("upload_sessions", "part_object", "TEXT"),
+    ]
+
+    _COLUMNS = (
+        "hash", "hash_algorithm", "object_name", "size", "chunk_size", "minio_upload_id",
+        "assembled", "verifying_until", "filename", "content_type", "part_object",
+    )
+    # Values of the added columns for sessions that don't have them
+    _DEFAULTS = {"assembled": 0, "verifying_until": 0.0}
+
+    def __init__(self, db_path: str, legacy_json_path: Optional[str] = None) -> None:
+        super().__init__(db_path)
+        if legacy_json_path is not None:
+            self._import_legacy_json(legacy_json_path, self._import_sessions)
+
+    def _import_sessions(self, conn: sqlite3.Connection, old_sessions: Dict[str, dict]) -> None:
+        for upload_id, session in old_sessions.items():
+            self._insert(conn, upload_id, session)
+
+    def _insert(self, conn: sqlite3.Connection, upload_id: str, session: dict) -> None:
+        conn.execute(
+            f"INSERT OR REPLACE INTO upload_sessions (upload_id, {', '.join(self._COLUMNS)}) "
+            f"VALUES (?, {', '.join('?' * len(self._COLUMNS))})",
+            (upload_id, *(session.get(column, self._DEFAULTS.get(column)) for column in self._COLUMNS)),
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO upload_parts (upload_id, part_index, etag) VALUES (?, ?, ?)",
+            ((upload_id, int(index), etag) for index, etag in session.get("parts", {}).items()),
+        )
+
+    def create(self, upload_id: str, session: dict) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            self._insert(conn, upload_id, session)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get(self, upload_id: str) -> Optional[dict]:
+        conn = self._conn()
+        row = conn.execute(
+            f"SELECT {', '.join(self._COLUMNS)} FROM upload_sessions WHERE upload_id = ?", (upload_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        session = dict(zip(self._COLUMNS, row))
+        session["parts"] = {
+            str(index): etag
+            for index, etag in conn.execute(
+                "SELECT part_index, etag FROM upload_parts WHERE upload_id = ?", (upload_id,)
+            )
+        }
+        return session
+
+    def add_part(self, upload_id: str, index: int, etag: str) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO upload_parts (upload_id, part_index, etag) VALUES (?, ?, ?)",
+            (upload_id, index, etag),
+        )
+
+    def claim_completion(self, upload_id: str, lease: float) -> bool:
+        """
+        Take the completion of a session for `lease` seconds. False if
+        another worker is completing it right now (its lease is running).
+        """
+        now = time.time()
+        cursor = self._conn().execute(
+            "UPDATE upload_sessions SET verifying_until = ? WHERE upload_id = ? AND verifying_until < ?",
+            (now + lease, upload_id, now),
+        )
+        return cursor.rowcount == 1
+
+    def extend_completion(self, upload_id: str, lease: float) -> None:
+        # The completing worker is still alive (called while it hashes)
+        self._conn().execute(
+            "UPDATE upload_sessions SET verifying_until = ? WHERE upload_id = ?", (time.time() + lease, upload_id)
+        )
+
+    def release_completion(self, upload_id: str) -> None:
+        # Completion failed (storage error): the client may try again at once
+        self._conn().execute("UPDATE upload_sessions SET verifying_until = 0 WHERE upload_id = ?", (upload_id,))
+
+    def mark_assembled(self, upload_id: str) -> None:
+        self._conn().execute("UPDATE upload_sessions SET assembled = 1 WHERE upload_id = ?", (upload_id,))
+
+    def delete(self, upload_id: str) -> Optional[dict]:
+        """
+        Removes a session and returns it, or None if it didn't exist
+        (e.g. another worker completed or aborted it first).
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            session = self.get(upload_id)
+            conn.execute("DELETE FROM upload_sessions WHERE upload_id = ?", (upload_id,))
+            conn.execute("DELETE FROM upload_parts WHERE upload_id = ?", (upload_id,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return session
+
+
+class ChunkStore(SQLiteStore):
+    """
+    Chunk-level dedup: which chunks are stored, and the manifests of the
+    assets that were uploaded as chunks.
+
+    chunks:    chunk_hash -> size (the content is the storage object <hash>.chunk)
+    manifests: file_hash  -> [[chunk_hash, size], ...] in file order
+    manifest_checks: file_hash -> verifying_until, error
+               manifests being verified (hashing the whole content runs in
+               the background, under the lease of one worker) or rejected
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS chunks (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS manifests (
+            hash TEXT PRIMARY KEY,
+            chunks TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS manifest_checks (
+            hash TEXT PRIMARY KEY,
+            verifying_until REAL NOT NULL,
+            error TEXT
+        ) WITHOUT ROWID
+        """,
+    ]
+
+    def missing(self, chunk_hashes: Iterable[str]) -> List[str]:
+        # Returns the hashes (in the given order, each once) that are not stored yet
+        hashes = list(dict.fromkeys(chunk_hashes))
+        found: Set[str] = set()
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(
+                row[0]
+                for row in self._conn().execute(f"SELECT hash FROM chunks WHERE hash IN ({placeholders})", batch)
+            )
+        return [h for h in hashes if h not in found]
+
+    def add_chunk(self, chunk_hash: str, size: int) -> None:
+        self._conn().execute("INSERT OR IGNORE INTO chunks (hash, size) VALUES (?, ?)", (chunk_hash, size))
+
+    def save_manifest(self, file_hash: str, chunks: List[List]) -> None:
+        self._conn().execute(
+            "INSERT OR IGNORE INTO manifests (hash, chunks) VALUES (?, ?)", (file_hash, json.dumps(chunks))
+        )
+
+    def get_manifest(self, file_hash: str) -> Optional[List[List]]:
+        row = self._conn().execute("SELECT chunks FROM manifests WHERE hash = ?", (file_hash,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def claim_check(self, file_hash: str, lease: float) -> bool:
+        """
+        Take the verification of a manifest for `lease` seconds (clears the
+        error of an earlier attempt). False if another worker is verifying
+        it right now.
+        """
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO manifest_checks (hash, verifying_until, error) VALUES (?, ?, NULL) "
+            "ON CONFLICT (hash) DO UPDATE SET verifying_until = excluded.verifying_until, error = NULL "
+            "WHERE manifest_checks.verifying_until < ?",
+            (file_hash, now + lease, now),
+        )
+        return cursor.rowcount == 1
+
+    def extend_check(self, file_hash: str, lease: float) -> None:
+        # The verifying worker is still alive (called while it hashes)
+        self._conn().execute(
+            "UPDATE manifest_checks SET verifying_until = ? WHERE hash = ?", (time.time() + lease, file_hash)
+        )
+
+    def end_check(self, file_hash: str, error: Optional[str] = None) -> None:
+        # Verification over: the row is kept only to report an error
+        if error is None:
+            self._conn().execute("DELETE FROM manifest_checks WHERE hash = ?", (file_hash,))
+        else:
+            self._conn().execute(
+                "UPDATE manifest_checks SET verifying_until = 0, error = ? WHERE hash = ?", (error, file_hash)
+            )
+
+    def get_check(self, file_hash: str) -> Optional[dict]:
+        # {"verifying_until", "error"}, or None if not being / not yet verified
+        row = self._conn().execute(
+            "SELECT verifying_until, error FROM manifest_checks WHERE hash = ?", (file_hash,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"verifying_until": row[0], "error": row[1]}
+
+
+class IngestJobStore(SQLiteStore):
+    """
+    Jobs of the asynchronous ingest queue (see server/ingest.py).
+
+    job = { "job_id", "hash", "hash_algorithm", "object_name", "content_type",
+            "size", "status", "attempts", "error", "owner",
+            "filename", "client_id" }   (catalog metadata for the index)
+
+    status: queued (spooled on the local disk, not stored yet) -> done,
+    or failed if the spooled file was lost. `owner` is the ingest queue
+    (worker process) pushing the job; the jobs of a crashed process are
+    claimed by the next one that starts.
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            job_id TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            hash_algorithm TEXT NOT NULL,
+            object_name TEXT NOT NULL,
+            content_type TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            owner TEXT NOT NULL,
+            updated REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS ingest_jobs_by_hash ON ingest_jobs (hash, status)",
+        "CREATE INDEX IF NOT EXISTS ingest_jobs_by_owner ON ingest_jobs (owner, status)",
+    ]
+
+    ADDED_COLUMNS = [
+        ("ingest_jobs", "filename", "TEXT"),
+        ("ingest_jobs", "client_id", "TEXT"),
+    ]
+
+    _COLUMNS = (
+        "job_id", "hash", "hash_algorithm", "object_name", "content_type",
+        "size", "status", "attempts", "error", "owner", "filename", "client_id",
+    )
+
+    def _select(self, where: str, params: tuple) -> List[dict]:
+        rows = self._conn().execute(
+            f"SELECT {', '.join(self._COLUMNS)} FROM ingest_jobs WHERE {where}", params
+        ).fetchall()
+        return [dict(zip(self._COLUMNS, row)) for row in rows]
+
+    def create(self, job: dict) -> None:
+        self._conn().execute(
+            "INSERT INTO ingest_jobs (job_id, hash, hash_algorithm, object_name, content_type, size, "
+            "status, owner, updated, filename, client_id) VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (
+                job["job_id"], job["hash"], job["hash_algorithm"], job["object_name"],
+                job["content_type"], job["size"], job["owner"], time.time(),
+                job.get("filename"), job.get("client_id"),
+            ),
+        )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        jobs = self._select("job_id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def find_queued(self, file_hash: str) -> Optional[dict]:
+        # A job that is already pushing this content, if any
+        jobs = self._select("hash = ? AND status = 'queued' LIMIT 1", (file_hash,))
+        return jobs[0] if jobs else None
+
+    def owners(self) -> Set[str]:
+        # Owners that still have queued jobs
+        return {
+            row[0]
+            for row in self._conn().execute("SELECT DISTINCT owner FROM ingest_jobs WHERE status = 'queued'")
+        }
+
+    def claim(self, old_owner: str, new_owner: str) -> List[dict]:
+        """
+        Moves the queued jobs of `old_owner` to `new_owner` and returns them
+        (atomic: if two processes claim the same owner, one gets everything).
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            jobs = self._select("owner = ? AND status = 'queued'", (old_owner,))
+            conn.execute(
+                "UPDATE ingest_jobs SET owner = ?, updated = ? WHERE owner = ? AND status = 'queued'",
+                (new_owner, time.time(), old_owner),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        for job in jobs:
+            job["owner"] = new_owner
+        return jobs
+
+    def record_attempt(self, job_id: str, error: str) -> None:
+        # A failed push; the job stays queued and is tried again
+        self._conn().execute(
+            "UPDATE ingest_jobs SET attempts = attempts + 1, error = ?, updated = ? WHERE job_id = ?",
+            (error, time.time(), job_id),
+        )
+
+    def finish(self, job_ids: List[str], status: str, error: Optional[str] = None) -> None:
+        # Marks many jobs done (or failed) in one transaction
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            conn.executemany(
+                "UPDATE ingest_jobs SET status = ?, error = ?, updated = ? WHERE job_id = ?",
+                ((status, error, now, job_id) for job_id in job_ids),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def prune(self, older_than: float) -> int:
+        # Forgets finished jobs last updated before `older_than` (a timestamp)
+        cursor = self._conn().execute(
+            "DELETE FROM ingest_jobs WHERE status != 'queued' AND updated < ?", (older_than,)
+        )
+        return cursor.rowcount
@@ -0,0 +1,447 @@
+"""
+Asynchronous ingest: acknowledge uploads as soon as they are safe on the
+local disk, and push them to the storage in the background.
+
+    request thread:  hash-verify the body while writing it to the spool
+                     -> record a job -> 202 {"job_id"}
+    push workers:    spooled file -> storage (a hard link with local storage)
+    committer:       index entries of pushed jobs, many per transaction
+                     -> job done -> spooled file removed
+
+Spool layout (INGEST_SPOOL_DIR):
+
+    owners/<owner>.lock      held (flock) by the running queue of a process
+                             (created locked as <owner>.lock.new, then renamed)
+    incoming/<owner>/<id>    bodies still being received
+    jobs/<job_id>            complete bodies, waiting to be pushed
+
+Every step after the 202 is idempotent (storage writes are atomic renames,
+index inserts are INSERT OR IGNORE), so after a crash the jobs are simply
+replayed: a starting queue claims the queued jobs of every owner whose lock
+is free (its process is gone) and pushes them again.
+"""
+import fcntl
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import BinaryIO, Callable, List, Optional
+
+from .hashing import HashVerifyingReader
+from .index_store import AssetIndex, IngestJobStore
+from .metrics import REGISTRY
+from .storage import COPY_CHUNK_SIZE, LocalStorage, Storage, StorageError, StorageUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# A <owner>.lock.new left for this long (seconds) is from a crashed start
+_STALE_LOCK_AGE = 3600
+
+INGEST_JOBS = REGISTRY.counter(
+    "assets_ingest_jobs_total",
+    "Jobs of the async ingest queue by result (accepted, recovered, retried, done, failed)",
+    ("result",),
+)
+INGEST_PUSH_SECONDS = REGISTRY.histogram(
+    "assets_ingest_push_seconds", "Time of pushing one spooled upload to the storage"
+)
+INGEST_COMMIT_SECONDS = REGISTRY.histogram(
+    "assets_ingest_commit_seconds", "Time of committing one batch of ingested assets to the index"
+)
+
+
+class IngestQueueFullError(Exception):
+    """Raised when too many uploads are waiting to be pushed (the request gets a 503)."""
+
+
+def _fsync_dir(path: str) -> None:
+    # Makes a rename into `path` survive a power loss
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class IngestQueue:
+    """
+    The ingest queue of one process (see the module docstring).
+
+    The number of jobs waiting in a process is capped by `max_queued`
+    (a soft limit, checked before a body is spooled): a storage outage
+    fills the spool up to there, then uploads get 503 until it drains.
+    """
+
+    def __init__(
+        self,
+        spool_dir: str,
+        jobs: IngestJobStore,
+        index: AssetIndex,
+        get_storage: Callable[[], Storage],
+        workers: int = 4,
+        max_queued: int = 10000,
+        commit_batch_size: int = 100,
+        commit_interval: float = 0.2,
+        retry_delay: float = 1.0,
+        retry_max_delay: float = 60.0,
+        fsync: bool = True,
+        maintenance_interval: float = 60.0,
+        job_ttl: float = 24 * 3600,
+    ) -> None:
+        """
+        :param spool_dir: directory of the spooled bodies (on the same file
+            system as local storage, so pushing is a hard link)
+        :param jobs: where the jobs are recorded
+        :param index: asset index the pushed assets are added to
+        :param get_storage: returns the (connected) storage backend
+        :param workers: number of threads pushing to the storage
+        :param max_queued: max jobs waiting in this process
+        :param commit_batch_size: max index entries per transaction
+        :param commit_interval: max seconds a pushed job waits for its batch
+        :param retry_delay: first delay after a failed push (doubled every
+            attempt, up to retry_max_delay); jobs are retried until they succeed
+        :param fsync: flush every spooled body to disk before the 202
+        :param maintenance_interval: seconds between checks for jobs of
+            crashed processes (and pruning of old finished jobs)
+        :param job_ttl: seconds a finished job stays visible on GET /jobs/<id>
+        """
+        self.spool_dir = os.path.abspath(spool_dir)
+        self.jobs = jobs
+        self.index = index
+        self.get_storage = get_storage
+        self.workers = workers
+        self.max_queued = max_queued
+        self.commit_batch_size = commit_batch_size
+        self.commit_interval = commit_interval
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.fsync = fsync
+        self.maintenance_interval = maintenance_interval
+        self.job_ttl = job_ttl
+
+        self.owner = uuid.uuid4().hex
+        self._owners_dir = os.path.join(self.spool_dir, "owners")
+        self._jobs_dir = os.path.join(self.spool_dir, "jobs")
+        self._incoming_dir = os.path.join(self.spool_dir, "incoming", self.owner)
+
+        # Jobs to push, and pushed jobs waiting for their index commit
+        self._to_push: "queue.Queue[Optional[dict]]" = queue.Queue()
+        self._to_commit: "queue.Queue[Optional[dict]]" = queue.Queue()
+        # Ids of this queue's jobs that are not done yet
+        self._pending: set = set()
+        self._pending_changed = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock_file = None
+
+    # ===== Lifecycle =====
+
+    def start(self) -> None:
+        # Takes over the jobs of crashed processes, then starts the threads
+        for directory in (self._owners_dir, self._jobs_dir):
+            os.makedirs(directory, exist_ok=True)
+        # The lock file only appears under its name once it is locked (a
+        # rename keeps the lock): recover() in another process must never
+        # see it unlocked and take this live owner for a dead one
+        temp_path = f"{self._lock_path(self.owner)}.new"
+        self._lock_file = open(temp_path, "wb")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(temp_path, self._lock_path(self.owner))
+        os.makedirs(self._incoming_dir, exist_ok=True)
+
+        self.recover()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._push_loop, name=f"ingest-push-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        committer = threading.Thread(target=self._commit_loop, name="ingest-commit", daemon=True)
+        committer.start()
+        self._threads.append(committer)
+
+    def stop(self) -> None:
+        """
+        Stops the threads. Jobs that are not done stay queued in the job
+        store and are pushed by the next queue that starts.
+        """
+        self._stopping.set()
+        workers, committer = self._threads[:-1], self._threads[-1:]
+        for _ in workers:
+            self._to_push.put(None)
+        for thread in workers:
+            thread.join()
+        # The committer commits what was pushed before it exits
+        self._to_commit.put(None)
+        for thread in committer:
+            thread.join()
+        self._threads = []
+        if self._lock_file is not None:
+            os.remove(self._lock_path(self.owner))
+            self._lock_file.close()
+            self._lock_file = None
+        shutil.rmtree(self._incoming_dir, ignore_errors=True)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        # Waits until every job of this queue is done; False on timeout
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: not self._pending, timeout)
+
+    def _lock_path(self, owner: str) -> str:
+        return os.path.join(self._owners_dir, f"{owner}.lock")
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self._jobs_dir, job_id)
+
+    # ===== Request side =====
+
+    def find_queued(self, file_hash: str) -> Optional[dict]:
+        # A job (of any process) that is already storing this content
+        return self.jobs.find_queued(file_hash)
+
+    def submit(
+        self,
+        file_hash: str,
+        hash_algorithm: str,
+        object_name: str,
+        content_type: str,
+        stream: BinaryIO,
+        filename: Optional[str] = None,
+        client_id: Optional[str] = None,
+    ) -> dict:
+        """
+        Spools an upload and queues it. Returns the job once the body is
+        verified and on disk; raises HashMismatchError (nothing is kept),
+        IngestQueueFullError, or OSError if the spool can't be written.
+        filename and client_id are recorded in the catalog with the asset.
+        """
+        with self._pending_changed:
+            if len(self._pending) >= self.max_queued:
+                raise IngestQueueFullError(f"{len(self._pending)} uploads are waiting to be stored")
+
+        job_id = uuid.uuid4().hex
+        incoming_path = os.path.join(self._incoming_dir, job_id)
+        reader = HashVerifyingReader(stream, hash_algorithm, file_hash)
+        try:
+            with open(incoming_path, "wb") as f:
+                while True:
+                    data = reader.read(COPY_CHUNK_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(incoming_path, self._job_path(job_id))
+        except BaseException:
+            try:
+                os.remove(incoming_path)
+            except FileNotFoundError:
+                pass
+            raise
+        if self.fsync:
+            _fsync_dir(self._jobs_dir)
+
+        job = {
+            "job_id": job_id,
+            "hash": file_hash,
+            "hash_algorithm": hash_algorithm,
+            "object_name": object_name,
+            "content_type": content_type,
+            "size": reader.size,
+            "status": "queued",
+            "attempts": 0,
+            "error": None,
+            "owner": self.owner,
+            "filename": filename,
+            "client_id": client_id,
+        }
+        try:
+            self.jobs.create(job)
+        except BaseException:
+            os.remove(self._job_path(job_id))
+            raise
+        self._enqueue(job)
+        INGEST_JOBS.inc(result="accepted")
+        return job
+
+    def _enqueue(self, job: dict) -> None:
+        with self._pending_changed:
+            self._pending.add(job["job_id"])
+        self._to_push.put(job)
+
+    def _finished(self, job_ids: List[str]) -> None:
+        with self._pending_changed:
+            self._pending.difference_update(job_ids)
+            self._pending_changed.notify_all()
+
+    # ===== Background side =====
+
+    def _push_loop(self) -> None:
+        while True:
+            job = self._to_push.get()
+            if job is None:
+                return
+            self._push(job)
+
+    def _push(self, job: dict) -> None:
+        path = self._job_path(job["job_id"])
+        if not os.path.exists(path):
+            # Nothing left to push (e.g. the spool was wiped); can't be retried
+            logger.error("[INGEST] Spooled file of job %s (%s) is missing", job["job_id"], job["hash"])
+            self.jobs.finish([job["job_id"]], "failed", "spooled file is missing")
+            self._finished([job["job_id"]])
+            INGEST_JOBS.inc(result="failed")
+            return
+
+        try:
+            storage = self.get_storage()
+            with INGEST_PUSH_SECONDS.time():
+                if isinstance(storage, LocalStorage):
+                    # The spooled file is never written again, so it can be linked
+                    storage.import_file(job["object_name"], path)
+                else:
+                    with open(path, "rb") as f:
+                        storage.put_stream(job["object_name"], f, job["content_type"])
+        except (StorageError, StorageUnavailableError, OSError) as e:
+            job["attempts"] += 1
+            delay = min(self.retry_delay * 2 ** (job["attempts"] - 1), self.retry_max_delay)
+            logger.warning(
+                "[INGEST] Push of job %s failed (attempt %d), retrying in %gs: %s",
+                job["job_id"], job["attempts"], delay, e,
+            )
+            INGEST_JOBS.inc(result="retried")
+            try:
+                self.jobs.record_attempt(job["job_id"], str(e))
+            except sqlite3.Error as db_error:
+                logger.error("Failed to record the attempt of job %s: %s", job["job_id"], db_error)
+            # Waiting here also slows this worker down while the storage is down
+            if not self._stopping.wait(delay):
+                self._to_push.put(job)
+            return
+
+        job["bucket"] = storage.bucket
+        self._to_commit.put(job)
+
+    def _commit_loop(self) -> None:
+        next_maintenance = time.monotonic() + self.maintenance_interval
+        stopping = False
+        while not stopping:
+            batch: List[dict] = []
+            timeout = max(next_maintenance - time.monotonic(), 0)
+            try:
+                job = self._to_commit.get(timeout=timeout)
+            except queue.Empty:
+                job = None
+            else:
+                if job is None:
+                    stopping = True
+                else:
+                    batch.append(job)
+                    # Collect more for the same transaction, for a short time only
+                    deadline = time.monotonic() + self.commit_interval
+                    while len(batch) < self.commit_batch_size:
+                        try:
+                            job = self._to_commit.get(timeout=max(deadline - time.monotonic(), 0))
+                        except queue.Empty:
+                            break
+                        if job is None:
+                            stopping = True
+                            break
+                        batch.append(job)
+            if batch:
+                self._commit(batch)
+            if time.monotonic() >= next_maintenance and not stopping:
+                self._maintain()
+                next_maintenance = time.monotonic() + self.maintenance_interval
+
+    def _commit(self, batch: List[dict]) -> None:
+        job_ids = [job["job_id"] for job in batch]
+        entries = [
+            (
+                job["hash"],
+                {
+                    "bucket": job["bucket"],
+                    "object_name": job["object_name"],
+                    "hash_algorithm": job["hash_algorithm"],
+                },
+                {
+                    "filename": job.get("filename"),
+                    "size": job["size"],
+                    "content_type": job["content_type"],
+                    "client_id": job.get("client_id"),
+                },
+            )
+            for job in batch
+        ]
+        while True:
+            try:
+                with INGEST_COMMIT_SECONDS.time():
+                    # Index first: a crash in between only replays pushed jobs
+                    self.index.insert_many_if_absent(entries)
+                    self.jobs.finish(job_ids, "done")
+                break
+            except sqlite3.Error as e:
+                logger.error("[INGEST] Failed to commit %d jobs, retrying: %s", len(batch), e)
+                if self._stopping.wait(self.retry_delay):
+                    # Still queued in the job store: the next queue replays them
+                    return
+
+        for job_id in job_ids:
+            try:
+                os.remove(self._job_path(job_id))
+            except FileNotFoundError:
+                pass
+        self._finished(job_ids)
+        INGEST_JOBS.inc(len(batch), result="done")
+        logger.debug("[INGEST] Committed %d jobs", len(batch))
+
+    def _maintain(self) -> None:
+        try:
+            self.recover()
+            self.jobs.prune(time.time() - self.job_ttl)
+        except (OSError, sqlite3.Error) as e:
+            logger.error("[INGEST] Maintenance failed: %s", e)
+
+    def recover(self) -> int:
+        """
+        Claims the queued jobs of every owner that is gone (its lock file is
+        not locked) and queues them here. Returns the number of jobs claimed.
+        """
+        owners = self.jobs.owners()
+        owners.update(
+            name[:-len(".lock")] for name in os.listdir(self._owners_dir) if name.endswith(".lock")
+        )
+        owners.discard(self.owner)
+
+        claimed = 0
+        for owner in owners:
+            with open(self._lock_path(owner), "ab") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # That process is still running
+                    continue
+                jobs = self.jobs.claim(owner, self.owner)
+                shutil.rmtree(os.path.join(self.spool_dir, "incoming", owner), ignore_errors=True)
+                os.remove(self._lock_path(owner))
+            for job in jobs:
+                self._enqueue(job)
+            claimed += len(jobs)
+
+        # Lock files of processes that died while starting (see start)
+        for name in os.listdir(self._owners_dir):
+            path = os.path.join(self._owners_dir, name)
+            try:
+                if name.endswith(".lock.new") and time.time() - os.stat(path).st_mtime > _STALE_LOCK_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+        if claimed:
+            logger.info("[INGEST] Recovered %d spooled uploads", claimed)
+            INGEST_JOBS.inc(claimed, result="recovered")
+        return claimed
@@ -1,109 +1,1631 @@
 import os
+import base64
 import json
-from io import BytesIO
+import hashlib
+import logging
+import mimetypes
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from typing import BinaryIO, Callable, Iterator, List, Optional
+from urllib.parse import unquote
 
-from flask import Flask, request, jsonify
-from minio import Minio
-from minio.error import S3Error
+from flask import Blueprint, Flask, Response, g, request, jsonify, send_file
+from werkzeug.datastructures import ContentRange
+
+from .cache import ReadCache, iter_bytes
+from .compression import DecompressingReader, DecompressionError, supported_encodings
+from .hashing import HashMismatchError, HashVerifyingReader, is_valid_hash
+from .index_store import AssetIndex, ChunkStore, IngestJobStore, UploadSessionStore
+from .ingest import IngestQueue, IngestQueueFullError
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY
+from .storage import (
+    ObjectInfo,
+    ObjectNotFoundError,
+    Storage,
+    StorageError,
+    StorageUnavailableError,
+    create_storage,
+)
+
+logger = logging.getLogger(__name__)
 
 # Base directory of the server/ folder
 BASE_DIR = os.path.dirname(__file__)
 
-# File that stores which hashes already exist on the server
+# SQLite database (WAL) with the asset index and the open upload sessions.
+# It is shared by all worker processes; lookups never load the whole index.
+INDEX_DB_FILE = os.getenv("INDEX_DB_FILE", os.path.join(BASE_DIR, "assets_index.db"))
+
+# Older versions kept these in JSON files; they are imported on first start
 ASSETS_INDEX_FILE = os.path.join(BASE_DIR, "assets_index.json")
+UPLOAD_SESSIONS_FILE = os.path.join(BASE_DIR, "upload_sessions.json")
 
-# In-memory index: { file_hash: { "bucket": ..., "object_name": ... } }
-if os.path.exists(ASSETS_INDEX_FILE):
-    with open(ASSETS_INDEX_FILE, "r", encoding="utf-8") as f:
-        ASSETS_INDEX = json.load(f)
-else:
-    ASSETS_INDEX = {}
 
+# Hash algorithms accepted from clients, in order of preference.
+# Clients pick the first one they support, so all clients agree on one.
+# (sha256 hex digests are 64 chars, blake2b 128, so they never collide in the index)
+HASH_ALGORITHMS = [
+    name.strip()
+    for name in os.getenv("HASH_ALGORITHMS", "sha256").split(",")
+    if name.strip()
+]
 
-def save_assets_index() -> None:
-    """Save the current ASSETS_INDEX dictionary to disk."""
-    with open(ASSETS_INDEX_FILE, "w", encoding="utf-8") as f:
-        json.dump(ASSETS_INDEX, f, indent=2, ensure_ascii=False)
 
+# ===== Storage configuration =====
 
-# ===== MinIO configuration =====
+# "minio" (S3 compatible storage) or "local" (content-addressed store on this disk)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "minio")
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", os.path.join(BASE_DIR, "storage"))
+# Flush every local object to disk before it is indexed
+LOCAL_STORAGE_FSYNC = os.getenv("LOCAL_STORAGE_FSYNC", "1") == "1"
 
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 MINIO_SECURE = False  # http (לא https)
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "assets")
+# Uploads are streamed to MinIO in parts of this size (S3 minimum is 5 MiB)
+MINIO_PART_SIZE = int(os.getenv("MINIO_PART_SIZE", str(8 * 1024 * 1024)))
+# Chunk size of resumable uploads; each chunk becomes one storage part
+# (so it must be at least 5 MiB, the S3 minimum for all parts but the last)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+
+# Connecting to MinIO: attempts, first retry delay (doubled every time, up to
+# the max delay) and connect timeout, all in seconds
+MINIO_CONNECT_ATTEMPTS = int(os.getenv("MINIO_CONNECT_ATTEMPTS", "5"))
+MINIO_RETRY_DELAY = float(os.getenv("MINIO_RETRY_DELAY", "0.5"))
+MINIO_RETRY_MAX_DELAY = float(os.getenv("MINIO_RETRY_MAX_DELAY", "8"))
+MINIO_CONNECT_TIMEOUT = float(os.getenv("MINIO_CONNECT_TIMEOUT", "5"))
+# Connections kept open to MinIO (request threads + batch put threads)
+MINIO_POOL_SIZE = int(os.getenv("MINIO_POOL_SIZE", "32"))
+
+# Downloads from MinIO go through a read cache (see server/cache.py):
+# objects up to READ_CACHE_MEMORY_MAX_OBJECT bytes are kept in memory (in
+# total READ_CACHE_MEMORY_BYTES per worker), bigger ones up to
+# READ_CACHE_DISK_MAX_OBJECT as files in READ_CACHE_DIR (in total
+# READ_CACHE_DISK_BYTES). 0 turns a tier off. Local storage objects already
+# are files on this disk, so they are never cached.
+READ_CACHE_DIR = os.getenv("READ_CACHE_DIR", os.path.join(BASE_DIR, "read_cache"))
+READ_CACHE_MEMORY_BYTES = int(os.getenv("READ_CACHE_MEMORY_BYTES", str(256 * 1024 * 1024)))
+READ_CACHE_MEMORY_MAX_OBJECT = int(os.getenv("READ_CACHE_MEMORY_MAX_OBJECT", str(1024 * 1024)))
+READ_CACHE_DISK_BYTES = int(os.getenv("READ_CACHE_DISK_BYTES", str(10 * 1024 * 1024 * 1024)))
+READ_CACHE_DISK_MAX_OBJECT = int(os.getenv("READ_CACHE_DISK_MAX_OBJECT", str(1024 * 1024 * 1024)))
+
+# Level of the server log (DEBUG, INFO, WARNING, ...)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+
+# Largest accepted request body in bytes (0 = no limit); bigger requests get 413.
+# Files above the client's resumable threshold are sent in chunks, so only
+# PUT /assets/<hash> of a single file comes close to this.
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(5 * 1024 * 1024 * 1024)))
+
 
-minio_client = Minio(
-    MINIO_ENDPOINT,
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=MINIO_SECURE,
+# ===== Ingest mode =====
+#
+# "sync":  an upload is answered once it is in the storage and the index.
+# "async": single-file uploads are answered with 202 and a job id as soon as
+#          the verified body is spooled on the local disk; background workers
+#          push it to the storage and index it (see server/ingest.py).
+INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+# Keep it on the same file system as LOCAL_STORAGE_DIR: then storing a
+# spooled file is a hard link instead of a copy
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", os.path.join(BASE_DIR, "spool"))
+# Threads pushing spooled uploads to the storage (per worker process)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+# Uploads waiting to be stored (per worker process) before new ones get 503
+INGEST_MAX_QUEUED = int(os.getenv("INGEST_MAX_QUEUED", "10000"))
+# Index entries committed per transaction, and the longest wait for a batch (seconds)
+INGEST_COMMIT_BATCH_SIZE = int(os.getenv("INGEST_COMMIT_BATCH_SIZE", "100"))
+INGEST_COMMIT_INTERVAL = float(os.getenv("INGEST_COMMIT_INTERVAL", "0.2"))
+# Flush every spooled body to disk before it is acknowledged
+INGEST_FSYNC = os.getenv("INGEST_FSYNC", "1") == "1"
+
+
+# ===== Metrics (GET /metrics) =====
+
+REQUESTS = REGISTRY.counter(
+    "assets_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "assets_http_request_duration_seconds",
+    "Time until the response of a request is ready (streamed bodies not included)",
+    ("route",),
+)
+UPLOADS = REGISTRY.counter(
+    "assets_uploads_total",
+    "Uploaded files by kind of upload and result "
+    "(new, accepted = queued by the async ingest mode, duplicate = dedup hit, rejected, error)",
+    ("kind", "result"),
 )
+UPLOAD_BYTES = REGISTRY.counter("assets_upload_bytes_total", "Bytes of new content stored")
+EXISTS_CHECKS = REGISTRY.counter(
+    "assets_exists_checks_total", "Hashes clients asked about, by result (found = dedup hit)", ("result",)
+)
+STORAGE_PUT_SECONDS = REGISTRY.histogram(
+    "assets_storage_put_seconds",
+    "Time of one storage write (stream = a whole streamed upload, bytes = a batch record)",
+    ("kind",),
+)
+INDEX_WRITE_SECONDS = REGISTRY.histogram(
+    "assets_index_write_seconds", "Time of one index database write", ("table",)
+)
+
+
+# ===== Lazily created resources =====
+#
+# Nothing here is touched when the module is imported: the storage backend
+# (MinIO client and bucket check) and the index database are set up on
+# first use (or by the warm-up thread started in create_app), so a worker
+# starts in milliseconds, and a MinIO outage at startup doesn't stop the server.
+
+_storage = None
+# { file_hash: { "bucket": ..., "object_name": ..., "hash_algorithm": ... } }
+_assets_index = None
+# Open resumable (chunked) upload sessions, so clients can continue them
+# after a server restart (see UploadSessionStore for the layout)
+_upload_sessions = None
+# Chunks and manifests of assets uploaded in chunked mode
+_chunk_store = None
+# Jobs of the async ingest mode, and the queue running them in this process
+_ingest_jobs = None
+_ingest_queue = None
+# Read cache of downloads (None until first use, see get_read_cache)
+_read_cache = None
+_warmup_thread = None
+# Separate locks: a slow MinIO connect must not block index lookups
+_storage_lock = threading.Lock()
+_index_lock = threading.Lock()
+_cache_lock = threading.Lock()
+_warmup_lock = threading.Lock()
+
+
+def _create_storage() -> Storage:
+    if STORAGE_BACKEND == "local":
+        return create_storage("local", root=LOCAL_STORAGE_DIR, fsync=LOCAL_STORAGE_FSYNC)
+    return create_storage(
+        "minio",
+        endpoint=MINIO_ENDPOINT,
+        access_key=MINIO_ACCESS_KEY,
+        secret_key=MINIO_SECRET_KEY,
+        bucket=MINIO_BUCKET,
+        secure=MINIO_SECURE,
+        part_size=MINIO_PART_SIZE,
+        connect_attempts=MINIO_CONNECT_ATTEMPTS,
+        retry_delay=MINIO_RETRY_DELAY,
+        retry_max_delay=MINIO_RETRY_MAX_DELAY,
+        connect_timeout=MINIO_CONNECT_TIMEOUT,
+        pool_size=MINIO_POOL_SIZE,
+    )
+
+
+def get_storage() -> Storage:
+    # Connects on first use; after a failure the next call tries again
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                storage = _create_storage()
+                storage.connect()
+                _storage = storage
+    return _storage
+
+
+def get_assets_index() -> AssetIndex:
+    global _assets_index
+    if _assets_index is None:
+        with _index_lock:
+            if _assets_index is None:
+                _assets_index = AssetIndex(INDEX_DB_FILE, legacy_json_path=ASSETS_INDEX_FILE)
+    return _assets_index
+
+
+def get_upload_sessions() -> UploadSessionStore:
+    global _upload_sessions
+    if _upload_sessions is None:
+        with _index_lock:
+            if _upload_sessions is None:
+                _upload_sessions = UploadSessionStore(INDEX_DB_FILE, legacy_json_path=UPLOAD_SESSIONS_FILE)
+    return _upload_sessions
+
+
+def get_chunk_store() -> ChunkStore:
+    global _chunk_store
+    if _chunk_store is None:
+        with _index_lock:
+            if _chunk_store is None:
+                _chunk_store = ChunkStore(INDEX_DB_FILE)
+    return _chunk_store
+
+
+def get_ingest_jobs() -> IngestJobStore:
+    global _ingest_jobs
+    if _ingest_jobs is None:
+        with _index_lock:
+            if _ingest_jobs is None:
+                _ingest_jobs = IngestJobStore(INDEX_DB_FILE)
+    return _ingest_jobs
+
+
+def get_ingest_queue() -> IngestQueue:
+    # Started on first use; starting replays the spool of crashed workers
+    global _ingest_queue
+    if _ingest_queue is None:
+        jobs, index = get_ingest_jobs(), get_assets_index()
+        with _index_lock:
+            if _ingest_queue is None:
+                ingest_queue = IngestQueue(
+                    INGEST_SPOOL_DIR,
+                    jobs,
+                    index,
+                    get_storage,
+                    workers=INGEST_WORKERS,
+                    max_queued=INGEST_MAX_QUEUED,
+                    commit_batch_size=INGEST_COMMIT_BATCH_SIZE,
+                    commit_interval=INGEST_COMMIT_INTERVAL,
+                    fsync=INGEST_FSYNC,
+                )
+                ingest_queue.start()
+                _ingest_queue = ingest_queue
+    return _ingest_queue
+
 
-# לוודא שה-bucket קיים
-if not minio_client.bucket_exists(MINIO_BUCKET):
-    minio_client.make_bucket(MINIO_BUCKET)
+def get_read_cache() -> Optional[ReadCache]:
+    # None with local storage or with both tiers off; the disk tier's
+    # directory is indexed on first use
+    global _read_cache
+    if STORAGE_BACKEND == "local" or not (READ_CACHE_MEMORY_BYTES or READ_CACHE_DISK_BYTES):
+        return None
+    if _read_cache is None:
+        with _cache_lock:
+            if _read_cache is None:
+                _read_cache = ReadCache(
+                    READ_CACHE_DIR,
+                    memory_max_bytes=READ_CACHE_MEMORY_BYTES,
+                    memory_max_object_size=READ_CACHE_MEMORY_MAX_OBJECT,
+                    disk_max_bytes=READ_CACHE_DISK_BYTES,
+                    disk_max_object_size=READ_CACHE_DISK_MAX_OBJECT,
+                )
+    return _read_cache
 
 
-app = Flask(__name__)
+def is_ready() -> bool:
+    if INGEST_MODE == "async" and _ingest_queue is None:
+        return False
+    return None not in (_storage, _assets_index, _upload_sessions, _chunk_store)
 
 
-@app.route("/upload", methods=["POST"])
+def _warm_up() -> None:
+    try:
+        get_assets_index()
+        get_upload_sessions()
+        get_chunk_store()
+        if INGEST_MODE == "async":
+            get_ingest_queue()
+        get_read_cache()
+        get_storage()
+        logger.info("[SERVER] Ready")
+    except Exception as e:
+        logger.warning("Warm-up failed, will retry on the next request: %s", e)
+
+
+def start_warmup() -> None:
+    # Sets up the resources in the background (at most one warm-up at a time)
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is not None and _warmup_thread.is_alive():
+            return
+        _warmup_thread = threading.Thread(target=_warm_up, name="warmup", daemon=True)
+        _warmup_thread.start()
+
+
+bp = Blueprint("assets", __name__)
+
+
+def create_app(warmup: bool = True) -> Flask:
+    """
+    Create the Flask app. Cheap: no network or disk access happens here.
+
+    :param warmup: connect to MinIO and open the index in a background
+        thread right away, instead of on the first request
+    """
+    app = Flask(__name__)
+    app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH or None
+    # Behind nginx/Apache: let the front server send local files (X-Sendfile)
+    app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE") == "1"
+    app.register_blueprint(bp)
+    if warmup:
+        start_warmup()
+    return app
+
+
+@bp.before_app_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+@bp.after_app_request
+def _record_request(response: Response) -> Response:
+    # Routes, not URLs, as label: one time series per endpoint, not per hash
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    start = g.get("request_start")
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route=route)
+    return response
+
+
+@bp.app_errorhandler(StorageUnavailableError)
+def storage_unavailable(e: StorageUnavailableError):
+    logger.error("%s", e)
+    return jsonify({"error": "storage_unavailable"}), 503, {"Retry-After": "5"}
+
+
+@bp.route("/healthz", methods=["GET"])
+def healthz():
+    # Liveness: the process is up and serving requests
+    return jsonify({"status": "ok"}), 200
+
+
+@bp.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    Readiness: 200 once the storage is connected and the index is open.
+    Until then 503, and a warm-up is started in the background.
+    """
+    status = {
+        "storage": _storage is not None,
+        "index": None not in (_assets_index, _upload_sessions, _chunk_store),
+    }
+    if is_ready():
+        return jsonify({"status": "ready", **status}), 200
+    start_warmup()
+    return jsonify({"status": "starting", **status}), 503
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus text format (the numbers of this worker process)
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@bp.route("/capabilities", methods=["GET"])
+def capabilities():
+    """
+    Tell clients which optional protocol features this server supports.
+    """
+    return jsonify({
+        "hash_algorithms": HASH_ALGORITHMS,
+        "batch_upload": True,
+        "chunked_upload": True,
+        # Content-Encodings accepted on PUT /assets/<hash> and /upload/batch
+        "compression": supported_encodings(),
+    }), 200
+
+
+# Max number of hashes accepted by one /exists request
+MAX_EXISTS_BATCH = 1000
+
+
+@bp.route("/assets/<file_hash>", methods=["HEAD"])
+def asset_exists(file_hash: str):
+    """
+    200 if an asset with this hash is already stored, 404 otherwise.
+    Lets a client skip sending bytes the server already has.
+    """
+    if file_hash in get_assets_index():
+        return "", 200
+    return "", 404
+
+
+# Content under a hash never changes, so downloads can be cached forever
+ASSET_CACHE_MAX_AGE = 365 * 24 * 3600
+ASSET_CACHE_CONTROL = f"public, max-age={ASSET_CACHE_MAX_AGE}, immutable"
+
+
+@bp.route("/assets/<file_hash>", methods=["GET"])
+def get_asset(file_hash: str):
+    """
+    Download an asset by its hash (streamed, never buffered whole).
+
+    - ETag is the content hash (strong); If-None-Match -> 304
+    - Range: bytes=<start>-<end> -> 206 with that part, 416 if it is
+      outside the file
+    - With local storage the file itself is handed to the WSGI server,
+      which sends it with sendfile where it can (e.g. gunicorn)
+    - Assets uploaded in chunks are streamed chunk by chunk
+    - With remote storage, hot assets are served from the read cache
+      (memory or local disk) without asking the storage at all
+    """
+    entry = get_assets_index().get(file_hash)
+    if entry is None:
+        return jsonify({"error": "not found"}), 404
+    if request.if_none_match.contains_weak(file_hash):
+        # The ETag is the hash: a revalidation is answered from the index
+        # alone, without reading (or caching) the object
+        return _not_modified(file_hash)
+
+    object_name = entry["object_name"]
+    cache = get_read_cache()
+    if cache is not None:
+        cached = cache.get(file_hash, object_name)
+        if cached is not None and cached.data is not None:
+            data = cached.data
+            return _stream_asset(file_hash, cached.info, lambda start, length: iter_bytes(data, start, length))
+        if cached is not None:
+            try:
+                return _send_local_file(file_hash, cached.path, cached.info)
+            except FileNotFoundError:
+                # Evicted by another worker in the meantime
+                cache.forget(file_hash)
+
+    storage = get_storage()
+    manifest = get_chunk_store().get_manifest(file_hash)
+    if manifest is not None:
+        content_type = mimetypes.guess_type(object_name)[0] or "application/octet-stream"
+        info = ObjectInfo(sum(size for _, size in manifest), content_type)
+        read_range = lambda start, length: _iter_manifest_range(storage, manifest, start, length)
+    else:
+        try:
+            info = storage.stat(object_name)
+        except ObjectNotFoundError:
+            logger.error("%s is in the index but not in the storage", object_name)
+            return jsonify({"error": "not found"}), 404
+        except StorageError as e:
+            logger.error("Failed to read %s: %s", object_name, e)
+            return jsonify({"error": "failed_to_read"}), 500
+
+        path = storage.local_path(object_name)
+        if path is not None:
+            return _send_local_file(file_hash, path, info)
+        read_range = lambda start, length: storage.iter_range(object_name, start, length)
+
+    if cache is not None:
+        try:
+            read_range = cache.read_through(file_hash, object_name, info, read_range)
+        except StorageError as e:
+            logger.error("Failed to read %s: %s", object_name, e)
+            return jsonify({"error": "failed_to_read"}), 500
+    return _stream_asset(file_hash, info, read_range)
+
+
+def _send_local_file(file_hash: str, path: str, info: ObjectInfo) -> Response:
+    # Flask handles If-None-Match and Range for files
+    response = send_file(
+        path,
+        mimetype=info.content_type,
+        conditional=True,
+        etag=file_hash,
+        max_age=ASSET_CACHE_MAX_AGE,
+    )
+    response.headers["Cache-Control"] = ASSET_CACHE_CONTROL
+    return response
+
+
+def _not_modified(file_hash: str) -> Response:
+    response = Response(status=304)
+    response.set_etag(file_hash)
+    response.headers["Cache-Control"] = ASSET_CACHE_CONTROL
+    return response
+
+
+def _stream_asset(
+    file_hash: str,
+    info: ObjectInfo,
+    read_range: Callable[[int, int], Iterator[bytes]],
+) -> Response:
+    # Range response for content that is not a local file (get_asset has
+    # already answered If-None-Match).
+    # read_range(start, length) streams that part of the content.
+    response = Response(mimetype=info.content_type)
+    response.set_etag(file_hash)
+    response.headers["Cache-Control"] = ASSET_CACHE_CONTROL
+    response.accept_ranges = "bytes"
+
+    start, length = 0, info.size
+    byte_range = request.range
+    # Several ranges in one request are rare; those get the whole file.
+    # If-Range with another ETag means the client's part is stale.
+    if (
+        byte_range is not None
+        and len(byte_range.ranges) == 1
+        and request.if_range.etag in (None, file_hash)
+    ):
+        bounds = byte_range.range_for_length(info.size)
+        if bounds is None:
+            response.status_code = 416
+            response.content_range = ContentRange("bytes", None, None, info.size)
+            return response
+        start, stop = bounds
+        length = stop - start
+        response.status_code = 206
+        response.content_range = ContentRange("bytes", start, stop, info.size)
+
+    response.response = read_range(start, length)
+    response.content_length = length
+    return response
+
+
+def _iter_manifest_range(storage: Storage, manifest: List[List], start: int, length: int) -> Iterator[bytes]:
+    # Streams [start, start + length) of an asset stored as chunks
+    chunk_start = 0
+    for chunk_hash, size in manifest:
+        if length <= 0:
+            return
+        chunk_end = chunk_start + size
+        if chunk_end > start:
+            offset = start - chunk_start
+            take = min(size - offset, length)
+            yield from storage.iter_range(chunk_object_name(chunk_hash), offset, take)
+            start += take
+            length -= take
+        chunk_start = chunk_end
+
+
+# ===== Catalog =====
+#
+# GET /assets?<filters>&limit=<n>&cursor=<next_cursor of the previous page>
+#
+# filters: extension (e.g. png), content_type (image/png, or image/* for a
+# prefix), client_id, filename_prefix, min_size / max_size (bytes),
+# since / until (first-seen unix time). Entries come oldest first; a page
+# ends with "next_cursor" (null on the last page). Pages are keyset-paginated
+# (see AssetIndex.query) and streamed while they are read from the index.
+
+CATALOG_PAGE_SIZE = 100
+MAX_CATALOG_PAGE_SIZE = 1000
+# Entries per chunk of the streamed response
+CATALOG_STREAM_BATCH = 100
+MAX_CLIENT_ID_LENGTH = 256
+
+
+def _encode_cursor(entry: dict) -> str:
+    raw = json.dumps([entry["first_seen"], entry["hash"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        first_seen, file_hash = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(first_seen), str(file_hash)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("invalid cursor")
+
+
+def _catalog_query(args) -> dict:
+    # Query string -> AssetIndex.query arguments; ValueError if invalid
+    query = {}
+    if args.get("extension"):
+        query["extension"] = args["extension"].lstrip(".").lower()
+    content_type = args.get("content_type")
+    if content_type:
+        if content_type.endswith("/*"):
+            query["content_type_prefix"] = content_type[:-1]
+        else:
+            query["content_type"] = content_type
+    if args.get("client_id"):
+        query["client_id"] = args["client_id"]
+    if args.get("filename_prefix"):
+        query["filename_prefix"] = args["filename_prefix"]
+    for name, convert in (("min_size", int), ("max_size", int), ("since", float), ("until", float)):
+        if args.get(name):
+            try:
+                query[name] = convert(args[name])
+            except ValueError:
+                raise ValueError(f"invalid {name}")
+    try:
+        limit = int(args.get("limit", CATALOG_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("invalid limit")
+    if not 0 < limit <= MAX_CATALOG_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_CATALOG_PAGE_SIZE}")
+    query["limit"] = limit
+    if args.get("cursor"):
+        query["after"] = _decode_cursor(args["cursor"])
+    return query
+
+
+def _stream_catalog_page(entries: Iterator[dict], limit: int) -> Iterator[str]:
+    # `entries` has up to limit + 1 entries: the extra one only says "there is more"
+    yield '{"assets": ['
+    chunk: List[str] = []
+    last = None
+    next_cursor = None
+    for count, entry in enumerate(entries):
+        if count == limit:
+            next_cursor = _encode_cursor(last)
+            break
+        chunk.append(("," if count else "") + json.dumps(entry))
+        last = entry
+        if len(chunk) >= CATALOG_STREAM_BATCH:
+            yield "".join(chunk)
+            chunk = []
+    entries.close()
+    yield "".join(chunk)
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+
+@bp.route("/assets", methods=["GET"])
+def list_assets():
+    """
+    List / search the catalog (see the format above).
+    """
+    try:
+        query = _catalog_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    limit = query.pop("limit")
+    entries = get_assets_index().query(**query, limit=limit + 1)
+    return Response(_stream_catalog_page(entries, limit), mimetype="application/json")
+
+
+@bp.route("/exists", methods=["POST"])
+def exists():
+    """
+    Batch version of HEAD /assets/<hash>.
+
+    Request:  {"hashes": ["<hash>", ...]}
+    Response: {"existing": [<the hashes that are already stored>]}
+    """
+    body = request.get_json(silent=True) or {}
+    hashes = body.get("hashes")
+    if not isinstance(hashes, list):
+        return jsonify({"error": "missing hashes list"}), 400
+    if len(hashes) > MAX_EXISTS_BATCH:
+        return jsonify({"error": f"at most {MAX_EXISTS_BATCH} hashes per request"}), 400
+
+    found = get_assets_index().existing(hashes)
+    existing = [h for h in hashes if h in found]
+    EXISTS_CHECKS.inc(len(existing), result="found")
+    EXISTS_CHECKS.inc(len(hashes) - len(existing), result="missing")
+    return jsonify({"existing": existing}), 200
+
+
+@bp.route("/upload", methods=["POST"])
 def upload_file():
     """
-    Receive a file + its hash from the client and store it on MinIO.
+    Receive a file + its hash from the client (multipart form) and store it on MinIO.
+
+    Kept for older clients. Werkzeug spools big form files to a temporary
+    file, so memory stays bounded, but PUT /assets/<hash> avoids the extra copy.
     """
     uploaded_file = request.files.get("file")
     file_hash = request.form.get("hash")
 
+    # Old clients don't send the algorithm: they always use sha256
+    hash_algorithm = request.form.get("hash_algorithm", "sha256")
+
     if uploaded_file is None or file_hash is None:
         return jsonify({"error": "missing file or hash"}), 400
 
+    return store_upload(
+        file_hash,
+        hash_algorithm,
+        uploaded_file.filename or "uploaded_file",
+        uploaded_file.stream,
+        uploaded_file.mimetype,
+    )
+
+
+class UnsupportedEncodingError(Exception):
+    """Raised when a request body has a Content-Encoding the server can't decode."""
+
+
+@bp.app_errorhandler(UnsupportedEncodingError)
+def unsupported_encoding(e: UnsupportedEncodingError):
+    return jsonify({"error": str(e), "supported": supported_encodings()}), 415
+
+
+def _request_body(max_size: Optional[int]) -> BinaryIO:
+    # The request body, decompressed on the fly if it has a Content-Encoding
+    encoding = request.headers.get("Content-Encoding", "identity").strip().lower()
+    if encoding == "identity":
+        return request.stream
+    if encoding not in supported_encodings():
+        raise UnsupportedEncodingError(f"unsupported content encoding: {encoding}")
+    return DecompressingReader(request.stream, encoding, max_size)
+
+
+@bp.route("/assets/<file_hash>", methods=["PUT"])
+def put_asset(file_hash: str):
+    """
+    Receive a file as the raw request body and stream it to MinIO.
+
+    Headers:
+    - X-File-Name: original file name, percent-encoded (used for the extension)
+    - X-Hash-Algorithm: algorithm of <file_hash> (default sha256)
+    - Content-Type: MIME type stored with the object
+    - Content-Encoding: zstd / gzip if the body is compressed (see
+      /capabilities); the hash is of the decompressed content
+    """
+    return store_upload(
+        file_hash,
+        request.headers.get("X-Hash-Algorithm", "sha256"),
+        unquote(request.headers.get("X-File-Name", "uploaded_file")),
+        _request_body(MAX_CONTENT_LENGTH or None),
+        request.mimetype or "application/octet-stream",
+    )
+
+
+def store_upload(
+    file_hash: str,
+    hash_algorithm: str,
+    orig_filename: str,
+    stream: BinaryIO,
+    content_type: str,
+):
+    """
+    Store one uploaded file under its hash (shared by both upload routes).
+
+    The body is streamed into the storage (with MinIO: a multipart upload,
+    MINIO_PART_SIZE bytes at a time) and hashed on the way. If the content
+    does not match `file_hash` nothing is stored and 400 is returned.
+    In the async ingest mode the body goes to the spool instead, and the
+    answer is 202 with the id of the job that stores it.
+    """
+    if hash_algorithm not in HASH_ALGORITHMS:
+        return jsonify({"error": f"unsupported hash algorithm: {hash_algorithm}"}), 400
+    if not is_valid_hash(file_hash, hash_algorithm):
+        return jsonify({"error": "invalid hash"}), 400
+
     # Check if this hash already exists on the server
-    existing_entry = ASSETS_INDEX.get(file_hash)
+    existing_entry = get_assets_index().get(file_hash)
     if existing_entry is not None:
-        print(f"[DUPLICATE] Received file with existing hash={file_hash}")
-        print(f"           Already stored as: {existing_entry}")
+        logger.info("[DUPLICATE] Received file with existing hash=%s, already stored as: %s", file_hash, existing_entry)
+        UPLOADS.inc(kind="single", result="duplicate")
         return jsonify({
             "status": "already_exists",
             "stored_as": existing_entry,
         }), 200
 
-    # New content: upload to MinIO using hash as the base name
-    orig_filename = uploaded_file.filename or "uploaded_file"
-    _, ext = os.path.splitext(orig_filename)
+    # New content: store it using hash as the base name
+    _, ext = os.path.splitext(os.path.basename(orig_filename))
     object_name = f"{file_hash}{ext}"  # e.g. <hash>.png
 
-    # Read the file into memory (טוב למשימה, קבצים קטנים)
-    file_bytes = uploaded_file.read()
-    file_size = len(file_bytes)
+    if INGEST_MODE == "async":
+        return _ingest_upload(file_hash, hash_algorithm, orig_filename, object_name, stream, content_type)
 
+    # Never holds more than a few parts in memory, whatever the file size
+    reader = HashVerifyingReader(stream, hash_algorithm, file_hash)
+    storage = get_storage()
     try:
-        minio_client.put_object(
-            MINIO_BUCKET,
-            object_name,
-            data=BytesIO(file_bytes),
-            length=file_size,
-            content_type=uploaded_file.mimetype,
+        with STORAGE_PUT_SECONDS.time(kind="stream"):
+            storage.put_stream(object_name, reader, content_type)
+    except HashMismatchError as e:
+        logger.warning("[REJECTED] %s: %s", orig_filename, e)
+        UPLOADS.inc(kind="single", result="rejected")
+        return jsonify({"error": "hash_mismatch"}), 400
+    except DecompressionError as e:
+        logger.warning("[REJECTED] %s: %s", orig_filename, e)
+        UPLOADS.inc(kind="single", result="rejected")
+        return jsonify({"error": "invalid_encoding"}), 400
+    except StorageError as e:
+        logger.error("Failed to store %s: %s", object_name, e)
+        UPLOADS.inc(kind="single", result="error")
+        return jsonify({"error": "failed_to_store"}), 500
+
+    entry = add_to_index(
+        file_hash,
+        object_name,
+        hash_algorithm,
+        {"filename": orig_filename, "size": reader.size, "content_type": content_type, "client_id": _client_id()},
+    )
+    UPLOADS.inc(kind="single", result="new")
+    UPLOAD_BYTES.inc(reader.size)
+
+    logger.info(
+        "[NEW] Received file: %s, hash=%s, size=%d, stored in bucket='%s', object='%s'",
+        orig_filename, file_hash, reader.size, storage.bucket, object_name,
+    )
+
+    return jsonify({"status": "ok", "stored_as": entry}), 200
+
+
+def _job_accepted(job: dict):
+    response = jsonify({"status": "accepted", "job_id": job["job_id"], "hash": job["hash"]})
+    return response, 202, {"Location": f"/jobs/{job['job_id']}"}
+
+
+def _ingest_upload(
+    file_hash: str,
+    hash_algorithm: str,
+    orig_filename: str,
+    object_name: str,
+    stream: BinaryIO,
+    content_type: str,
+):
+    # Async ingest mode: spool the body and answer 202 (see server/ingest.py)
+    ingest_queue = get_ingest_queue()
+    queued = ingest_queue.find_queued(file_hash)
+    if queued is not None:
+        # Already on its way into the storage
+        UPLOADS.inc(kind="single", result="duplicate")
+        return _job_accepted(queued)
+
+    try:
+        job = ingest_queue.submit(
+            file_hash, hash_algorithm, object_name, content_type, stream, orig_filename, _client_id()
         )
-    except S3Error as e:
-        print(f"[ERROR] Failed to upload to MinIO: {e}")
-        return jsonify({"error": "failed_to_upload_to_minio"}), 500
+    except HashMismatchError as e:
+        logger.warning("[REJECTED] %s: %s", orig_filename, e)
+        UPLOADS.inc(kind="single", result="rejected")
+        return jsonify({"error": "hash_mismatch"}), 400
+    except DecompressionError as e:
+        logger.warning("[REJECTED] %s: %s", orig_filename, e)
+        UPLOADS.inc(kind="single", result="rejected")
+        return jsonify({"error": "invalid_encoding"}), 400
+    except IngestQueueFullError as e:
+        logger.warning("Ingest queue is full: %s", e)
+        return jsonify({"error": "ingest_queue_full"}), 503, {"Retry-After": "5"}
+    except OSError as e:
+        logger.error("Failed to spool %s: %s", object_name, e)
+        UPLOADS.inc(kind="single", result="error")
+        return jsonify({"error": "failed_to_store"}), 500
+
+    UPLOADS.inc(kind="single", result="accepted")
+    UPLOAD_BYTES.inc(job["size"])
+    logger.info(
+        "[QUEUED] Received file: %s, hash=%s, size=%d, job=%s", orig_filename, file_hash, job["size"], job["job_id"]
+    )
+    return _job_accepted(job)
+
+
+@bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    """
+    Status of an upload accepted with 202: "queued" until it is in the
+    storage and the index, then "done" (with "stored_as"), or "failed".
+    Finished jobs are forgotten after a day.
+    """
+    job = get_ingest_jobs().get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    status = {key: job[key] for key in ("job_id", "hash", "status", "attempts", "error")}
+    if job["status"] == "done":
+        status["stored_as"] = get_assets_index().get(job["hash"])
+    return jsonify(status), 200
+
+
+def _client_id() -> Optional[str]:
+    # Who uploads: clients send X-Client-Id (recorded in the catalog)
+    client_id = request.headers.get("X-Client-Id", "").strip()
+    return client_id[:MAX_CLIENT_ID_LENGTH] or None
+
 
-    # Update index: remember where this hash is stored
+def add_to_index(file_hash: str, object_name: str, hash_algorithm: str, metadata: Optional[dict] = None) -> dict:
+    # Update index: remember where this hash is stored (and the catalog
+    # metadata of this first upload, see AssetIndex.insert_if_absent).
+    # If a concurrent upload of the same content got there first, its entry wins.
     entry = {
-        "bucket": MINIO_BUCKET,
+        "bucket": get_storage().bucket,
         "object_name": object_name,
+        "hash_algorithm": hash_algorithm,
     }
-    ASSETS_INDEX[file_hash] = entry
-    save_assets_index()
+    with INDEX_WRITE_SECONDS.time(table="assets"):
+        return get_assets_index().insert_if_absent(file_hash, entry, metadata)
 
-    print(f"[NEW] Received file: {orig_filename}, hash={file_hash}")
-    print(f"     Stored in MinIO bucket='{MINIO_BUCKET}', object='{object_name}'")
 
-    return jsonify({"status": "ok", "stored_as": entry}), 200
+# ===== Batch uploads =====
+#
+# POST /upload/batch carries many small files in one request body.
+# The body is a sequence of records, each one:
+#
+#   [4 bytes: header length, big-endian][header: JSON][<size> bytes of content]
+#
+# header = {"hash", "hash_algorithm", "name", "size", "content_type"}
+#
+# The whole body may be compressed (Content-Encoding, as on PUT /assets).
+# A body of more than MAX_BATCH_BYTES (decompressed) is refused with 413.
+#
+# Response: {"results": [{"hash": ..., "status": "ok" | "already_exists" |
+#            "hash_mismatch" | "invalid" | "error"}, ...]} in record order.
+
+BATCH_HEADER_LENGTH = struct.Struct(">I")
+
+# Record status -> result label of the uploads metric
+_BATCH_UPLOAD_RESULTS = {
+    "ok": "new",
+    "already_exists": "duplicate",
+    "hash_mismatch": "rejected",
+    "invalid": "rejected",
+    "error": "error",
+}
+
+# Limits of one batch request (batches are meant for small files only)
+MAX_BATCH_RECORDS = 1000
+MAX_BATCH_RECORD_SIZE = 16 * 1024 * 1024
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(64 * 1024 * 1024)))
+# Content of records queued for a storage put but not stored yet; reading
+# the body waits for the oldest puts beyond this, so a batch never holds
+# more than this much in memory while the storage is slow
+BATCH_IN_FLIGHT_BYTES = int(os.getenv("BATCH_IN_FLIGHT_BYTES", str(16 * 1024 * 1024)))
+
+# Storage puts of one batch run concurrently on this many threads
+BATCH_PUT_WORKERS = int(os.getenv("BATCH_PUT_WORKERS", "8"))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_PUT_WORKERS, thread_name_prefix="batch-put")
+
+
+def _put_batch_record(storage: Storage, object_name: str, content: bytes, content_type: str) -> None:
+    # Runs on the batch put threads
+    with STORAGE_PUT_SECONDS.time(kind="bytes"):
+        storage.put_bytes(object_name, content, content_type)
+
+
+class BatchFormatError(Exception):
+    """Raised when a batch upload body is not a valid sequence of records."""
+
+
+class BatchTooLargeError(Exception):
+    """Raised when a batch upload body is bigger than MAX_BATCH_BYTES."""
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    while len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            raise BatchFormatError("unexpected end of batch body")
+        data += more
+    return data
+
+
+def iter_batch_records(stream: BinaryIO, max_bytes: Optional[int] = None):
+    # Yields (header, content) for every record of a batch body; raises
+    # BatchTooLargeError before reading past `max_bytes` (None = no limit)
+    count = 0
+    total = 0
+
+    def take(size: int) -> None:
+        nonlocal total
+        total += size
+        if max_bytes is not None and total > max_bytes:
+            raise BatchTooLargeError(f"batch body is bigger than {max_bytes} bytes")
+
+    while True:
+        raw_length = stream.read(BATCH_HEADER_LENGTH.size)
+        if not raw_length:
+            return
+        if len(raw_length) < BATCH_HEADER_LENGTH.size:
+            raw_length += _read_exactly(stream, BATCH_HEADER_LENGTH.size - len(raw_length))
+        take(BATCH_HEADER_LENGTH.size)
+        (header_length,) = BATCH_HEADER_LENGTH.unpack(raw_length)
+        if header_length > 64 * 1024:
+            raise BatchFormatError("record header too long")
+        take(header_length)
+        try:
+            header = json.loads(_read_exactly(stream, header_length))
+            size = int(header["size"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise BatchFormatError(f"invalid record header: {e}")
+        if not 0 <= size <= MAX_BATCH_RECORD_SIZE:
+            raise BatchFormatError("record too big for a batch")
+
+        count += 1
+        if count > MAX_BATCH_RECORDS:
+            raise BatchFormatError(f"at most {MAX_BATCH_RECORDS} records per batch")
+        take(size)
+        yield header, _read_exactly(stream, size)
+
+
+@bp.route("/upload/batch", methods=["POST"])
+def upload_batch():
+    """
+    Receive many small files in one request (see the format above).
+    Every record is deduplicated against the index and new ones are
+    stored with concurrent puts.
+    """
+    if request.content_length is not None and request.content_length > MAX_BATCH_BYTES:
+        return jsonify({"error": f"batch body is bigger than {MAX_BATCH_BYTES} bytes"}), 413
+
+    storage = get_storage()
+    client_id = _client_id()
+    results = []
+    # (index in results, file_hash, object_name, hash_algorithm, metadata, future)
+    pending_puts = []
+    # (size, future) of the puts that may still be running, oldest first
+    in_flight: "deque[tuple]" = deque()
+    in_flight_bytes = 0
+    hashes_in_batch = set()
+
+    try:
+        # iter_batch_records stops first (413); the decompression limit only
+        # allows for the record length it reads before checking
+        body = _request_body(MAX_BATCH_BYTES + BATCH_HEADER_LENGTH.size)
+        for header, content in iter_batch_records(body, MAX_BATCH_BYTES):
+            file_hash = header.get("hash")
+            hash_algorithm = header.get("hash_algorithm", "sha256")
+            result = {"hash": file_hash}
+            results.append(result)
+
+            if (
+                not isinstance(file_hash, str)
+                or hash_algorithm not in HASH_ALGORITHMS
+                or not is_valid_hash(file_hash, hash_algorithm)
+            ):
+                result["status"] = "invalid"
+                continue
+            if file_hash in get_assets_index() or file_hash in hashes_in_batch:
+                result["status"] = "already_exists"
+                continue
+            if hashlib.new(hash_algorithm, content).hexdigest() != file_hash:
+                result["status"] = "hash_mismatch"
+                continue
+
+            hashes_in_batch.add(file_hash)
+            name = str(header.get("name") or "")
+            _, ext = os.path.splitext(os.path.basename(name))
+            object_name = f"{file_hash}{ext}"
+            metadata = {
+                "filename": name or None,
+                "size": len(content),
+                "content_type": header.get("content_type") or "application/octet-stream",
+                "client_id": client_id,
+            }
+            future = batch_executor.submit(
+                _put_batch_record,
+                storage,
+                object_name,
+                content,
+                metadata["content_type"],
+            )
+            pending_puts.append((len(results) - 1, file_hash, object_name, hash_algorithm, metadata, future))
+            in_flight.append((len(content), future))
+            in_flight_bytes += len(content)
+            while in_flight_bytes > BATCH_IN_FLIGHT_BYTES:
+                size, oldest = in_flight.popleft()
+                futures_wait([oldest])
+                in_flight_bytes -= size
+    except BatchTooLargeError as e:
+        logger.error("Batch upload refused: %s", e)
+        for *_, future in pending_puts:
+            future.cancel()
+        return jsonify({"error": str(e)}), 413
+    except (BatchFormatError, DecompressionError) as e:
+        # Nothing of this batch is indexed; the client sends the files again
+        logger.error("Invalid batch upload: %s", e)
+        for *_, future in pending_puts:
+            future.cancel()
+        return jsonify({"error": str(e)}), 400
+
+    stored = 0
+    for index, file_hash, object_name, hash_algorithm, metadata, future in pending_puts:
+        try:
+            future.result()
+        except StorageError as e:
+            logger.error("Failed to store %s: %s", object_name, e)
+            results[index]["status"] = "error"
+            continue
+        add_to_index(file_hash, object_name, hash_algorithm, metadata)
+        results[index]["status"] = "ok"
+        stored += 1
+        UPLOAD_BYTES.inc(metadata["size"])
+
+    for result in results:
+        UPLOADS.inc(kind="batch", result=_BATCH_UPLOAD_RESULTS[result["status"]])
+    logger.info("[BATCH] Received %d files, stored %d new", len(results), stored)
+    return jsonify({"results": results}), 200
+
+
+# ===== Resumable (chunked) uploads =====
+#
+# POST   /uploads                          -> start a session (or "already_exists")
+# GET    /uploads/<upload_id>              -> which chunks the server already has
+# PUT    /uploads/<upload_id>/chunks/<i>   -> send chunk i (raw body)
+# POST   /uploads/<upload_id>/complete     -> assemble, verify the hash, add to index
+# DELETE /uploads/<upload_id>              -> give up
+#
+# Every chunk is one part of a storage multipart upload, so an interrupted
+# 20 GB upload continues from the last chunk the server acknowledged.
+#
+# Verifying means reading the whole object back, which for a multi-GB file
+# takes longer than a client waits for a response. It runs in a background
+# thread: if it is done within UPLOAD_COMPLETE_WAIT seconds, complete answers
+# with the result; otherwise with 202 {"status": "verifying"}, and the client
+# polls GET /uploads/<upload_id> until the session is gone (done or
+# rejected, HEAD /assets/<hash> tells which).
+
+UPLOAD_COMPLETE_WAIT = float(os.getenv("UPLOAD_COMPLETE_WAIT", "20"))
+# A worker completing a session holds it for this long (seconds) and renews
+# it while hashing; if the worker dies, the next complete takes over
+UPLOAD_COMPLETE_LEASE = 60.0
+
+
+def _session_status(upload_id: str, session: dict) -> dict:
+    return {
+        "upload_id": upload_id,
+        "hash": session["hash"],
+        "size": session["size"],
+        "chunk_size": session["chunk_size"],
+        "received": sorted(int(index) for index in session["parts"]),
+        "status": "verifying" if session["verifying_until"] > time.time() else "open",
+    }
+
+
+@bp.route("/uploads", methods=["POST"])
+def create_upload_session():
+    """
+    Request: {"hash", "hash_algorithm", "filename", "size", "content_type"}
+    """
+    body = request.get_json(silent=True) or {}
+    file_hash = body.get("hash")
+    hash_algorithm = body.get("hash_algorithm", "sha256")
+    orig_filename = body.get("filename") or "uploaded_file"
+    size = body.get("size")
+
+    if hash_algorithm not in HASH_ALGORITHMS:
+        return jsonify({"error": f"unsupported hash algorithm: {hash_algorithm}"}), 400
+    if not isinstance(file_hash, str) or not is_valid_hash(file_hash, hash_algorithm):
+        return jsonify({"error": "invalid hash"}), 400
+    if not isinstance(size, int) or size < 1:
+        return jsonify({"error": "invalid size"}), 400
+
+    existing_entry = get_assets_index().get(file_hash)
+    if existing_entry is not None:
+        UPLOADS.inc(kind="resumable", result="duplicate")
+        return jsonify({"status": "already_exists", "stored_as": existing_entry}), 200
+
+    _, ext = os.path.splitext(os.path.basename(orig_filename))
+    object_name = f"{file_hash}{ext}"
+    content_type = body.get("content_type") or "application/octet-stream"
+    upload_id = uuid.uuid4().hex
+    # The parts are joined under a name of this session: content that turns
+    # out not to match the hash never lands on <hash><ext>
+    part_object = f"upload-{upload_id}{ext}"
+    try:
+        storage_upload_id = get_storage().create_multipart(part_object, content_type)
+    except StorageError as e:
+        logger.error("Failed to start multipart upload of %s: %s", object_name, e)
+        return jsonify({"error": "failed_to_store"}), 500
+
+    session = {
+        "hash": file_hash,
+        "hash_algorithm": hash_algorithm,
+        "object_name": object_name,
+        "part_object": part_object,
+        "size": size,
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        # Id of the multipart upload in the storage backend
+        "minio_upload_id": storage_upload_id,
+        "parts": {},
+        "filename": orig_filename,
+        "content_type": content_type,
+        "assembled": 0,
+        "verifying_until": 0.0,
+    }
+    with INDEX_WRITE_SECONDS.time(table="upload_sessions"):
+        get_upload_sessions().create(upload_id, session)
+
+    logger.info("[SESSION] Started upload %s for %s (%d bytes)", upload_id, orig_filename, size)
+    return jsonify({"status": "created", **_session_status(upload_id, session)}), 201
+
+
+@bp.route("/uploads/<upload_id>", methods=["GET"])
+def get_upload_session(upload_id: str):
+    session = get_upload_sessions().get(upload_id)
+    if session is None:
+        return jsonify({"error": "unknown upload"}), 404
+    return jsonify(_session_status(upload_id, session)), 200
+
+
+@bp.route("/uploads/<upload_id>/chunks/<int:index>", methods=["PUT"])
+def put_upload_chunk(upload_id: str, index: int):
+    session = get_upload_sessions().get(upload_id)
+    if session is None:
+        return jsonify({"error": "unknown upload"}), 404
+
+    chunk_size = session["chunk_size"]
+    chunk_count = (session["size"] + chunk_size - 1) // chunk_size
+    if index >= chunk_count:
+        return jsonify({"error": "chunk index out of range"}), 400
+    expected_length = min(chunk_size, session["size"] - index * chunk_size)
+    if request.content_length != expected_length:
+        return jsonify({"error": f"chunk {index} must be {expected_length} bytes"}), 400
+
+    # One chunk (a few MiB) is the most this request ever holds in memory
+    data = request.stream.read(expected_length)
+    if len(data) != expected_length:
+        return jsonify({"error": "incomplete chunk"}), 400
+
+    try:
+        with STORAGE_PUT_SECONDS.time(kind="part"):
+            etag = get_storage().upload_part(
+                _part_object(session),
+                session["minio_upload_id"],
+                index + 1,  # part numbers start at 1
+                data,
+            )
+    except StorageError as e:
+        logger.error("Failed to store chunk %d of %s: %s", index, upload_id, e)
+        return jsonify({"error": "failed_to_store"}), 500
+
+    with INDEX_WRITE_SECONDS.time(table="upload_parts"):
+        get_upload_sessions().add_part(upload_id, index, etag)
+    return jsonify({"status": "ok", "index": index}), 200
+
+
+@bp.route("/uploads/<upload_id>/complete", methods=["POST"])
+def complete_upload_session(upload_id: str):
+    sessions = get_upload_sessions()
+    session = sessions.get(upload_id)
+    if session is None:
+        return jsonify({"error": "unknown upload"}), 404
+
+    chunk_size = session["chunk_size"]
+    chunk_count = (session["size"] + chunk_size - 1) // chunk_size
+    missing = [i for i in range(chunk_count) if str(i) not in session["parts"]]
+    if missing:
+        return jsonify({"error": "missing chunks", "missing": missing}), 409
+
+    if not sessions.claim_completion(upload_id, UPLOAD_COMPLETE_LEASE):
+        # Another request (maybe a retry of this one) is verifying it
+        return _verifying(upload_id)
+    result = _finish_in_background(f"complete-{upload_id[:8]}", _complete_session, upload_id, session, _client_id())
+    if result is None:
+        return _verifying(upload_id)
+    return jsonify(result["body"]), result["status"]
+
+
+def _finish_in_background(name: str, target: Callable[..., None], *args) -> Optional[dict]:
+    """
+    Runs target(*args, result) on its own thread; target puts the response
+    into `result` as "status" / "body". Returns `result` if it is done
+    within UPLOAD_COMPLETE_WAIT seconds, else None (still running).
+    """
+    result: dict = {}
+    thread = threading.Thread(target=target, args=(*args, result), name=name, daemon=True)
+    thread.start()
+    thread.join(UPLOAD_COMPLETE_WAIT)
+    if thread.is_alive():
+        return None
+    return result
+
+
+def _verifying(upload_id: str):
+    response = jsonify({"status": "verifying", "upload_id": upload_id})
+    return response, 202, {"Location": f"/uploads/{upload_id}"}
+
+
+def _part_object(session: dict) -> str:
+    # Sessions started by older versions join their parts straight into
+    # the final object
+    return session["part_object"] or session["object_name"]
+
+
+def _discard_session_object(session: dict) -> None:
+    # Drops what a session stored: its multipart upload, or the object the
+    # parts were joined into (never the final object of an older session)
+    storage = get_storage()
+    part_object = _part_object(session)
+    try:
+        if not session["assembled"]:
+            storage.abort_multipart(part_object, session["minio_upload_id"])
+        elif part_object != session["object_name"]:
+            storage.remove(part_object)
+    except StorageError as e:
+        logger.warning("Failed to discard %s: %s", part_object, e)
+
+
+def _complete_session(upload_id: str, session: dict, client_id: Optional[str], result: dict) -> None:
+    # Runs on its own thread (see complete_upload_session); puts the response
+    # into `result` as "status" / "body"
+    sessions = get_upload_sessions()
+    storage = get_storage()
+    object_name, file_hash = session["object_name"], session["hash"]
+    part_object = _part_object(session)
+    chunk_count = len(session["parts"])
+
+    existing_entry = get_assets_index().get(file_hash)
+    if existing_entry is not None:
+        # Stored by another upload since this session started: nothing to do
+        sessions.delete(upload_id)
+        _discard_session_object(session)
+        UPLOADS.inc(kind="resumable", result="duplicate")
+        logger.info("[SKIP] Upload %s: %s is already stored", upload_id, file_hash)
+        result.update(status=200, body={"status": "already_exists", "stored_as": existing_entry})
+        return
+
+    content_type = (
+        session["content_type"]
+        # (sessions started by older versions have none)
+        or mimetypes.guess_type(object_name)[0]
+        or "application/octet-stream"
+    )
+    try:
+        if not session["assembled"]:
+            etags = [session["parts"][str(i)] for i in range(chunk_count)]
+            storage.complete_multipart(part_object, session["minio_upload_id"], etags)
+            sessions.mark_assembled(upload_id)
+            session["assembled"] = 1
+        actual_hash = _hash_stored_object(
+            part_object,
+            session["hash_algorithm"],
+            on_progress=lambda: sessions.extend_completion(upload_id, UPLOAD_COMPLETE_LEASE),
+        )
+        if actual_hash == file_hash and part_object != object_name:
+            # Replaces a concurrent upload of the same content, if any
+            storage.rename(part_object, object_name, content_type)
+    except Exception as e:
+        logger.error("Failed to complete multipart upload %s: %s", upload_id, e)
+        sessions.release_completion(upload_id)
+        UPLOADS.inc(kind="resumable", result="error")
+        result.update(status=500, body={"error": "failed_to_store"})
+        return
+
+    sessions.delete(upload_id)
+
+    if actual_hash != file_hash:
+        # Never keep content under a hash it doesn't have
+        logger.warning("[REJECTED] Upload %s: content hash %s does not match %s", upload_id, actual_hash, file_hash)
+        if part_object != object_name:
+            _discard_session_object(session)
+        elif get_assets_index().get(file_hash) is None:
+            # (an older session, joined into the final object: keep it if a
+            # valid upload of the same hash was indexed meanwhile)
+            storage.remove(object_name)
+        UPLOADS.inc(kind="resumable", result="rejected")
+        result.update(status=400, body={"error": "hash_mismatch"})
+        return
+
+    entry = add_to_index(
+        file_hash,
+        object_name,
+        session["hash_algorithm"],
+        {
+            "filename": session["filename"],
+            "size": session["size"],
+            "content_type": content_type,
+            "client_id": client_id,
+        },
+    )
+    UPLOADS.inc(kind="resumable", result="new")
+    UPLOAD_BYTES.inc(session["size"])
+    logger.info("[NEW] Completed resumable upload %s, hash=%s, size=%d", upload_id, file_hash, session["size"])
+    result.update(status=200, body={"status": "ok", "stored_as": entry})
+
+
+@bp.route("/uploads/<upload_id>", methods=["DELETE"])
+def abort_upload_session(upload_id: str):
+    session = get_upload_sessions().delete(upload_id)
+    if session is None:
+        return jsonify({"error": "unknown upload"}), 404
+    _discard_session_object(session)
+    return jsonify({"status": "aborted"}), 200
+
+
+# ===== Chunked uploads (block-level dedup) =====
+#
+# POST /chunks/missing   {"hashes": [...]} -> {"missing": [the ones not stored yet]}
+# PUT  /chunks/<hash>    raw chunk content (hash checked like PUT /assets)
+# POST /manifests        assemble an asset from stored chunks:
+#     {"hash", "hash_algorithm", "filename", "size",
+#      "chunks": [[chunk_hash, size], ...]}    (in file order)
+# GET  /manifests/<hash>  {"status": "ok" | "verifying" | <error>}
+#
+# The whole content is hashed before a manifest is indexed. As for
+# resumable uploads, that runs in the background: POST /manifests answers
+# 202 {"status": "verifying"} if it isn't done within UPLOAD_COMPLETE_WAIT
+# seconds, and the client polls GET /manifests/<hash>.
+#
+# Clients split big files into content-defined chunks (client/hash_utils.py),
+# so after an edit only the changed chunks are new: those are all that is
+# sent and stored. Chunks are storage objects named <hash>.chunk; the
+# manifest (chunk list) of every chunked asset is kept in the index database.
+
+# Largest accepted chunk (clients use at most 4 MiB)
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+# Max number of chunks in one manifest (16 TiB of 1 MiB chunks)
+MAX_MANIFEST_CHUNKS = 16 * 1024 * 1024
+
+
+def chunk_object_name(chunk_hash: str) -> str:
+    return f"{chunk_hash}.chunk"
+
+
+@bp.route("/chunks/missing", methods=["POST"])
+def missing_chunks():
+    body = request.get_json(silent=True) or {}
+    hashes = body.get("hashes")
+    if not isinstance(hashes, list) or not all(isinstance(h, str) for h in hashes):
+        return jsonify({"error": "missing hashes list"}), 400
+    if len(hashes) > MAX_EXISTS_BATCH:
+        return jsonify({"error": f"at most {MAX_EXISTS_BATCH} hashes per request"}), 400
+    return jsonify({"missing": get_chunk_store().missing(hashes)}), 200
+
+
+@bp.route("/chunks/<chunk_hash>", methods=["PUT"])
+def put_chunk(chunk_hash: str):
+    hash_algorithm = request.headers.get("X-Hash-Algorithm", "sha256")
+    if hash_algorithm not in HASH_ALGORITHMS:
+        return jsonify({"error": f"unsupported hash algorithm: {hash_algorithm}"}), 400
+    if not is_valid_hash(chunk_hash, hash_algorithm):
+        return jsonify({"error": "invalid hash"}), 400
+    if request.content_length is None or request.content_length > MAX_CHUNK_SIZE:
+        return jsonify({"error": f"chunks must have a Content-Length of at most {MAX_CHUNK_SIZE}"}), 400
+
+    chunk_store = get_chunk_store()
+    if not chunk_store.missing([chunk_hash]):
+        return jsonify({"status": "already_exists"}), 200
+
+    reader = HashVerifyingReader(request.stream, hash_algorithm, chunk_hash)
+    try:
+        with STORAGE_PUT_SECONDS.time(kind="chunk"):
+            get_storage().put_stream(chunk_object_name(chunk_hash), reader, "application/octet-stream")
+    except HashMismatchError as e:
+        logger.warning("[REJECTED] Chunk %s: %s", chunk_hash, e)
+        return jsonify({"error": "hash_mismatch"}), 400
+    except StorageError as e:
+        logger.error("Failed to store chunk %s: %s", chunk_hash, e)
+        return jsonify({"error": "failed_to_store"}), 500
+
+    with INDEX_WRITE_SECONDS.time(table="chunks"):
+        chunk_store.add_chunk(chunk_hash, reader.size)
+    UPLOAD_BYTES.inc(reader.size)
+    return jsonify({"status": "ok"}), 200
+
+
+@bp.route("/manifests", methods=["POST"])
+def create_manifest():
+    """
+    Store an asset made of already uploaded chunks.
+
+    409 with {"missing": [...]} if some chunks are not on the server;
+    the whole content is hashed before it is indexed, as with any upload
+    (202 if that takes longer than UPLOAD_COMPLETE_WAIT, see above).
+    """
+    body = request.get_json(silent=True) or {}
+    file_hash = body.get("hash")
+    hash_algorithm = body.get("hash_algorithm", "sha256")
+    orig_filename = body.get("filename") or "uploaded_file"
+    size = body.get("size")
+    chunks = body.get("chunks")
+
+    if hash_algorithm not in HASH_ALGORITHMS:
+        return jsonify({"error": f"unsupported hash algorithm: {hash_algorithm}"}), 400
+    if not isinstance(file_hash, str) or not is_valid_hash(file_hash, hash_algorithm):
+        return jsonify({"error": "invalid hash"}), 400
+    if (
+        not isinstance(chunks, list)
+        or not 0 < len(chunks) <= MAX_MANIFEST_CHUNKS
+        or not all(
+            isinstance(chunk, list)
+            and len(chunk) == 2
+            and isinstance(chunk[0], str)
+            and is_valid_hash(chunk[0], hash_algorithm)
+            and isinstance(chunk[1], int)
+            and 0 < chunk[1] <= MAX_CHUNK_SIZE
+            for chunk in chunks
+        )
+    ):
+        return jsonify({"error": "invalid chunk list"}), 400
+    if size != sum(chunk_size for _, chunk_size in chunks):
+        return jsonify({"error": "chunk sizes don't add up to the file size"}), 400
+
+    existing_entry = get_assets_index().get(file_hash)
+    if existing_entry is not None:
+        UPLOADS.inc(kind="chunked", result="duplicate")
+        return jsonify({"status": "already_exists", "stored_as": existing_entry}), 200
+
+    chunk_store = get_chunk_store()
+    missing = []
+    for start in range(0, len(chunks), 500):
+        missing.extend(chunk_store.missing(chunk_hash for chunk_hash, _ in chunks[start:start + 500]))
+    if missing:
+        return jsonify({"error": "missing chunks", "missing": sorted(set(missing))}), 409
+
+    if not chunk_store.claim_check(file_hash, UPLOAD_COMPLETE_LEASE):
+        # Another request (maybe a retry of this one) is verifying it
+        return _manifest_verifying(file_hash)
+    result = _finish_in_background(
+        f"manifest-{file_hash[:8]}",
+        _verify_manifest,
+        file_hash,
+        hash_algorithm,
+        orig_filename,
+        size,
+        chunks,
+        _client_id(),
+    )
+    if result is None:
+        return _manifest_verifying(file_hash)
+    return jsonify(result["body"]), result["status"]
+
+
+def _manifest_verifying(file_hash: str):
+    response = jsonify({"status": "verifying", "hash": file_hash})
+    return response, 202, {"Location": f"/manifests/{file_hash}"}
+
+
+def _verify_manifest(
+    file_hash: str,
+    hash_algorithm: str,
+    orig_filename: str,
+    size: int,
+    chunks: List[List],
+    client_id: Optional[str],
+    result: dict,
+) -> None:
+    # Runs on its own thread (see create_manifest); never index content
+    # under a hash it doesn't have
+    chunk_store = get_chunk_store()
+    storage = get_storage()
+    hasher = hashlib.new(hash_algorithm)
+    last_progress = time.monotonic()
+    try:
+        for data in _iter_manifest_range(storage, chunks, 0, size):
+            hasher.update(data)
+            if time.monotonic() - last_progress >= 10:
+                chunk_store.extend_check(file_hash, UPLOAD_COMPLETE_LEASE)
+                last_progress = time.monotonic()
+    except Exception as e:
+        logger.error("Failed to read the chunks of %s: %s", file_hash, e)
+        chunk_store.end_check(file_hash, "failed_to_read")
+        UPLOADS.inc(kind="chunked", result="error")
+        result.update(status=500, body={"error": "failed_to_read"})
+        return
+    if hasher.hexdigest() != file_hash:
+        logger.warning(
+            "[REJECTED] Manifest of %s: content hash %s does not match %s", orig_filename, hasher.hexdigest(), file_hash
+        )
+        chunk_store.end_check(file_hash, "hash_mismatch")
+        UPLOADS.inc(kind="chunked", result="rejected")
+        result.update(status=400, body={"error": "hash_mismatch"})
+        return
+
+    _, ext = os.path.splitext(os.path.basename(orig_filename))
+    with INDEX_WRITE_SECONDS.time(table="manifests"):
+        chunk_store.save_manifest(file_hash, chunks)
+    entry = add_to_index(
+        file_hash,
+        f"{file_hash}{ext}",
+        hash_algorithm,
+        {
+            "filename": orig_filename,
+            "size": size,
+            "content_type": mimetypes.guess_type(orig_filename)[0] or "application/octet-stream",
+            "client_id": client_id,
+        },
+    )
+    chunk_store.end_check(file_hash)
+    UPLOADS.inc(kind="chunked", result="new")
+    logger.info("[NEW] Assembled %s from %d chunks, hash=%s, size=%d", orig_filename, len(chunks), file_hash, size)
+    result.update(status=200, body={"status": "ok", "stored_as": entry})
+
+
+@bp.route("/manifests/<file_hash>", methods=["GET"])
+def get_manifest_status(file_hash: str):
+    # Result of a POST /manifests that answered 202
+    entry = get_assets_index().get(file_hash)
+    if entry is not None:
+        return jsonify({"status": "ok", "stored_as": entry}), 200
+    check = get_chunk_store().get_check(file_hash)
+    if check is None:
+        return jsonify({"error": "unknown manifest"}), 404
+    if check["verifying_until"] > time.time():
+        return jsonify({"status": "verifying", "hash": file_hash}), 200
+    # Rejected, or the verifying worker died: POST the manifest again
+    return jsonify({"status": check["error"] or "failed"}), 200
+
+
+def _hash_stored_object(
+    object_name: str, hash_algorithm: str, on_progress: Optional[Callable[[], None]] = None
+) -> str:
+    # Reads an object back from the storage (streamed) and returns its hash;
+    # on_progress is called about every 10 seconds while it reads
+    hasher = hashlib.new(hash_algorithm)
+    last_progress = time.monotonic()
+    for data in get_storage().iter_chunks(object_name):
+        hasher.update(data)
+        if on_progress is not None and time.monotonic() - last_progress >= 10:
+            on_progress()
+            last_progress = time.monotonic()
+    return hasher.hexdigest()
 
 
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=8000, debug=True)
+    # Development server only; use `python -m server.serve` in production
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+    create_app().run(host="127.0.0.1", port=8000, debug=os.getenv("FLASK_DEBUG") == "1")
@@ -0,0 +1,52 @@
+import threading
+from typing import Dict, Sequence
+
+from common.metrics import DEFAULT_BUCKETS, Counter, Histogram
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Registry:
+    """
+    The metrics of one process, rendered for GET /metrics.
+
+    Every worker process has its own registry, so with several workers a
+    scrape shows the numbers of whichever worker answered it (counters of
+    one worker still only go up, but not all traffic is in them).
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Re-importing a module must not register a metric twice
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, labelnames, help_text=help_text))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, labelnames, buckets, help_text=help_text))
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
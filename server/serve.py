@@ -0,0 +1,302 @@
+"""
+Production entry point of the asset server.
+
+    python -m server.serve --workers 4 --port 8000
+
+Every worker is a separate process with its own MinIO client; they share
+the SQLite index (server/assets_index.db), so dedup stays correct across
+workers. The WSGI server is picked in this order (see --backend):
+
+- gunicorn (gthread workers) if it is installed
+- waitress if it is installed and a single worker is asked for
+  (waitress has no worker processes, only threads)
+- werkzeug's threaded server, pre-forked into `workers` processes that
+  accept connections on one shared listening socket; a worker that dies
+  is replaced
+
+All settings can also be given as environment variables:
+SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_THREADS, SERVER_KEEPALIVE,
+SERVER_TIMEOUT, MAX_CONTENT_LENGTH, LOG_LEVEL.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("auto", "gunicorn", "waitress", "werkzeug")
+
+# A werkzeug worker that dies sooner than this after its start (seconds) is
+# replaced only after a delay, doubled every time up to RESPAWN_MAX_DELAY,
+# so a worker that can't start doesn't fork in a tight loop
+RESPAWN_MIN_UPTIME = 10.0
+RESPAWN_DELAY = 1.0
+RESPAWN_MAX_DELAY = 30.0
+
+
+def _module_available(name: str) -> bool:
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
+
+
+def choose_backend(requested: str, workers: int) -> str:
+    if requested != "auto":
+        return requested
+    if _module_available("gunicorn"):
+        return "gunicorn"
+    if _module_available("waitress") and (workers == 1 or not hasattr(os, "fork")):
+        return "waitress"
+    return "werkzeug"
+
+
+def _load_app():
+    # Created in the worker process, never before fork (MinIO / SQLite
+    # connections can't be shared); it connects in the background
+    from server.main import create_app
+    return create_app()
+
+
+def serve_gunicorn(args: argparse.Namespace) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class AssetServer(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "worker_class": "gthread",
+                "threads": args.threads,
+                "keepalive": args.keepalive,
+                # Big uploads take a while; don't kill a busy worker
+                "timeout": args.timeout,
+                "preload_app": False,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return _load_app()
+
+    AssetServer().run()
+
+
+def serve_waitress(args: argparse.Namespace) -> None:
+    from waitress import serve
+
+    serve(
+        _load_app(),
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        channel_timeout=args.timeout,
+        max_request_body_size=args.max_content_length or sys.maxsize,
+    )
+
+
+def serve_werkzeug(args: argparse.Namespace) -> None:
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(1024)
+    listener.set_inheritable(True)
+    logger.info(
+        "[SERVER] Listening on http://%s:%d (%d worker(s), werkzeug)", args.host, args.port, args.workers
+    )
+
+    if args.workers == 1 or not hasattr(os, "fork"):
+        _run_werkzeug_worker(listener, args)
+        return
+
+    def spawn() -> int:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                _run_werkzeug_worker(listener, args)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        return pid
+
+    pool = WorkerPool(spawn, args.workers)
+    signal.signal(signal.SIGTERM, pool.stop)
+    try:
+        pool.run()
+    finally:
+        listener.close()
+
+
+class WorkerPool:
+    """
+    Keeps `workers` forked worker processes running until stop() is called
+    (e.g. from a SIGTERM handler): a worker that exits or crashes is
+    replaced by a new one.
+    """
+
+    def __init__(self, spawn: Callable[[], int], workers: int) -> None:
+        """
+        :param spawn: forks one worker and returns its pid (in the parent)
+        :param workers: number of worker processes
+        """
+        self.spawn = spawn
+        self.workers = workers
+        # pid -> time.monotonic() of its start
+        self.children: Dict[int, float] = {}
+        self.stopping = False
+        self._delay = RESPAWN_DELAY
+
+    def _start_one(self) -> None:
+        self.children[self.spawn()] = time.monotonic()
+
+    def run(self) -> None:
+        # Returns once stopped and every worker has exited
+        for _ in range(self.workers):
+            self._start_one()
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                return
+            except KeyboardInterrupt:
+                self.stop()
+                continue
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+
+            logger.warning(
+                "[SERVER] Worker %d exited (status %d), starting a new one", pid, os.waitstatus_to_exitcode(status)
+            )
+            if time.monotonic() - started < RESPAWN_MIN_UPTIME:
+                time.sleep(self._delay)
+                self._delay = min(self._delay * 2, RESPAWN_MAX_DELAY)
+            else:
+                self._delay = RESPAWN_DELAY
+            if not self.stopping:
+                self._start_one()
+
+    def stop(self, signum=None, frame=None) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def make_request_handler(keepalive: float, timeout: float):
+    """
+    werkzeug request handler class with two socket timeouts (seconds):
+    `keepalive` while waiting for the next request on a connection,
+    `timeout` once a request has started (reading a big body from a slow
+    client, writing the response).
+    """
+    from werkzeug.serving import WSGIRequestHandler
+
+    class RequestHandler(WSGIRequestHandler):
+        # HTTP/1.1: connections are kept alive between requests
+        protocol_version = "HTTP/1.1"
+
+        def handle_one_request(self) -> None:
+            # Idle connections are closed after `keepalive` seconds
+            self.connection.settimeout(keepalive)
+            super().handle_one_request()
+
+        def parse_request(self) -> bool:
+            # Called once the request line is in
+            self.connection.settimeout(timeout)
+            return super().parse_request()
+
+    return RequestHandler
+
+
+def _run_werkzeug_worker(listener: socket.socket, args: argparse.Namespace) -> None:
+    from werkzeug.serving import make_server
+
+    RequestHandler = make_request_handler(args.keepalive, args.timeout)
+
+    if not args.access_log:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    server = make_server(
+        args.host,
+        args.port,
+        _load_app(),
+        threaded=True,
+        request_handler=RequestHandler,
+        fd=listener.fileno(),
+    )
+    server.serve_forever()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the asset server")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("SERVER_WORKERS", str(os.cpu_count() or 1))),
+        help="number of worker processes",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=int(os.getenv("SERVER_THREADS", "8")),
+        help="request threads per worker (gunicorn / waitress)",
+    )
+    parser.add_argument(
+        "--keepalive", type=int, default=int(os.getenv("SERVER_KEEPALIVE", "15")),
+        help="seconds an idle keep-alive connection stays open",
+    )
+    parser.add_argument(
+        "--timeout", type=int, default=int(os.getenv("SERVER_TIMEOUT", "300")),
+        help="seconds a single request may take (gunicorn), or may stall while "
+        "its body is read or its response written (waitress, werkzeug)",
+    )
+    parser.add_argument(
+        "--max-content-length", type=int, default=int(os.getenv("MAX_CONTENT_LENGTH", str(5 * 1024 ** 3))),
+        help="largest accepted request body in bytes (0 = no limit)",
+    )
+    parser.add_argument("--backend", choices=BACKENDS, default=os.getenv("SERVER_BACKEND", "auto"))
+    parser.add_argument("--access-log", action="store_true", help="log every request (werkzeug)")
+    parser.add_argument(
+        "--log-level", default=os.getenv("LOG_LEVEL", "INFO").upper(),
+        help="DEBUG shows every duplicate / skipped file, WARNING only problems",
+    )
+    args = parser.parse_args(argv)
+    args.workers = max(1, args.workers)
+    args.threads = max(1, args.threads)
+    return args
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    # Read by server.main in every worker
+    os.environ["MAX_CONTENT_LENGTH"] = str(args.max_content_length)
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(message)s")
+
+    backend = choose_backend(args.backend, args.workers)
+    if backend == "gunicorn":
+        serve_gunicorn(args)
+    elif backend == "waitress":
+        if args.workers > 1:
+            logger.warning("[SERVER] waitress runs a single process; --workers is ignored")
+        serve_waitress(args)
+    else:
+        serve_werkzeug(args)
+
+
+if __name__ == "__main__":
+    main()
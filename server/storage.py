@@ -0,0 +1,586 @@
+import errno
+import fcntl
+import logging
+import mimetypes
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from io import BytesIO
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional
+
+import urllib3
+from minio import Minio
+from minio.commonconfig import ComposeSource
+from minio.datatypes import Part
+from minio.error import S3Error
+
+logger = logging.getLogger(__name__)
+
+# Chunk size used when streaming objects in and out of a backend
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# ioctl that makes dst share src's blocks (btrfs, XFS, ...): "reflink"
+FICLONE = 0x40049409
+
+# copy_file_range / sendfile fail with these when the files don't support
+# them (other file system, old kernel, ...); the next method is tried then
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+class StorageError(Exception):
+    """Raised when a storage backend fails to store or read an object."""
+
+
+class ObjectNotFoundError(StorageError):
+    """Raised when an object does not exist in the storage."""
+
+
+class StorageUnavailableError(Exception):
+    """Raised when the storage can't be reached at all (the request gets a 503)."""
+
+
+class ObjectInfo(NamedTuple):
+    size: int
+    content_type: str
+
+
+class Storage:
+    """
+    Interface of a storage backend: where asset content lives.
+
+    Objects are addressed by name (<hash><ext>). Writes become visible
+    atomically: a reader sees the whole object or nothing. Failures raise
+    StorageError; a HashMismatchError raised by the stream passed to
+    put_stream propagates unchanged and nothing is stored.
+
+    Multipart uploads back the resumable upload sessions: parts are
+    numbered from 1 and joined in order by complete_multipart. A session
+    completes under a name of its own and the server renames the object
+    into place once its content hash has been checked.
+    """
+
+    # Stored in the index entry of every object ("bucket")
+    bucket = ""
+
+    def connect(self) -> None:
+        # Prepares the backend; raises StorageUnavailableError if it can't
+        pass
+
+    def put_stream(self, object_name: str, stream: BinaryIO, content_type: str) -> None:
+        raise NotImplementedError
+
+    def put_bytes(self, object_name: str, data: bytes, content_type: str) -> None:
+        raise NotImplementedError
+
+    def create_multipart(self, object_name: str, content_type: str) -> str:
+        raise NotImplementedError
+
+    def upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        # Returns the part's etag, needed by complete_multipart
+        raise NotImplementedError
+
+    def complete_multipart(self, object_name: str, upload_id: str, etags: List[str]) -> None:
+        raise NotImplementedError
+
+    def abort_multipart(self, object_name: str, upload_id: str) -> None:
+        raise NotImplementedError
+
+    def iter_chunks(self, object_name: str, chunk_size: int = COPY_CHUNK_SIZE) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def stat(self, object_name: str) -> ObjectInfo:
+        raise NotImplementedError
+
+    def iter_range(
+        self, object_name: str, start: int, length: int, chunk_size: int = COPY_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        # Streams `length` bytes of the object starting at `start`
+        raise NotImplementedError
+
+    def local_path(self, object_name: str) -> Optional[str]:
+        # Path of the object on this machine, if the backend keeps it in a
+        # file (lets the server send it with sendfile); None otherwise
+        return None
+
+    def remove(self, object_name: str) -> None:
+        raise NotImplementedError
+
+    def rename(self, object_name: str, new_name: str, content_type: str) -> None:
+        # Moves the object to new_name, replacing whatever is stored there
+        raise NotImplementedError
+
+
+# ===== MinIO =====
+
+@contextmanager
+def _minio_errors():
+    try:
+        yield
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchObject"):
+            raise ObjectNotFoundError(str(e)) from e
+        raise StorageError(str(e)) from e
+    except urllib3.exceptions.HTTPError as e:
+        raise StorageError(str(e)) from e
+
+
+# minio-py has no public API for a multipart upload driven by the caller
+# part by part (put_object runs a whole upload in one call), which resumable
+# upload sessions need. Its private helpers do it; they are only called
+# from MinioMultipart, with their signatures in minio 7.2 (tested with
+# 7.2.20, the version pinned in requirements.txt). Check them when
+# upgrading minio.
+_MINIO_MULTIPART_METHODS = (
+    "_create_multipart_upload",
+    "_upload_part",
+    "_complete_multipart_upload",
+    "_abort_multipart_upload",
+)
+
+
+class MinioMultipart:
+    """
+    Multipart uploads of one bucket, part by part (see above).
+
+    If the installed minio lacks the helpers, every call raises
+    StorageError: single uploads keep working, only resumable ones fail.
+    """
+
+    def __init__(self, client: Minio, bucket: str) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.missing = [name for name in _MINIO_MULTIPART_METHODS if not callable(getattr(client, name, None))]
+        if self.missing:
+            logger.warning(
+                "This minio version has no %s: resumable uploads will fail, install the version in requirements.txt",
+                ", ".join(self.missing),
+            )
+
+    def _check(self) -> None:
+        if self.missing:
+            raise StorageError(f"multipart uploads not supported by this minio version (no {', '.join(self.missing)})")
+
+    def create(self, object_name: str, content_type: str) -> str:
+        self._check()
+        return self.client._create_multipart_upload(self.bucket, object_name, {"Content-Type": content_type})
+
+    def upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        self._check()
+        return self.client._upload_part(self.bucket, object_name, data, None, upload_id, part_number)
+
+    def complete(self, object_name: str, upload_id: str, etags: List[str]) -> None:
+        self._check()
+        parts = [Part(number, etag) for number, etag in enumerate(etags, start=1)]
+        self.client._complete_multipart_upload(self.bucket, object_name, upload_id, parts)
+
+    def abort(self, object_name: str, upload_id: str) -> None:
+        self._check()
+        self.client._abort_multipart_upload(self.bucket, object_name, upload_id)
+
+
+class MinioStorage(Storage):
+    """
+    Objects in a MinIO (S3) bucket.
+
+    Streams are sent as multipart uploads of `part_size` bytes, so memory
+    stays bounded whatever the file size; MinIO aborts the upload when the
+    stream raises.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        access_key: str,
+        secret_key: str,
+        bucket: str,
+        secure: bool = False,
+        part_size: int = 8 * 1024 * 1024,
+        connect_attempts: int = 5,
+        retry_delay: float = 0.5,
+        retry_max_delay: float = 8.0,
+        connect_timeout: float = 5.0,
+        pool_size: int = 32,
+    ) -> None:
+        """
+        :param connect_attempts: connect() tries this often before giving up
+        :param retry_delay: first delay between attempts, doubled every time
+            up to retry_max_delay (seconds)
+        :param pool_size: HTTP connections kept open to MinIO
+        """
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.part_size = part_size
+        self.connect_attempts = max(1, connect_attempts)
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.client = Minio(
+            endpoint,
+            access_key=access_key,
+            secret_key=secret_key,
+            secure=secure,
+            http_client=urllib3.PoolManager(
+                timeout=urllib3.Timeout(connect=connect_timeout, read=300),
+                maxsize=pool_size,
+                retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+            ),
+        )
+        self.multipart = MinioMultipart(self.client, bucket)
+
+    def connect(self) -> None:
+        delay = self.retry_delay
+        for attempt in range(1, self.connect_attempts + 1):
+            try:
+                # לוודא שה-bucket קיים
+                if not self.client.bucket_exists(self.bucket):
+                    self.client.make_bucket(self.bucket)
+                return
+            except (S3Error, urllib3.exceptions.HTTPError, OSError) as e:
+                if attempt == self.connect_attempts:
+                    raise StorageUnavailableError(f"MinIO at {self.endpoint} is not reachable: {e}") from e
+                logger.warning("MinIO not reachable (attempt %d/%d): %s", attempt, self.connect_attempts, e)
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_max_delay)
+
+    def put_stream(self, object_name: str, stream: BinaryIO, content_type: str) -> None:
+        with _minio_errors():
+            self.client.put_object(
+                self.bucket,
+                object_name,
+                data=stream,
+                length=-1,
+                part_size=self.part_size,
+                content_type=content_type,
+            )
+
+    def put_bytes(self, object_name: str, data: bytes, content_type: str) -> None:
+        with _minio_errors():
+            self.client.put_object(
+                self.bucket,
+                object_name,
+                data=BytesIO(data),
+                length=len(data),
+                content_type=content_type,
+            )
+
+    def create_multipart(self, object_name: str, content_type: str) -> str:
+        with _minio_errors():
+            return self.multipart.create(object_name, content_type)
+
+    def upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        with _minio_errors():
+            return self.multipart.upload_part(object_name, upload_id, part_number, data)
+
+    def complete_multipart(self, object_name: str, upload_id: str, etags: List[str]) -> None:
+        with _minio_errors():
+            self.multipart.complete(object_name, upload_id, etags)
+
+    def abort_multipart(self, object_name: str, upload_id: str) -> None:
+        with _minio_errors():
+            self.multipart.abort(object_name, upload_id)
+
+    def iter_chunks(self, object_name: str, chunk_size: int = COPY_CHUNK_SIZE) -> Iterator[bytes]:
+        with _minio_errors():
+            response = self.client.get_object(self.bucket, object_name)
+            try:
+                yield from response.stream(chunk_size)
+            finally:
+                response.close()
+                response.release_conn()
+
+    def stat(self, object_name: str) -> ObjectInfo:
+        with _minio_errors():
+            info = self.client.stat_object(self.bucket, object_name)
+        return ObjectInfo(info.size, info.content_type or "application/octet-stream")
+
+    def iter_range(
+        self, object_name: str, start: int, length: int, chunk_size: int = COPY_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        if length <= 0:
+            return
+        with _minio_errors():
+            response = self.client.get_object(self.bucket, object_name, offset=start, length=length)
+            try:
+                yield from response.stream(chunk_size)
+            finally:
+                response.close()
+                response.release_conn()
+
+    def remove(self, object_name: str) -> None:
+        with _minio_errors():
+            self.client.remove_object(self.bucket, object_name)
+
+    def rename(self, object_name: str, new_name: str, content_type: str) -> None:
+        # S3 has no rename: a server-side copy (compose handles objects over
+        # the 5 GiB copy limit), then the source is dropped
+        with _minio_errors():
+            self.client.compose_object(
+                self.bucket,
+                new_name,
+                [ComposeSource(self.bucket, object_name)],
+                metadata={"Content-Type": content_type},
+            )
+            self.client.remove_object(self.bucket, object_name)
+
+
+# ===== Local disk =====
+
+def _copy_file_range(src_fd: int, dst_fd: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count)
+
+
+def _sendfile(src_fd: int, dst_fd: int, count: int) -> int:
+    return os.sendfile(dst_fd, src_fd, None, count)
+
+
+def _read_write(src_fd: int, dst_fd: int, count: int) -> int:
+    data = os.read(src_fd, min(count, COPY_CHUNK_SIZE))
+    view = memoryview(data)
+    while view:
+        view = view[os.write(dst_fd, view):]
+    return len(data)
+
+
+def copy_file_data(src_fd: int, dst_fd: int, count: int) -> None:
+    """
+    Copy `count` bytes from src_fd to dst_fd, both at their current offsets.
+
+    Uses copy_file_range (the data never leaves the kernel, and some file
+    systems just share the blocks), then sendfile, then plain read/write.
+    """
+    methods = [_read_write]
+    if hasattr(os, "sendfile"):
+        methods.insert(0, _sendfile)
+    if hasattr(os, "copy_file_range"):
+        methods.insert(0, _copy_file_range)
+
+    copied = 0
+    for method in methods:
+        try:
+            while copied < count:
+                n = method(src_fd, dst_fd, count - copied)
+                if n == 0:
+                    raise StorageError(f"source ended after {copied} of {count} bytes")
+                copied += n
+            return
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+
+
+class LocalStorage(Storage):
+    """
+    Content-addressed store on the local disk.
+
+    <root>/ab/cd/<object_name>  where "abcd" are the first characters of the
+    object name (the hash), so no directory grows past a few thousand files.
+
+    Every object is written to <root>/tmp first and renamed into place only
+    when complete, so readers never see partial files, and a crash leaves
+    at most a stray temp file behind. Parts of multipart uploads are kept in
+    <root>/uploads/<upload_id>/ and joined with copy_file_range.
+    """
+
+    bucket = "local"
+
+    def __init__(self, root: str, fsync: bool = True) -> None:
+        """
+        :param root: directory of the store (created if missing)
+        :param fsync: flush every object to disk before it becomes visible
+        """
+        self.root = os.path.abspath(root)
+        self.fsync = fsync
+        self._tmp_dir = os.path.join(self.root, "tmp")
+        self._uploads_dir = os.path.join(self.root, "uploads")
+
+    def connect(self) -> None:
+        try:
+            os.makedirs(self._tmp_dir, exist_ok=True)
+            os.makedirs(self._uploads_dir, exist_ok=True)
+        except OSError as e:
+            raise StorageUnavailableError(f"local storage at {self.root} is not usable: {e}") from e
+
+    def path(self, object_name: str) -> str:
+        # Where the object is (or would be) stored
+        if os.sep in object_name or object_name.startswith("."):
+            raise StorageError(f"invalid object name: {object_name}")
+        return os.path.join(self.root, object_name[:2], object_name[2:4], object_name)
+
+    def _temp_path(self) -> str:
+        return os.path.join(self._tmp_dir, uuid.uuid4().hex)
+
+    def _commit(self, temp_path: str, object_name: str) -> None:
+        final_path = self.path(object_name)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        # Atomic: replaces a concurrent copy of the same content, if any
+        os.replace(temp_path, final_path)
+
+    @contextmanager
+    def _writing(self, object_name: str):
+        # Yields an open temp file; commits it if the block succeeds, else deletes it
+        temp_path = self._temp_path()
+        try:
+            with open(temp_path, "wb") as f:
+                yield f
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._commit(temp_path, object_name)
+        except OSError as e:
+            self._discard(temp_path)
+            raise StorageError(str(e)) from e
+        except BaseException:
+            self._discard(temp_path)
+            raise
+
+    @staticmethod
+    def _discard(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def put_stream(self, object_name: str, stream: BinaryIO, content_type: str) -> None:
+        with self._writing(object_name) as f:
+            while True:
+                data = stream.read(COPY_CHUNK_SIZE)
+                if not data:
+                    break
+                f.write(data)
+
+    def put_bytes(self, object_name: str, data: bytes, content_type: str) -> None:
+        with self._writing(object_name) as f:
+            f.write(data)
+
+    def import_file(self, object_name: str, source_path: str, link: bool = True) -> None:
+        """
+        Store an existing file (e.g. a spooled upload) without copying its
+        bytes if possible: hard link (same file system), reflink, then
+        copy_file_range. Only link files that are never modified afterwards.
+        """
+        if link:
+            temp_path = self._temp_path()
+            try:
+                os.link(source_path, temp_path)
+                self._commit(temp_path, object_name)
+                return
+            except OSError:
+                self._discard(temp_path)
+
+        with open(source_path, "rb") as src, self._writing(object_name) as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+            copy_file_data(src.fileno(), dst.fileno(), os.fstat(src.fileno()).st_size)
+
+    def _upload_dir(self, upload_id: str) -> str:
+        if not upload_id.isalnum():
+            raise StorageError(f"invalid upload id: {upload_id}")
+        return os.path.join(self._uploads_dir, upload_id)
+
+    def create_multipart(self, object_name: str, content_type: str) -> str:
+        upload_id = uuid.uuid4().hex
+        try:
+            os.makedirs(self._upload_dir(upload_id))
+        except OSError as e:
+            raise StorageError(str(e)) from e
+        return upload_id
+
+    def upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        part_path = os.path.join(self._upload_dir(upload_id), str(part_number))
+        temp_path = self._temp_path()
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            # A re-sent part replaces the old one in one step
+            os.replace(temp_path, part_path)
+        except OSError as e:
+            self._discard(temp_path)
+            raise StorageError(str(e)) from e
+        return f"{part_number}-{len(data)}"
+
+    def complete_multipart(self, object_name: str, upload_id: str, etags: List[str]) -> None:
+        upload_dir = self._upload_dir(upload_id)
+        with self._writing(object_name) as dst:
+            for number in range(1, len(etags) + 1):
+                with open(os.path.join(upload_dir, str(number)), "rb") as part:
+                    size = os.fstat(part.fileno()).st_size
+                    copy_file_data(part.fileno(), dst.fileno(), size)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def abort_multipart(self, object_name: str, upload_id: str) -> None:
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+
+    def open(self, object_name: str) -> BinaryIO:
+        try:
+            return open(self.path(object_name), "rb")
+        except FileNotFoundError as e:
+            raise ObjectNotFoundError(str(e)) from e
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def stat(self, object_name: str) -> ObjectInfo:
+        try:
+            size = os.stat(self.path(object_name)).st_size
+        except FileNotFoundError as e:
+            raise ObjectNotFoundError(str(e)) from e
+        except OSError as e:
+            raise StorageError(str(e)) from e
+        # Content types are not kept on disk; the extension tells it
+        content_type = mimetypes.guess_type(object_name)[0] or "application/octet-stream"
+        return ObjectInfo(size, content_type)
+
+    def iter_range(
+        self, object_name: str, start: int, length: int, chunk_size: int = COPY_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        with self.open(object_name) as f:
+            f.seek(start)
+            while length > 0:
+                data = f.read(min(chunk_size, length))
+                if not data:
+                    return
+                length -= len(data)
+                yield data
+
+    def local_path(self, object_name: str) -> Optional[str]:
+        return self.path(object_name)
+
+    def iter_chunks(self, object_name: str, chunk_size: int = COPY_CHUNK_SIZE) -> Iterator[bytes]:
+        with self.open(object_name) as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    return
+                yield data
+
+    def remove(self, object_name: str) -> None:
+        try:
+            os.remove(self.path(object_name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def rename(self, object_name: str, new_name: str, content_type: str) -> None:
+        source_path = self.path(object_name)
+        try:
+            self._commit(source_path, new_name)
+        except FileNotFoundError as e:
+            raise ObjectNotFoundError(str(e)) from e
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+
+def create_storage(backend: str, **settings) -> Storage:
+    """
+    :param backend: "minio" or "local"
+    :param settings: constructor arguments of the chosen backend
+    """
+    if backend == "minio":
+        return MinioStorage(**settings)
+    if backend == "local":
+        return LocalStorage(**settings)
+    raise ValueError(f"unknown storage backend: {backend}")
@@ -0,0 +1,35 @@
+import os
+import sys
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks import suite
+
+
+def test_suite_runs_every_benchmark_and_compares(monkeypatch):
+    # A tiny scale: this only checks that the harness still works
+    monkeypatch.setitem(suite.SCALES, "tiny", {
+        "small_files": 30,
+        "small_size": "1K",
+        "huge_size": "64K",
+        "depth": 2,
+        "fanout": 2,
+        "state_entries": [100],
+        "upload_files": 10,
+        "upload_size": "2K",
+        "catalog_assets": 300,
+    })
+
+    report = suite.run("tiny", list(suite.BENCHMARKS), repeat=1)
+
+    measured = {(r["benchmark"], r["case"]) for r in report["results"]}
+    assert {"hash", "scan", "state", "upload", "catalog"} == {benchmark for benchmark, _ in measured}
+    assert ("scan", "warm_dirs_cached") in measured
+    assert all(r["value"] > 0 for r in report["results"])
+
+    rows = suite.compare(report, report)
+    assert len(rows) == len(report["results"])
+    assert all(row["change"] == 0 for row in rows)
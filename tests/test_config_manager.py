@@ -47,3 +47,32 @@ def test_config_manager_updates_watch_directory(tmp_path):
     # נטען מחדש מאותו config_path
     manager2 = ConfigManager(config_path=str(config_file))
     assert manager2.get_watch_directory() == new_dir
+
+
+def test_config_manager_watch_roots(tmp_path):
+    config_file = tmp_path / "config.json"
+    manager = ConfigManager(config_path=str(config_file))
+
+    # בלי watch_roots: תיקיית המעקב היחידה, עם ההגדרות הגלובליות
+    manager.config.update({"watch_directory": "/data/inbox", "recursive": True, "exclude": ["*.tmp"]})
+    assert manager.get_watch_roots() == [{
+        "path": "/data/inbox",
+        "priority": 1.0,
+        "recursive": True,
+        "exclude": ["*.tmp"],
+        "include": [],
+        "use_default_ignores": True,
+    }]
+
+    # כמה תיקיות, כל אחת עם הגדרות משלה (או נתיב בלבד)
+    manager.config["watch_roots"] = [
+        {"path": "/data/urgent", "priority": 4, "recursive": False, "include": ["*.pdf"]},
+        "/data/videos",
+    ]
+    urgent, videos = manager.get_watch_roots()
+    assert (urgent["path"], urgent["priority"], urgent["recursive"], urgent["include"]) == ("/data/urgent", 4.0, False, ["*.pdf"])
+    assert (videos["path"], videos["priority"], videos["recursive"]) == ("/data/videos", 1.0, True)
+
+    assert manager.get_upload_limit_mbps() is None
+    manager.config["upload_limit_mbps"] = 20
+    assert manager.get_upload_limit_mbps() == 20.0
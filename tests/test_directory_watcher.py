@@ -1,5 +1,7 @@
 import os
 import sys
+import threading
+import time
 
 # הוספת תיקיית הפרויקט ל-sys.path
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -9,6 +11,8 @@ if PROJECT_ROOT not in sys.path:
 from client.watcher import DirectoryWatcher
 from client.state_manager import StateManager
 from client.hash_utils import calculate_file_hash
+from client.scheduler import Scheduler
+from client.uploader import UploadResult
 
 
 class FakeUploader:
@@ -18,12 +22,26 @@ class FakeUploader:
     """
     def __init__(self):
         self.uploaded_calls = []
+        # hashes the fake "server" already has
+        self.existing_hashes = set()
+
+    def find_existing(self, file_hashes):
+        return self.existing_hashes & set(file_hashes)
 
     def upload_file(self, file_path: str, file_hash: str) -> bool:
         # just remember that we were called
         self.uploaded_calls.append((file_path, file_hash))
         return True
 
+    def upload_many(self, items, on_result=None, root=None):
+        results = []
+        for file_path, file_hash in items:
+            result = UploadResult(file_path, file_hash, self.upload_file(file_path, file_hash))
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+        return results
+
 
 def test_watcher_uploads_new_file_and_marks_state(tmp_path):
     # create a temporary watch directory
@@ -89,3 +107,268 @@ def test_watcher_does_not_reupload_already_uploaded_file(tmp_path):
 
     # second scan - should not upload again (because of state)
     assert uploader.uploaded_calls == []
+
+
+def test_watcher_does_not_rehash_unchanged_file(tmp_path, monkeypatch):
+    import client.watcher as watcher_module
+
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    (watch_dir / "a.txt").write_text("hello world", encoding="utf-8")
+
+    state = StateManager(state_path=str(tmp_path / "state.json"))
+    watcher = DirectoryWatcher(
+        watch_directory=str(watch_dir),
+        state_manager=state,
+        uploader=FakeUploader(),
+    )
+    watcher.scan_once()
+
+    # count how many times the file is hashed from now on
+    hashed = []
+
+    def counting_hash(path, *args, **kwargs):
+        hashed.append(path)
+        return calculate_file_hash(path, *args, **kwargs)
+
+    monkeypatch.setattr(watcher_module, "calculate_file_hash", counting_hash)
+
+    # same size / mtime / inode -> no reading of the file at all
+    watcher.scan_once()
+    assert hashed == []
+
+    # paranoid mode hashes everything again, but still doesn't re-upload
+    paranoid = DirectoryWatcher(
+        watch_directory=str(watch_dir),
+        state_manager=state,
+        uploader=FakeUploader(),
+        paranoid_interval=3600,
+    )
+    paranoid.scan_once()
+    assert len(hashed) == 1
+    assert paranoid.uploader.uploaded_calls == []
+
+
+def test_watcher_reuploads_file_when_content_changes(tmp_path):
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    file_path = watch_dir / "a.txt"
+    file_path.write_text("hello world", encoding="utf-8")
+
+    state = StateManager(state_path=str(tmp_path / "state.json"))
+    uploader = FakeUploader()
+    watcher = DirectoryWatcher(
+        watch_directory=str(watch_dir),
+        state_manager=state,
+        uploader=uploader,
+    )
+    watcher.scan_once()
+
+    file_path.write_text("hello world, again", encoding="utf-8")
+    uploader.uploaded_calls.clear()
+    watcher.scan_once()
+
+    assert uploader.uploaded_calls == [(str(file_path), calculate_file_hash(str(file_path)))]
+
+
+def _wait_for(condition, timeout=5.0):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_watcher_event_mode_uploads_new_file(tmp_path):
+    import threading
+
+    import pytest
+    from client.inotify import inotify_available
+
+    if not inotify_available():
+        pytest.skip("inotify is only available on Linux")
+
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    # already there before watching starts -> picked up by the startup scan
+    (watch_dir / "old.txt").write_text("old", encoding="utf-8")
+
+    state = StateManager(state_path=str(tmp_path / "state.json"))
+    uploader = FakeUploader()
+    watcher = DirectoryWatcher(
+        watch_directory=str(watch_dir),
+        state_manager=state,
+        uploader=uploader,
+    )
+
+    thread = threading.Thread(target=watcher.watch, kwargs={"debounce": 0.1}, daemon=True)
+    thread.start()
+    try:
+        assert _wait_for(lambda: len(uploader.uploaded_calls) == 1)
+
+        new_file = watch_dir / "new.txt"
+        new_file.write_text("new", encoding="utf-8")
+        assert _wait_for(lambda: len(uploader.uploaded_calls) == 2)
+        assert uploader.uploaded_calls[1][0] == str(new_file)
+    finally:
+        watcher.stop()
+        thread.join(timeout=5)
+
+    assert not thread.is_alive()
+
+
+def test_watcher_event_mode_retries_failed_upload(tmp_path, monkeypatch):
+    import pytest
+    from client import watcher as watcher_module
+    from client.inotify import inotify_available
+
+    if not inotify_available():
+        pytest.skip("inotify is only available on Linux")
+    monkeypatch.setattr(watcher_module, "_RETRY_DELAY", 0.1)
+
+    class FlakyUploader(FakeUploader):
+        # the server is down for the first upload
+        def upload_file(self, file_path, file_hash):
+            super().upload_file(file_path, file_hash)
+            return len(self.uploaded_calls) > 1
+
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    state = StateManager(state_path=str(tmp_path / "state.json"))
+    uploader = FlakyUploader()
+    watcher = DirectoryWatcher(watch_directory=str(watch_dir), state_manager=state, uploader=uploader)
+
+    thread = threading.Thread(target=watcher.watch, kwargs={"debounce": 0.1}, daemon=True)
+    thread.start()
+    try:
+        time.sleep(0.3)
+        new_file = watch_dir / "new.txt"
+        new_file.write_text("new", encoding="utf-8")
+        # nothing changes the file again: only the retry uploads it
+        assert _wait_for(lambda: state.is_uploaded(str(new_file), calculate_file_hash(str(new_file))))
+        assert len(uploader.uploaded_calls) == 2
+    finally:
+        watcher.stop()
+        thread.join(timeout=5)
+
+
+def test_watcher_parallel_pipeline_uploads_every_file_once(tmp_path):
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    for i in range(50):
+        (watch_dir / f"file_{i}.txt").write_text(f"content {i}", encoding="utf-8")
+
+    state = StateManager(state_path=str(tmp_path / "state.json"))
+    uploader = FakeUploader()
+    watcher = DirectoryWatcher(
+        watch_directory=str(watch_dir),
+        state_manager=state,
+        uploader=uploader,
+        hash_workers=4,
+        upload_workers=3,
+        queue_size=2,
+    )
+    watcher.scan_once()
+
+    uploaded_paths = sorted(path for path, _ in uploader.uploaded_calls)
+    assert uploaded_paths == sorted(str(p) for p in watch_dir.iterdir())
+    assert len(state.get_uploaded_files()) == 50
+
+
+def test_watchers_of_several_roots_share_one_scheduler(tmp_path):
+    state = StateManager(state_path=str(tmp_path / "state.json"))
+    uploader = FakeUploader()
+    scheduler = Scheduler(hash_workers=2)
+    watchers = []
+    for name, priority in (("videos", 1), ("urgent", 4)):
+        root = tmp_path / name
+        root.mkdir()
+        for i in range(10):
+            (root / f"{name}_{i}.txt").write_text(f"{name} {i}", encoding="utf-8")
+        watchers.append(DirectoryWatcher(
+            watch_directory=str(root),
+            state_manager=state,
+            uploader=uploader,
+            hash_workers=3,
+            scheduler=scheduler,
+            priority=priority,
+        ))
+
+    # both roots are scanned at the same time, hashing on the shared threads
+    threads = [threading.Thread(target=watcher.scan_once) for watcher in watchers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler.shutdown()
+
+    assert len(uploader.uploaded_calls) == 20
+    assert len(state.get_uploaded_files()) == 20
+
+
+def test_watcher_skips_upload_when_server_already_has_content(tmp_path):
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    # big enough to be checked with the server before uploading
+    big_file = watch_dir / "video.bin"
+    big_file.write_bytes(b"x" * 200_000)
+
+    state = StateManager(state_path=str(tmp_path / "state.json"))
+    uploader = FakeUploader()
+    uploader.existing_hashes.add(calculate_file_hash(str(big_file)))
+
+    watcher = DirectoryWatcher(
+        watch_directory=str(watch_dir),
+        state_manager=state,
+        uploader=uploader,
+    )
+    watcher.scan_once()
+
+    # no bytes sent, but the file is still marked as uploaded
+    assert uploader.uploaded_calls == []
+    assert state.is_uploaded(str(big_file), calculate_file_hash(str(big_file)))
+
+
+def test_watcher_lists_directory_again_after_failed_upload(tmp_path):
+    from client.scanner import IgnoreRules
+
+    watch_dir = tmp_path / "watch"
+    (watch_dir / "sub").mkdir(parents=True)
+    (watch_dir / "a.txt").write_text("a", encoding="utf-8")
+    (watch_dir / "sub" / "b.txt").write_text("b", encoding="utf-8")
+    (watch_dir / "sub" / "b.txt.part").write_text("still downloading", encoding="utf-8")
+    old = 1_000_000_000 * 10**9
+    for directory in (watch_dir, watch_dir / "sub"):
+        os.utime(directory, ns=(old, old))
+
+    class FlakyUploader(FakeUploader):
+        def upload_file(self, file_path, file_hash):
+            super().upload_file(file_path, file_hash)
+            return not file_path.endswith("b.txt") or len(self.uploaded_calls) > 2
+
+    state = StateManager(state_path=str(tmp_path / "state.json"))
+    uploader = FlakyUploader()
+    watcher = DirectoryWatcher(
+        watch_directory=str(watch_dir),
+        state_manager=state,
+        recursive=True,
+        uploader=uploader,
+        skip_unchanged_dirs=True,
+    )
+    signature = f"{IgnoreRules().signature}:1"
+
+    watcher.scan_once()
+    assert sorted(os.path.basename(path) for path, _ in uploader.uploaded_calls) == ["a.txt", "b.txt"]
+    assert set(state.get_scanned_dirs(signature)) == {str(watch_dir)}
+
+    # The directory with the failed file is listed again, the other one is not
+    watcher.scan_once()
+    assert [os.path.basename(path) for path, _ in uploader.uploaded_calls[2:]] == ["b.txt"]
+    assert set(state.get_scanned_dirs(signature)) == {str(watch_dir), str(watch_dir / "sub")}
+
+    uploader.uploaded_calls.clear()
+    watcher.scan_once()
+    assert uploader.uploaded_calls == []
@@ -33,3 +33,98 @@ def test_calculate_file_hash_different_content_different_hash(tmp_path):
     h2 = calculate_file_hash(str(file2))
 
     assert h1 != h2
+
+
+def test_all_strategies_give_the_same_hash(tmp_path):
+    import hashlib
+
+    from client.hash_utils import BUFFER_SIZE, STRATEGIES
+
+    # bigger than one read buffer, and not a multiple of it
+    content = os.urandom(BUFFER_SIZE * 2 + 123)
+    file1 = tmp_path / "big.bin"
+    file1.write_bytes(content)
+
+    for algorithm in ("sha256", "blake2b"):
+        expected = hashlib.new(algorithm, content).hexdigest()
+        for strategy in STRATEGIES:
+            assert calculate_file_hash(str(file1), algorithm, strategy) == expected
+
+
+def test_big_files_are_not_mapped_unless_asked(monkeypatch, tmp_path):
+    import hashlib
+
+    from client import hash_utils
+
+    # A file truncated while mapped would kill the client with SIGBUS
+    def no_mmap(*args, **kwargs):
+        raise AssertionError("mmap used without being asked for")
+
+    monkeypatch.setattr(hash_utils.mmap, "mmap", no_mmap)
+    content = os.urandom(8 * 1024 * 1024)
+    path = tmp_path / "video.mp4"
+    path.write_bytes(content)
+
+    assert calculate_file_hash(str(path)) == hashlib.sha256(content).hexdigest()
+
+
+def test_calculate_file_hash_empty_file_and_unknown_algorithm(tmp_path):
+    import hashlib
+
+    import pytest
+
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+
+    assert calculate_file_hash(str(empty), strategy="mmap") == hashlib.sha256(b"").hexdigest()
+    with pytest.raises(ValueError):
+        calculate_file_hash(str(empty), algorithm="md5")
+
+
+def test_chunk_file_boundaries_survive_an_insert(tmp_path):
+    import random
+
+    from client.hash_utils import chunk_file
+
+    content = random.Random(7).randbytes(200_000)
+    original = tmp_path / "original.bin"
+    original.write_bytes(content)
+    edited = tmp_path / "edited.bin"
+    edited.write_bytes(content[:100_000] + b"inserted" + content[100_000:])
+    sizes = {"min_size": 1024, "avg_size": 4096, "max_size": 16384}
+
+    file_hash, chunks = chunk_file(str(original), **sizes)
+
+    assert file_hash == calculate_file_hash(str(original))
+    assert sum(chunk.size for chunk in chunks) == len(content)
+    assert [chunk.offset for chunk in chunks] == [sum(c.size for c in chunks[:i]) for i in range(len(chunks))]
+    assert all(1024 <= chunk.size <= 16384 for chunk in chunks[:-1])
+
+    # Only the chunk(s) around the insert are new
+    _, edited_chunks = chunk_file(str(edited), **sizes)
+    new = {chunk.hash for chunk in edited_chunks} - {chunk.hash for chunk in chunks}
+    assert 1 <= len(new) <= 2
+
+
+def test_numpy_and_python_chunking_find_the_same_boundaries(monkeypatch):
+    import random
+
+    import pytest
+
+    from client import hash_utils
+
+    if hash_utils.numpy is None:
+        pytest.skip("numpy is not installed")
+    # Small blocks, so boundaries are also found across block edges
+    monkeypatch.setattr(hash_utils, "_VECTOR_BLOCK", 1000)
+    data = random.Random(11).randbytes(300_000)
+    for sizes in [(1024, 4096, 16384), (64, 256, 1024), (1000, 100_000, 300_000)]:
+        boundaries = {}
+        for chunker in hash_utils.CHUNKERS:
+            offset, found = 0, []
+            while offset < len(data):
+                offset += hash_utils.find_chunk_end(data[offset:], *sizes, chunker=chunker)
+                found.append(offset)
+            boundaries[chunker] = found
+        assert boundaries["numpy"] == boundaries["python"]
+        assert len(boundaries["python"]) > 1
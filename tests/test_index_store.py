@@ -0,0 +1,159 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from server.index_store import AssetIndex, UploadSessionStore
+
+
+def _entry(name):
+    return {"bucket": "assets", "object_name": name, "hash_algorithm": "sha256"}
+
+
+def test_insert_if_absent_keeps_first_entry(tmp_path):
+    index = AssetIndex(str(tmp_path / "index.db"))
+
+    assert index.get("a" * 64) is None
+    assert index.insert_if_absent("a" * 64, _entry("first.png")) == _entry("first.png")
+    # A second upload of the same content does not replace the first one
+    assert index.insert_if_absent("a" * 64, _entry("second.jpg")) == _entry("first.png")
+
+    assert "a" * 64 in index
+    assert "b" * 64 not in index
+    assert index.existing(["a" * 64, "b" * 64, 5]) == {"a" * 64}
+    assert len(index) == 1
+
+
+def test_concurrent_inserts_from_many_threads(tmp_path):
+    index = AssetIndex(str(tmp_path / "index.db"))
+    winners = []
+
+    def insert(n):
+        entry = _entry(f"{n}.bin")
+        if index.insert_if_absent("c" * 64, entry) is entry:
+            winners.append(n)
+        for i in range(50):
+            index.insert_if_absent(f"{n:02d}{i:062d}", _entry("x"))
+
+    threads = [threading.Thread(target=insert, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(winners) == 1
+    assert len(index) == 1 + 8 * 50
+
+
+def test_imports_legacy_json_index(tmp_path):
+    legacy = tmp_path / "assets_index.json"
+    legacy.write_text(json.dumps({
+        "a" * 64: {"bucket": "assets", "object_name": "a.png"},
+    }))
+
+    index = AssetIndex(str(tmp_path / "index.db"), legacy_json_path=str(legacy))
+
+    assert index.get("a" * 64) == _entry("a.png")
+    assert not legacy.exists()
+    assert (tmp_path / "assets_index.json.migrated").exists()
+
+    # Opening it again (e.g. another worker) does not import twice
+    again = AssetIndex(str(tmp_path / "index.db"), legacy_json_path=str(legacy))
+    assert len(again) == 1
+
+
+def test_upload_sessions_roundtrip(tmp_path):
+    sessions = UploadSessionStore(str(tmp_path / "index.db"))
+    session = {
+        "hash": "d" * 64,
+        "hash_algorithm": "sha256",
+        "object_name": "d.iso",
+        "size": 20,
+        "chunk_size": 8,
+        "minio_upload_id": "m-1",
+        "parts": {},
+        "filename": "d.iso",
+        "content_type": "application/x-iso9660-image",
+        "part_object": "upload-u1.iso",
+    }
+    sessions.create("u1", session)
+    sessions.add_part("u1", 1, "etag-1")
+    sessions.add_part("u1", 0, "etag-0")
+
+    assert sessions.get("u1") == {
+        **session, "parts": {"0": "etag-0", "1": "etag-1"}, "assembled": 0, "verifying_until": 0.0
+    }
+
+    # Only one worker at a time completes a session
+    assert sessions.claim_completion("u1", 60) is True
+    assert sessions.claim_completion("u1", 60) is False
+    sessions.mark_assembled("u1")
+    sessions.release_completion("u1")
+    assert sessions.claim_completion("u1", 60) is True
+    assert sessions.get("u1")["assembled"] == 1
+
+    assert sessions.delete("u1")["parts"] == {"0": "etag-0", "1": "etag-1"}
+    assert sessions.get("u1") is None
+    assert sessions.delete("u1") is None
+
+
+def _add_assets(index, count):
+    for i in range(count):
+        ext = ("jpg", "png")[i % 2]
+        index.insert_if_absent(
+            f"{i:064x}",
+            _entry(f"{i:064x}.{ext.upper()}"),
+            {"filename": f"IMG_{i}.{ext}", "size": i * 100, "content_type": f"image/{ext}", "client_id": f"c{i % 3}"},
+        )
+
+
+def test_catalog_query_filters_and_pages(tmp_path):
+    index = AssetIndex(str(tmp_path / "index.db"))
+    _add_assets(index, 50)
+
+    pngs = list(index.query(extension="png", limit=100))
+    assert len(pngs) == 25
+    assert pngs[0]["extension"] == "png" and pngs[0]["content_type"] == "image/png"
+    assert [e["hash"] for e in index.query(filename_prefix="IMG_1", limit=100)] == sorted(
+        f"{i:064x}" for i in [1] + list(range(10, 20))
+    )
+    assert len(list(index.query(content_type_prefix="image/", client_id="c1", limit=100))) == 17
+    assert {e["size"] for e in index.query(min_size=1000, max_size=1200, limit=100)} == {1000, 1100, 1200}
+
+    # Keyset pages: every asset once, in order
+    seen, after = [], None
+    while True:
+        page = list(index.query(after=after, limit=7))
+        if not page:
+            break
+        seen.extend(e["hash"] for e in page)
+        after = (page[-1]["first_seen"], page[-1]["hash"])
+    assert len(seen) == 50 and len(set(seen)) == 50
+
+
+def test_old_database_gets_the_catalog_columns(tmp_path):
+    db = str(tmp_path / "index.db")
+    conn = sqlite3.connect(db)
+    conn.execute(
+        "CREATE TABLE assets (hash TEXT PRIMARY KEY, bucket TEXT NOT NULL, object_name TEXT NOT NULL, "
+        "hash_algorithm TEXT NOT NULL DEFAULT 'sha256') WITHOUT ROWID"
+    )
+    conn.execute("INSERT INTO assets VALUES (?, 'assets', 'old.png', 'sha256')", ("a" * 64,))
+    conn.commit()
+    conn.close()
+
+    index = AssetIndex(db)
+    index.insert_if_absent("b" * 64, _entry("new.png"), {"size": 3})
+
+    assert index.get("a" * 64) == _entry("old.png")
+    # Assets from before the catalog have no metadata and come first
+    assert [(e["hash"], e["size"], e["first_seen"] == 0) for e in index.query(limit=10)] == [
+        ("a" * 64, None, True),
+        ("b" * 64, 3, False),
+    ]
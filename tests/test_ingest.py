@@ -0,0 +1,117 @@
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from server.hashing import HashMismatchError
+from server.index_store import AssetIndex, IngestJobStore
+from server.ingest import IngestQueue, IngestQueueFullError
+from server.storage import LocalStorage, StorageUnavailableError
+
+
+def _queue(tmp_path, get_storage, **kwargs):
+    db = str(tmp_path / "index.db")
+    ingest_queue = IngestQueue(
+        str(tmp_path / "spool"), IngestJobStore(db), AssetIndex(db), get_storage, fsync=False, **kwargs
+    )
+    ingest_queue.start()
+    return ingest_queue
+
+
+def _submit(ingest_queue, content):
+    file_hash = hashlib.sha256(content).hexdigest()
+    return ingest_queue.submit(file_hash, "sha256", f"{file_hash}.bin", "application/octet-stream", io.BytesIO(content))
+
+
+def test_spooled_jobs_are_stored_and_indexed(tmp_path):
+    storage = LocalStorage(str(tmp_path / "objects"), fsync=False)
+    storage.connect()
+    ingest_queue = _queue(tmp_path, lambda: storage, workers=2, commit_batch_size=10)
+    try:
+        jobs = [_submit(ingest_queue, f"content {i}".encode()) for i in range(25)]
+        assert ingest_queue.drain(timeout=10)
+    finally:
+        ingest_queue.stop()
+
+    for job in jobs:
+        assert ingest_queue.jobs.get(job["job_id"])["status"] == "done"
+        assert ingest_queue.index.get(job["hash"])["object_name"] == f"{job['hash']}.bin"
+        assert os.path.exists(storage.path(f"{job['hash']}.bin"))
+    # Nothing is left in the spool
+    assert os.listdir(tmp_path / "spool" / "jobs") == []
+
+
+def test_bad_hash_is_not_spooled_and_queue_is_bounded(tmp_path):
+    def down():
+        raise StorageUnavailableError("down")
+
+    ingest_queue = _queue(tmp_path, down, max_queued=1, retry_delay=60)
+    try:
+        with pytest.raises(HashMismatchError):
+            ingest_queue.submit("a" * 64, "sha256", "x.bin", "application/octet-stream", io.BytesIO(b"x"))
+        assert os.listdir(tmp_path / "spool" / "jobs") == []
+
+        _submit(ingest_queue, b"waits for the storage")
+        with pytest.raises(IngestQueueFullError):
+            _submit(ingest_queue, b"one too many")
+    finally:
+        ingest_queue.stop()
+
+
+def test_jobs_of_a_stopped_queue_are_replayed(tmp_path):
+    def down():
+        raise StorageUnavailableError("down")
+
+    first = _queue(tmp_path, down, retry_delay=60)
+    job = _submit(first, b"spooled before the restart")
+    first.stop()
+    assert first.jobs.get(job["job_id"])["status"] == "queued"
+    assert first.jobs.get(job["job_id"])["attempts"] == 1
+
+    storage = LocalStorage(str(tmp_path / "objects"), fsync=False)
+    storage.connect()
+    second = _queue(tmp_path, lambda: storage)
+    try:
+        assert second.drain(timeout=10)
+    finally:
+        second.stop()
+
+    assert second.jobs.get(job["job_id"])["status"] == "done"
+    assert job["hash"] in second.index
+    with open(storage.path(f"{job['hash']}.bin"), "rb") as f:
+        assert f.read() == b"spooled before the restart"
+
+
+def test_recover_never_takes_a_starting_queue_for_a_dead_one(monkeypatch, tmp_path):
+    from server import ingest
+
+    storage = LocalStorage(str(tmp_path / "objects"), fsync=False)
+    running = _queue(tmp_path, lambda: storage)
+    db = str(tmp_path / "index.db")
+    starting = IngestQueue(str(tmp_path / "spool"), IngestJobStore(db), AssetIndex(db), lambda: storage, fsync=False)
+    flock = ingest.fcntl.flock
+
+    def recover_in_between(lock_file, operation):
+        # Another process recovers right after the lock file was opened
+        if lock_file is starting._lock_file:
+            running.recover()
+        return flock(lock_file, operation)
+
+    monkeypatch.setattr(ingest.fcntl, "flock", recover_in_between)
+    starting.start()
+    monkeypatch.setattr(ingest.fcntl, "flock", flock)
+    try:
+        running.recover()
+        assert os.path.exists(tmp_path / "spool" / "owners" / f"{starting.owner}.lock")
+        assert os.path.isdir(tmp_path / "spool" / "incoming" / starting.owner)
+        assert _submit(starting, b"accepted")["status"] == "queued"
+    finally:
+        starting.stop()
+        running.stop()
@@ -0,0 +1,67 @@
+import os
+import sys
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from client import metrics as client_metrics
+from client.state_manager import StateManager
+from client.watcher import DirectoryWatcher
+from server.metrics import Registry
+
+
+def test_prometheus_text_format():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ("status",))
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    requests.inc(status=200)
+    requests.inc(2, status=200)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{status="200"} 3',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_histogram_quantile_is_a_bucket_bound():
+    histogram = client_metrics.Histogram("test", buckets=(0.1, 1.0, 10.0))
+    assert histogram.quantile(0.5) is None
+    for value in (0.05, 0.05, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.95) == 10.0
+    assert histogram.count() == 4
+
+
+def test_watcher_counts_scanned_hashed_and_skipped_files(tmp_path):
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    (watch_dir / "a.txt").write_bytes(b"a" * 1000)
+    (watch_dir / "b.txt").write_bytes(b"b" * 500)
+
+    scanned = client_metrics.FILES_SCANNED.value()
+    hashed_bytes = client_metrics.BYTES_HASHED.value()
+    unchanged = client_metrics.FILES_SKIPPED.value(reason="unchanged")
+
+    watcher = DirectoryWatcher(str(watch_dir), StateManager(state_path=str(tmp_path / "state.db")))
+    watcher.scan_once()
+    watcher.scan_once()
+
+    assert client_metrics.FILES_SCANNED.value() == scanned + 4
+    assert client_metrics.BYTES_HASHED.value() == hashed_bytes + 1500
+    assert client_metrics.FILES_SKIPPED.value(reason="unchanged") == unchanged + 2
+    assert "scanned=" in client_metrics.format_stats()
@@ -0,0 +1,53 @@
+import os
+import sys
+import threading
+import time
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from client.pipeline import Stage, run_pipeline
+
+
+def test_run_pipeline_passes_items_through_all_stages():
+    results = []
+    lock = threading.Lock()
+
+    def double(x):
+        return x * 2
+
+    def collect(x):
+        with lock:
+            results.append(x)
+
+    def skip_multiples_of_three(x):
+        # returning None drops the item
+        return None if x % 3 == 0 else x
+
+    run_pipeline(
+        range(20),
+        [
+            Stage("filter", skip_multiples_of_three, 2),
+            Stage("double", double, 3),
+            Stage("collect", collect, 2),
+        ],
+        queue_size=1,
+    )
+
+    assert sorted(results) == [x * 2 for x in range(20) if x % 3 != 0]
+
+
+def test_run_pipeline_keeps_going_after_a_failing_item():
+    seen = []
+
+    def slow_and_sometimes_broken(x):
+        time.sleep(0.001)
+        if x == 3:
+            raise ValueError("broken item")
+        seen.append(x)
+
+    run_pipeline(range(6), [Stage("work", slow_and_sometimes_broken, 1)], queue_size=1)
+
+    assert seen == [0, 1, 2, 4, 5]
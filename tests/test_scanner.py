@@ -0,0 +1,73 @@
+import os
+import sys
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from client.scanner import IgnoreRules, ScannedDir, Scanner
+
+
+def _make_tree(root, paths):
+    for path in paths:
+        full = root / path
+        full.parent.mkdir(parents=True, exist_ok=True)
+        full.write_text(path, encoding="utf-8")
+
+
+def _scan(root, **kwargs):
+    scanner = Scanner(str(root), **kwargs)
+    return sorted(os.path.relpath(path, root).replace(os.sep, "/") for path, _ in scanner.iter_files())
+
+
+def test_ignore_rules_follow_gitignore_syntax():
+    rules = IgnoreRules(exclude=["build/", "/top.log", "docs/**/*.md", "*.bak", "!keep.bak"])
+
+    assert rules.ignores_file("Thumbs.db")
+    assert rules.ignores_file("deep/dir/~$report.docx")
+    assert rules.ignores_file("video.mp4.part")
+    assert not rules.ignores_file("video.mp4")
+
+    assert rules.ignores_dir("build") and rules.ignores_dir("src/build")
+    assert not rules.ignores_file("build")
+    assert rules.ignores_file("top.log") and not rules.ignores_file("sub/top.log")
+    assert rules.ignores_file("docs/a/b/c.md") and rules.ignores_file("docs/c.md")
+    assert rules.ignores_file("old.bak") and not rules.ignores_file("sub/keep.bak")
+    assert rules.ignores_path("build/output/app.bin")
+
+    photos_only = IgnoreRules(include=["*.jpg", "raw/**"], use_defaults=False)
+    assert not photos_only.ignores_file("a/b.jpg")
+    assert not photos_only.ignores_file("raw/x/y.cr2")
+    assert photos_only.ignores_file("notes.txt")
+    assert not photos_only.ignores_dir("notes")
+
+
+def test_scanner_skips_ignored_files_and_directories(tmp_path):
+    _make_tree(tmp_path, ["a.txt", "desktop.ini", "sub/b.txt", "sub/c.tmp", "node_modules/d.js", "sub/deeper/e.txt"])
+    rules = IgnoreRules(exclude=["node_modules/"])
+
+    assert _scan(tmp_path, rules=rules) == ["a.txt"]
+    assert _scan(tmp_path, recursive=True, rules=rules) == ["a.txt", "sub/b.txt", "sub/deeper/e.txt"]
+
+
+def test_scanner_does_not_list_unchanged_directories(tmp_path):
+    _make_tree(tmp_path, ["a.txt", "sub/b.txt", "sub/deeper/c.txt"])
+    old = 1_000_000_000 * 10**9
+    for directory in (tmp_path, tmp_path / "sub", tmp_path / "sub" / "deeper"):
+        os.utime(directory, ns=(old, old))
+
+    first = Scanner(str(tmp_path), recursive=True, dir_cache={})
+    assert len(list(first.iter_files())) == 3
+    assert set(first.listed) == {str(tmp_path), str(tmp_path / "sub"), str(tmp_path / "sub" / "deeper")}
+
+    # Only "deeper" changed: the other two are not listed again,
+    # but their sub-directories are still checked
+    (tmp_path / "sub" / "deeper" / "new.txt").write_text("new", encoding="utf-8")
+    second = Scanner(str(tmp_path), recursive=True, dir_cache=dict(first.listed))
+    assert sorted(os.path.basename(path) for path, _ in second.iter_files()) == ["c.txt", "new.txt"]
+    assert second.skipped_dirs == 2
+    # Just modified, so within the racy window: not cached yet
+    assert second.listed == {}
+
+    assert first.listed[str(tmp_path)] == ScannedDir(old, ["sub"])
@@ -0,0 +1,73 @@
+import os
+import sys
+import threading
+import time
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import pytest
+
+from client.scheduler import FairExecutor, TokenBucket
+
+
+def test_token_bucket_limits_the_rate_of_all_threads():
+    bucket = TokenBucket(rate=1_000_000, burst=100_000)
+
+    # the burst is available right away
+    assert bucket.consume(100_000) == 0
+
+    # 4 threads x 50 KB = 200 KB more, at 1 MB/s -> about 0.2 s
+    started = time.monotonic()
+    threads = [threading.Thread(target=bucket.consume, args=(50_000,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 0.18 <= time.monotonic() - started < 1.0
+
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def _run_in_order(executor, submissions):
+    # Blocks the (single) worker, queues `submissions`, then lets them run
+    # and returns the keys in the order the tasks ran
+    release = threading.Event()
+    executor.submit("blocker", 0, release.wait)
+    order = []
+    futures = [executor.submit(key, cost, order.append, key) for key, cost in submissions]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    return order
+
+
+def test_fair_executor_does_not_starve_a_small_root_behind_a_bulk_import():
+    executor = FairExecutor(workers=1)
+    try:
+        # a bulk import of 20 big files is queued first, then 2 small urgent files
+        order = _run_in_order(executor, [("videos", 100 * 1024 * 1024)] * 20 + [("urgent", 1024)] * 2)
+    finally:
+        executor.shutdown()
+
+    # FIFO would run the urgent files last; fair queueing runs them right
+    # after the bulk file that was already due
+    assert order[:3] == ["videos", "urgent", "urgent"]
+    assert order.count("videos") == 20
+
+
+def test_fair_executor_shares_by_priority():
+    executor = FairExecutor(workers=1)
+    executor.set_weight("high", 3)
+    try:
+        order = _run_in_order(executor, [("low", 1024 * 1024)] * 12 + [("high", 1024 * 1024)] * 12)
+    finally:
+        executor.shutdown()
+
+    # while both have work waiting, "high" gets 3 turns for every turn of "low"
+    assert order[:12].count("high") == 9
+    with pytest.raises(ValueError):
+        executor.set_weight("low", 0)
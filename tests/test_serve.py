@@ -0,0 +1,90 @@
+import os
+import sys
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from server import serve
+
+
+def test_choose_backend_prefers_gunicorn(monkeypatch):
+    monkeypatch.setattr(serve, "_module_available", lambda name: True)
+    assert serve.choose_backend("auto", 4) == "gunicorn"
+    assert serve.choose_backend("werkzeug", 4) == "werkzeug"
+
+
+def test_choose_backend_without_gunicorn(monkeypatch):
+    monkeypatch.setattr(serve, "_module_available", lambda name: name == "waitress")
+    # waitress has no worker processes
+    assert serve.choose_backend("auto", 1) == "waitress"
+    assert serve.choose_backend("auto", 4) == "werkzeug"
+
+
+def test_settings_from_environment(monkeypatch):
+    monkeypatch.setenv("SERVER_WORKERS", "3")
+    monkeypatch.setenv("SERVER_KEEPALIVE", "7")
+    monkeypatch.setenv("MAX_CONTENT_LENGTH", "1024")
+
+    args = serve.parse_args(["--port", "9000"])
+
+    assert (args.workers, args.keepalive, args.max_content_length, args.port) == (3, 7, 1024, 9000)
+
+
+def test_worker_pool_replaces_workers_that_die(monkeypatch, caplog):
+    monkeypatch.setattr(serve, "RESPAWN_DELAY", 0.01)
+    caplog.set_level("WARNING", logger="server.serve")
+    spawned = []
+
+    def spawn():
+        # Workers that crash right away
+        pid = os.fork()
+        if pid == 0:
+            os._exit(1)
+        spawned.append(pid)
+        if len(spawned) == 5:
+            pool.stop()
+        return pid
+
+    pool = serve.WorkerPool(spawn, 2)
+    pool.run()
+
+    assert len(spawned) == 5
+    assert pool.children == {}
+    # Goes to the log, like everything else the server reports
+    assert any("exited (status 1)" in record.getMessage() for record in caplog.records)
+
+
+def test_request_body_may_stall_longer_than_keepalive():
+    import socket
+    import threading
+    import time
+
+    from werkzeug.serving import make_server
+
+    def app(environ, start_response):
+        body = environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"]))
+        start_response("200 OK", [("Content-Length", str(len(body)))])
+        return [body]
+
+    handler = serve.make_request_handler(keepalive=0.2, timeout=5)
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with socket.create_connection(("127.0.0.1", server.server_port)) as conn:
+            conn.sendall(b"POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 10\r\n\r\nhello")
+            # A slow client: longer than the keep-alive timeout
+            time.sleep(0.5)
+            conn.sendall(b"world")
+            response = conn.makefile("rb")
+            assert response.readline() == b"HTTP/1.1 200 OK\r\n"
+            while response.readline() != b"\r\n":
+                pass
+            assert response.read(10) == b"helloworld"
+
+            # An idle connection is still closed after the keep-alive timeout
+            time.sleep(0.5)
+            assert response.read() == b""
+    finally:
+        server.shutdown()
@@ -0,0 +1,584 @@
+import gzip
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import pytest
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from server import main, storage as storage_module
+from server.cache import CACHE_EVICTIONS, CACHE_HITS
+from server.index_store import AssetIndex, ChunkStore, IngestJobStore, UploadSessionStore
+from server.storage import LocalStorage, ObjectInfo, Storage
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    # Ready resources on the local disk, so no test ever needs MinIO
+    local = LocalStorage(str(tmp_path / "objects"), fsync=False)
+    local.connect()
+    db = str(tmp_path / "index.db")
+    monkeypatch.setattr(main, "_storage", local)
+    monkeypatch.setattr(main, "_assets_index", AssetIndex(db))
+    monkeypatch.setattr(main, "_upload_sessions", UploadSessionStore(db))
+    monkeypatch.setattr(main, "_chunk_store", ChunkStore(db))
+    # A fresh read cache per test, with its disk tier in the temp directory
+    monkeypatch.setattr(main, "_read_cache", None)
+    monkeypatch.setattr(main, "READ_CACHE_DIR", str(tmp_path / "read_cache"))
+    return local
+
+
+@pytest.fixture
+def client(storage):
+    return main.create_app(warmup=False).test_client()
+
+
+def _put(client, content, file_hash=None):
+    file_hash = file_hash or hashlib.sha256(content).hexdigest()
+    return client.put(
+        f"/assets/{file_hash}",
+        data=content,
+        headers={"X-File-Name": "photo.png", "Content-Type": "image/png"},
+    )
+
+
+def test_put_then_dedup(client, storage):
+    content = b"png bytes" * 1000
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    response = _put(client, content)
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "ok"
+    with open(storage.path(f"{file_hash}.png"), "rb") as f:
+        assert f.read() == content
+
+    assert client.head(f"/assets/{file_hash}").status_code == 200
+    assert client.post("/exists", json={"hashes": [file_hash, "0" * 64]}).get_json() == {
+        "existing": [file_hash]
+    }
+    assert _put(client, content).get_json()["status"] == "already_exists"
+
+
+def test_put_with_wrong_hash_is_rejected(client, storage):
+    response = _put(client, b"real content", file_hash="a" * 64)
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "hash_mismatch"}
+    assert client.head(f"/assets/{'a' * 64}").status_code == 404
+
+
+def test_create_app_does_not_connect(monkeypatch):
+    created = []
+    monkeypatch.setattr(main, "_storage", None)
+    monkeypatch.setattr(main, "_create_storage", lambda: created.append(True))
+
+    main.create_app(warmup=False)
+
+    assert created == []
+
+
+def test_readiness(monkeypatch, tmp_path, storage):
+    app = main.create_app(warmup=False)
+    assert app.test_client().get("/healthz").status_code == 200
+    assert app.test_client().get("/readyz").status_code == 200
+
+    monkeypatch.setattr(main, "_storage", None)
+    monkeypatch.setattr(main, "start_warmup", lambda: None)
+    response = app.test_client().get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["storage"] is False
+
+
+def test_storage_outage_returns_503_and_retries_later(monkeypatch, client, storage):
+    calls = []
+
+    class DownMinio:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def bucket_exists(self, bucket):
+            calls.append(bucket)
+            raise OSError("connection refused")
+
+    monkeypatch.setattr(main, "_storage", None)
+    monkeypatch.setattr(main, "STORAGE_BACKEND", "minio")
+    monkeypatch.setattr(storage_module, "Minio", DownMinio)
+    monkeypatch.setattr(main, "MINIO_CONNECT_ATTEMPTS", 3)
+    monkeypatch.setattr(main, "MINIO_RETRY_DELAY", 0)
+
+    response = _put(client, b"content")
+    assert response.status_code == 503
+    assert response.get_json() == {"error": "storage_unavailable"}
+    assert len(calls) == 3
+
+    # Storage is back: the next request connects
+    monkeypatch.setattr(main, "_create_storage", lambda: storage)
+    assert _put(client, b"content").status_code == 200
+
+
+def test_resumable_upload_on_local_storage(monkeypatch, client, storage):
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 4)
+    content = b"0123456789"
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    created = client.post(
+        "/uploads",
+        json={"hash": file_hash, "filename": "a.txt", "size": len(content), "content_type": "text/csv"},
+        headers={"X-Client-Id": "laptop"},
+    )
+    upload_id = created.get_json()["upload_id"]
+    for index in (2, 0, 1):
+        chunk = content[index * 4:(index + 1) * 4]
+        assert client.put(f"/uploads/{upload_id}/chunks/{index}", data=chunk).status_code == 200
+
+    response = client.post(f"/uploads/{upload_id}/complete")
+    assert response.status_code == 200
+    assert response.get_json()["stored_as"]["bucket"] == "local"
+    with open(storage.path(f"{file_hash}.txt"), "rb") as f:
+        assert f.read() == content
+
+    # The catalog has what the client sent, as for a single PUT
+    (asset,) = client.get("/assets?extension=txt").get_json()["assets"]
+    assert asset["filename"] == "a.txt"
+    assert asset["content_type"] == "text/csv"
+    assert asset["size"] == len(content)
+
+
+def test_resumable_upload_with_wrong_content_never_touches_the_stored_asset(monkeypatch, client, storage):
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 4)
+
+    def start_wrong_upload(file_hash):
+        created = client.post("/uploads", json={"hash": file_hash, "filename": "b.png", "size": 4})
+        upload_id = created.get_json()["upload_id"]
+        assert client.put(f"/uploads/{upload_id}/chunks/0", data=b"junk").status_code == 200
+        return upload_id
+
+    # Indexed after the session started: complete sees it and drops the parts
+    content = b"png!"
+    file_hash = hashlib.sha256(content).hexdigest()
+    upload_id = start_wrong_upload(file_hash)
+    assert _put(client, content).status_code == 200
+    response = client.post(f"/uploads/{upload_id}/complete")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "already_exists"
+    assert client.get(f"/assets/{file_hash}").data == content
+
+    # Indexed while the session is being verified: the mismatch only removes
+    # what the session joined, never the object of the valid upload
+    content = b"png?"
+    file_hash = hashlib.sha256(content).hexdigest()
+    upload_id = start_wrong_upload(file_hash)
+    hash_stored_object = main._hash_stored_object
+
+    def hash_during_valid_upload(*args, **kwargs):
+        assert _put(client, content).status_code == 200
+        return hash_stored_object(*args, **kwargs)
+
+    monkeypatch.setattr(main, "_hash_stored_object", hash_during_valid_upload)
+    response = client.post(f"/uploads/{upload_id}/complete")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "hash_mismatch"}
+    assert client.get(f"/assets/{file_hash}").data == content
+    assert not os.path.exists(storage.path(f"upload-{upload_id}.png"))
+
+
+def test_slow_resumable_complete_is_verified_in_the_background(monkeypatch, tmp_path, client, storage):
+    from werkzeug.serving import make_server
+
+    from client import uploader as uploader_module
+
+    # Verifying takes longer than complete waits: 202, then the client polls
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 4)
+    monkeypatch.setattr(main, "UPLOAD_COMPLETE_WAIT", 0)
+    monkeypatch.setattr(uploader_module, "COMPLETE_POLL_INTERVAL", 0.05)
+    hash_stored_object = main._hash_stored_object
+
+    def slow_hash(*args, **kwargs):
+        time.sleep(0.3)
+        return hash_stored_object(*args, **kwargs)
+
+    monkeypatch.setattr(main, "_hash_stored_object", slow_hash)
+    content = b"0123456789"
+    file_hash = hashlib.sha256(content).hexdigest()
+    path = tmp_path / "a.txt"
+    path.write_bytes(content)
+
+    server = make_server("127.0.0.1", 0, main.create_app(warmup=False), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        uploader = uploader_module.Uploader(f"http://127.0.0.1:{server.server_port}", resumable_threshold=1)
+        assert uploader.upload_file_resumable(str(path), file_hash, len(content)) is True
+    finally:
+        server.shutdown()
+    assert client.head(f"/assets/{file_hash}").status_code == 200
+
+    # A complete while another one is verifying doesn't start a second one
+    created = client.post("/uploads", json={"hash": "b" * 64, "filename": "b.txt", "size": 4}).get_json()
+    upload_id = created["upload_id"]
+    assert client.put(f"/uploads/{upload_id}/chunks/0", data=b"abcd").status_code == 200
+    assert client.post(f"/uploads/{upload_id}/complete").status_code == 202
+    assert client.get(f"/uploads/{upload_id}").get_json()["status"] == "verifying"
+    assert client.post(f"/uploads/{upload_id}/complete").status_code == 202
+    deadline = time.monotonic() + 5
+    while client.get(f"/uploads/{upload_id}").status_code != 404 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    # Wrong hash: the session is gone and so is the content
+    assert client.head(f"/assets/{'b' * 64}").status_code == 404
+
+
+def _batch_body(contents):
+    records = []
+    for i, content in enumerate(contents):
+        header = json.dumps({
+            "hash": hashlib.sha256(content).hexdigest(), "name": f"{i}.txt", "size": len(content)
+        }).encode()
+        records += [struct.pack(">I", len(header)), header, content]
+    return b"".join(records)
+
+
+def test_batch_upload_limits_its_size(monkeypatch, client, storage):
+    # Every put waits for the one before it: still all stored
+    monkeypatch.setattr(main, "BATCH_IN_FLIGHT_BYTES", 1)
+    contents = [b"file %d" % i * 100 for i in range(5)]
+    response = client.post("/upload/batch", data=_batch_body(contents))
+    assert response.status_code == 200
+    assert [r["status"] for r in response.get_json()["results"]] == ["ok"] * 5
+
+    monkeypatch.setattr(main, "MAX_BATCH_BYTES", 1000)
+    body = _batch_body([b"x" * 2000])
+    assert client.post("/upload/batch", data=body).status_code == 413
+    # Compressed, the body is small but decompresses to more than allowed
+    response = client.post("/upload/batch", data=gzip.compress(body), headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 413
+    assert client.head(f"/assets/{hashlib.sha256(b'x' * 2000).hexdigest()}").status_code == 404
+
+
+class MemoryStorage(Storage):
+    # A backend without local files, so downloads take the streaming path
+    bucket = "memory"
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_stream(self, object_name, stream, content_type):
+        # Read until EOF, where HashVerifyingReader checks the hash
+        chunks = []
+        while True:
+            chunk = stream.read(64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.objects[object_name] = b"".join(chunks)
+
+    def stat(self, object_name):
+        return ObjectInfo(len(self.objects[object_name]), "image/png")
+
+    def iter_range(self, object_name, start, length, chunk_size=4):
+        data = self.objects[object_name][start:start + length]
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+
+@pytest.mark.parametrize("backend", ["local", "memory"])
+def test_download_with_etag_and_ranges(monkeypatch, client, backend):
+    if backend == "memory":
+        monkeypatch.setattr(main, "_storage", MemoryStorage())
+    content = bytes(range(256)) * 40
+    file_hash = hashlib.sha256(content).hexdigest()
+    assert _put(client, content).status_code == 200
+
+    response = client.get(f"/assets/{file_hash}")
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers["ETag"] == f'"{file_hash}"'
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.mimetype == "image/png"
+
+    response = client.get(f"/assets/{file_hash}", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.data == content[100:200]
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(content)}"
+
+    response = client.get(f"/assets/{file_hash}", headers={"Range": "bytes=-10"})
+    assert response.data == content[-10:]
+
+    response = client.get(f"/assets/{file_hash}", headers={"Range": f"bytes={len(content)}-"})
+    assert response.status_code == 416
+
+    response = client.get(f"/assets/{file_hash}", headers={"If-None-Match": f'"{file_hash}"'})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    assert client.get(f"/assets/{'0' * 64}").status_code == 404
+    # HEAD still answers the cheap "do you have it?" question
+    assert client.head(f"/assets/{file_hash}").status_code == 200
+
+
+def test_downloads_from_remote_storage_go_through_the_read_cache(monkeypatch, tmp_path, client):
+    remote = MemoryStorage()
+    monkeypatch.setattr(main, "_storage", remote)
+    # 1000 bytes fit in memory, 3000 go to the disk tier, which holds one of them
+    monkeypatch.setattr(main, "READ_CACHE_MEMORY_MAX_OBJECT", 1000)
+    monkeypatch.setattr(main, "READ_CACHE_DISK_BYTES", 5000)
+    small, big, other = b"s" * 1000, bytes(range(250)) * 12, b"o" * 3000
+    hashes = [hashlib.sha256(content).hexdigest() for content in (small, big, other)]
+    for content in (small, big, other):
+        assert _put(client, content).status_code == 200
+    memory_hits = lambda: CACHE_HITS.value(tier="memory")
+    disk_hits = lambda: CACHE_HITS.value(tier="disk")
+    evictions = lambda: CACHE_EVICTIONS.value(tier="disk")
+    before = (memory_hits(), disk_hits(), evictions())
+
+    # a revalidation on a miss neither reads the storage nor fills the cache
+    stored = dict(remote.objects)
+    remote.objects.clear()
+    response = client.get(f"/assets/{hashes[0]}", headers={"If-None-Match": f'"{hashes[0]}"'})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == f'"{hashes[0]}"'
+    remote.objects.update(stored)
+
+    # first reads fill the cache; the storage is not asked again afterwards
+    assert client.get(f"/assets/{hashes[0]}").data == small
+    assert client.get(f"/assets/{hashes[1]}").data == big
+    remote.objects.clear()
+    assert client.get(f"/assets/{hashes[0]}").data == small
+    response = client.get(f"/assets/{hashes[1]}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.data == big[10:20]
+    assert response.headers["ETag"] == f'"{hashes[1]}"'
+    assert (memory_hits() - before[0], disk_hits() - before[1]) == (1, 1)
+
+    # the disk tier only holds one big object: filling another evicts it
+    remote.objects[f"{hashes[2]}.png"] = other
+    assert client.get(f"/assets/{hashes[2]}").data == other
+    assert evictions() - before[2] == 1
+    assert os.listdir(tmp_path / "read_cache" / hashes[2][:2]) == [f"{hashes[2]}.png"]
+
+    # a new worker finds the disk tier again
+    monkeypatch.setattr(main, "_read_cache", None)
+    remote.objects.clear()
+    assert client.get(f"/assets/{hashes[2]}").data == other
+
+
+def test_chunked_upload_with_manifest(client, storage):
+    parts = [b"a" * 1000, b"b" * 500, b"a" * 1000, b"c" * 10]
+    content = b"".join(parts)
+    file_hash = hashlib.sha256(content).hexdigest()
+    chunk_hashes = [hashlib.sha256(part).hexdigest() for part in parts]
+    manifest = {
+        "hash": file_hash,
+        "filename": "video.bin",
+        "size": len(content),
+        "chunks": [[h, len(part)] for h, part in zip(chunk_hashes, parts)],
+    }
+
+    missing = client.post("/chunks/missing", json={"hashes": chunk_hashes}).get_json()["missing"]
+    assert missing == list(dict.fromkeys(chunk_hashes))
+
+    # A manifest with missing chunks is refused and says which are missing
+    assert client.put(f"/chunks/{chunk_hashes[0]}", data=parts[0]).status_code == 200
+    response = client.post("/manifests", json=manifest)
+    assert response.status_code == 409
+    assert sorted(response.get_json()["missing"]) == sorted({chunk_hashes[1], chunk_hashes[3]})
+
+    assert client.put(f"/chunks/{chunk_hashes[1]}", data=b"not the chunk").status_code == 400
+    for h, part in zip(chunk_hashes[1:], parts[1:]):
+        assert client.put(f"/chunks/{h}", data=part).status_code == 200
+    response = client.post("/manifests", json=manifest)
+    assert response.status_code == 200
+    assert client.post("/manifests", json=manifest).get_json()["status"] == "already_exists"
+
+    assert client.get(f"/assets/{file_hash}").data == content
+    response = client.get(f"/assets/{file_hash}", headers={"Range": "bytes=900-1600"})
+    assert response.status_code == 206
+    assert response.data == content[900:1601]
+
+
+
+def test_manifest_verification_outlasting_the_client_timeout(monkeypatch, tmp_path, client, storage):
+    from werkzeug.serving import make_server
+
+    from client import uploader as uploader_module
+
+    # Hashing the assembled file takes longer than the client waits for a
+    # response: the server answers 202 and the client polls
+    monkeypatch.setattr(uploader_module, "UPLOAD_TIMEOUT", (5, 0.5))
+    monkeypatch.setattr(uploader_module, "COMPLETE_POLL_INTERVAL", 0.05)
+    monkeypatch.setattr(main, "UPLOAD_COMPLETE_WAIT", 0.1)
+    iter_manifest_range = main._iter_manifest_range
+
+    def slow_read(*args, **kwargs):
+        time.sleep(1)
+        return iter_manifest_range(*args, **kwargs)
+
+    monkeypatch.setattr(main, "_iter_manifest_range", slow_read)
+    content = os.urandom(600_000)
+    file_hash = hashlib.sha256(content).hexdigest()
+    path = tmp_path / "video.bin"
+    path.write_bytes(content)
+
+    server = make_server("127.0.0.1", 0, main.create_app(warmup=False), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        uploader = uploader_module.Uploader(f"http://127.0.0.1:{server.server_port}")
+        assert uploader.upload_file_chunked(str(path), file_hash) is True
+    finally:
+        server.shutdown()
+    assert client.get(f"/assets/{file_hash}").data == content
+
+    # A manifest whose chunks don't make up its hash is rejected in the background
+    chunk = b"chunk"
+    assert client.put(f"/chunks/{hashlib.sha256(chunk).hexdigest()}", data=chunk).status_code == 200
+    manifest = {
+        "hash": "e" * 64,
+        "filename": "x.bin",
+        "size": len(chunk),
+        "chunks": [[hashlib.sha256(chunk).hexdigest(), len(chunk)]],
+    }
+    assert client.post("/manifests", json=manifest).status_code == 202
+    assert client.get(f"/manifests/{'e' * 64}").get_json()["status"] == "verifying"
+    # A retry while it is verifying doesn't hash it again
+    assert client.post("/manifests", json=manifest).status_code == 202
+    deadline = time.monotonic() + 5
+    while client.get(f"/manifests/{'e' * 64}").get_json()["status"] == "verifying" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert client.get(f"/manifests/{'e' * 64}").get_json()["status"] == "hash_mismatch"
+    assert client.head(f"/assets/{'e' * 64}").status_code == 404
+
+def test_metrics_endpoint(client):
+    before = main.UPLOADS.value(kind="single", result="new")
+    content = b"metrics" * 100
+    _put(client, content)
+    _put(client, content)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert main.UPLOADS.value(kind="single", result="new") == before + 1
+    assert 'assets_uploads_total{kind="single",result="duplicate"}' in text
+    assert "# TYPE assets_storage_put_seconds histogram" in text
+    assert 'assets_storage_put_seconds_bucket{kind="stream",le="+Inf"}' in text
+    assert 'assets_http_requests_total{route="/assets/<file_hash>",method="PUT",status="200"}' in text
+
+
+def test_async_ingest_mode(monkeypatch, tmp_path, client, storage):
+    monkeypatch.setattr(main, "INGEST_MODE", "async")
+    monkeypatch.setattr(main, "INGEST_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(main, "INGEST_FSYNC", False)
+    monkeypatch.setattr(main, "_ingest_jobs", IngestJobStore(str(tmp_path / "index.db")))
+    monkeypatch.setattr(main, "_ingest_queue", None)
+    content = b"queued png" * 1000
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    try:
+        assert _put(client, b"real content", file_hash="a" * 64).status_code == 400
+
+        response = _put(client, content)
+        assert response.status_code == 202
+        job_id = response.get_json()["job_id"]
+        assert response.headers["Location"] == f"/jobs/{job_id}"
+        assert main.get_ingest_queue().drain(timeout=10)
+    finally:
+        main.get_ingest_queue().stop()
+
+    status = client.get(f"/jobs/{job_id}").get_json()
+    assert status["status"] == "done"
+    assert status["stored_as"]["object_name"] == f"{file_hash}.png"
+    with open(storage.path(f"{file_hash}.png"), "rb") as f:
+        assert f.read() == content
+    assert _put(client, content).get_json()["status"] == "already_exists"
+    assert client.get(f"/jobs/{'0' * 32}").status_code == 404
+
+
+def test_catalog_listing(client):
+    for i in range(5):
+        content = f"asset {i}".encode()
+        client.put(
+            f"/assets/{hashlib.sha256(content).hexdigest()}",
+            data=content,
+            headers={"X-File-Name": f"{i}.{'png' if i % 2 else 'txt'}", "X-Client-Id": "laptop"},
+        )
+
+    response = client.get("/assets?extension=png")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [e["filename"] for e in body["assets"]] == ["1.png", "3.png"]
+    assert body["assets"][0]["client_id"] == "laptop"
+    assert body["next_cursor"] is None
+
+    names, cursor = [], ""
+    while cursor is not None:
+        body = client.get(f"/assets?limit=2&cursor={cursor}").get_json()
+        names.extend(e["filename"] for e in body["assets"])
+        cursor = body["next_cursor"]
+    assert sorted(names) == [f"{i}.{'png' if i % 2 else 'txt'}" for i in range(5)]
+
+    assert client.get("/assets?limit=0").status_code == 400
+    assert client.get("/assets?cursor=nonsense").status_code == 400
+    assert client.get("/assets?min_size=big").status_code == 400
+
+
+def test_compressed_uploads(client, storage):
+    assert "gzip" in client.get("/capabilities").get_json()["compression"]
+    content = b"date,value\n" + b"2024-01-01,42\n" * 5000
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    def put(body, encoding):
+        return client.put(
+            f"/assets/{file_hash}",
+            data=body,
+            headers={"X-File-Name": "data.csv", "Content-Encoding": encoding},
+        )
+
+    assert put(content, "br").status_code == 415
+    assert put(b"garbage", "gzip").get_json() == {"error": "invalid_encoding"}
+    response = put(gzip.compress(content), "gzip")
+    assert response.status_code == 200
+    # The hash and the stored object are of the original content
+    with open(storage.path(f"{file_hash}.csv"), "rb") as f:
+        assert f.read() == content
+
+
+def test_uploader_compresses_text_but_not_jpeg(tmp_path, storage):
+    from werkzeug.serving import make_server
+
+    from client.hash_utils import calculate_file_hash
+    from client.metrics import BYTES_SENT_COMPRESSED
+    from client.uploader import Uploader
+
+    server = make_server("127.0.0.1", 0, main.create_app(warmup=False), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    files = {"log.txt": b"INFO all good\n" * 20000, "photo.jpg": os.urandom(50000)}
+    items = []
+    for name, content in files.items():
+        path = tmp_path / name
+        path.write_bytes(content)
+        items.append((str(path), calculate_file_hash(str(path))))
+
+    uploader = Uploader(f"http://127.0.0.1:{server.server_port}", batch_file_size=0)
+    try:
+        uploader.negotiate_hash_algorithm()
+        assert uploader.content_encoding in ("zstd", "gzip")
+        before = main.UPLOAD_BYTES.value()
+        compressed_before = BYTES_SENT_COMPRESSED.value(stage="in")
+        assert all(result.success for result in uploader.upload_many(items))
+    finally:
+        uploader.close()
+        server.shutdown()
+
+    # Stored decompressed; the server counts the original bytes
+    assert main.UPLOAD_BYTES.value() - before == sum(len(c) for c in files.values())
+    # Only the text file went compressed
+    assert BYTES_SENT_COMPRESSED.value(stage="in") - compressed_before == len(files["log.txt"])
+    for (path, file_hash), content in zip(items, files.values()):
+        with open(storage.path(file_hash + os.path.splitext(path)[1]), "rb") as f:
+            assert f.read() == content
@@ -0,0 +1,59 @@
+import gzip
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from server.compression import DecompressingReader, DecompressionError
+from server.hashing import HashMismatchError, HashVerifyingReader, is_valid_hash
+
+
+def _read_all(reader, chunk_size=7):
+    # reads like MinIO's put_object: small reads until EOF
+    parts = []
+    while True:
+        data = reader.read(chunk_size)
+        if not data:
+            return b"".join(parts)
+        parts.append(data)
+
+
+def test_hash_verifying_reader_accepts_matching_content():
+    content = b"hello world" * 10
+    reader = HashVerifyingReader(io.BytesIO(content), "sha256", hashlib.sha256(content).hexdigest())
+
+    assert _read_all(reader) == content
+    assert reader.size == len(content)
+
+
+def test_hash_verifying_reader_rejects_other_content_at_eof():
+    claimed = hashlib.sha256(b"something else").hexdigest()
+    reader = HashVerifyingReader(io.BytesIO(b"hello world"), "sha256", claimed)
+
+    with pytest.raises(HashMismatchError):
+        _read_all(reader)
+
+    assert is_valid_hash(claimed, "sha256")
+    assert not is_valid_hash("../../etc/passwd", "sha256")
+
+
+def test_decompressing_reader_streams_and_limits_the_size():
+    content = b"a,b,c\n1,2,3\n" * 10000
+    body = io.BytesIO(gzip.compress(content))
+    reader = HashVerifyingReader(DecompressingReader(body, "gzip"), "sha256", hashlib.sha256(content).hexdigest())
+    assert _read_all(reader, chunk_size=4096) == content
+
+    # A small body that expands far beyond the limit is stopped on the way
+    bomb = io.BytesIO(gzip.compress(b"\0" * 10_000_000))
+    with pytest.raises(DecompressionError):
+        _read_all(DecompressingReader(bomb, "gzip", max_size=1_000_000), chunk_size=64 * 1024)
+
+    with pytest.raises(DecompressionError):
+        _read_all(DecompressingReader(io.BytesIO(b"not gzip at all"), "gzip"))
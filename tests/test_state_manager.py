@@ -34,3 +34,100 @@ def test_state_persists_between_runs(tmp_path):
     assert m2.is_uploaded("/tmp/x.txt", "zzz")
 
 
+
+
+def test_is_unchanged_compares_fingerprint(tmp_path):
+    manager = StateManager(state_path=str(tmp_path / "state.json"))
+
+    fingerprint = [11, 1700000000000000000, 42, 1]
+    assert not manager.is_unchanged("/tmp/x.txt", fingerprint)
+
+    manager.mark_uploaded("/tmp/x.txt", "zzz", fingerprint)
+    assert manager.is_unchanged("/tmp/x.txt", fingerprint)
+    assert not manager.is_unchanged("/tmp/x.txt", [12, 1700000000000000000, 42, 1])
+
+    # fingerprints are persisted together with the hash
+    m2 = StateManager(state_path=str(tmp_path / "state.json"))
+    assert m2.is_unchanged("/tmp/x.txt", fingerprint)
+
+
+def test_old_json_state_is_migrated(tmp_path):
+    import json
+
+    # state file written by the old JSON StateManager
+    legacy_file = tmp_path / "state.json"
+    legacy_file.write_text(json.dumps({
+        "uploaded_files": {"/tmp/a.txt": "aaa", "/tmp/b.txt": "bbb"},
+        "file_fingerprints": {"/tmp/a.txt": [1, 2, 3, 4]},
+    }), encoding="utf-8")
+
+    manager = StateManager(state_path=str(tmp_path / "state.db"))
+
+    assert manager.get_uploaded_files() == {"/tmp/a.txt": "aaa", "/tmp/b.txt": "bbb"}
+    assert manager.is_unchanged("/tmp/a.txt", [1, 2, 3, 4])
+    assert not legacy_file.exists()
+    assert (tmp_path / "state.json.migrated").exists()
+
+
+def test_empty_state_file_is_a_fresh_database(tmp_path):
+    # e.g. left by a crash while the database was being created
+    state_file = tmp_path / "state.db"
+    state_file.write_bytes(b"")
+
+    manager = StateManager(state_path=str(state_file))
+    manager.mark_uploaded("/tmp/a.txt", "aaa")
+    manager.flush()
+
+    assert manager.get_uploaded_files() == {"/tmp/a.txt": "aaa"}
+    assert not (tmp_path / "state.db.migrated").exists()
+
+
+def test_mark_uploaded_many_is_one_transaction(tmp_path):
+    import pytest
+
+    manager = StateManager(state_path=str(tmp_path / "state.db"))
+
+    # second entry is broken (hash must not be NULL) -> nothing is written
+    with pytest.raises(Exception):
+        manager.mark_uploaded_many([("/tmp/a.txt", "aaa", None), ("/tmp/b.txt", None, None)])
+    assert manager.get_uploaded_files() == {}
+
+    manager.mark_uploaded_many([("/tmp/a.txt", "aaa", None), ("/tmp/b.txt", "bbb", None)])
+    assert manager.get_uploaded_files() == {"/tmp/a.txt": "aaa", "/tmp/b.txt": "bbb"}
+
+
+def test_write_behind_marks_are_flushed_in_batches(tmp_path):
+    state_file = tmp_path / "state.db"
+    m1 = StateManager(state_path=str(state_file), flush_every=3)
+
+    m1.mark_uploaded("/tmp/a.txt", "aaa")
+    m1.mark_uploaded("/tmp/b.txt", "bbb")
+
+    # visible right away to the same instance, but not written yet
+    assert m1.is_uploaded("/tmp/a.txt", "aaa")
+    assert StateManager(state_path=str(state_file)).get_uploaded_files() == {}
+
+    # third mark reaches flush_every -> all three are written together
+    m1.mark_uploaded("/tmp/c.txt", "ccc")
+    assert len(StateManager(state_path=str(state_file)).get_uploaded_files()) == 3
+
+    # close() writes whatever is still buffered
+    m1.mark_uploaded("/tmp/d.txt", "ddd")
+    m1.close()
+    assert StateManager(state_path=str(state_file)).is_uploaded("/tmp/d.txt", "ddd")
+
+
+def test_upload_sessions_survive_restart(tmp_path):
+    state_file = tmp_path / "state.db"
+
+    m1 = StateManager(state_path=str(state_file))
+    m1.save_upload_session("/tmp/big.mp4", "hhh", "upload-1")
+    m1.close()
+
+    m2 = StateManager(state_path=str(state_file))
+    assert m2.get_upload_session("/tmp/big.mp4", "hhh") == "upload-1"
+    # a session for older content of the same path is not reused
+    assert m2.get_upload_session("/tmp/big.mp4", "other") is None
+
+    m2.clear_upload_session("/tmp/big.mp4")
+    assert m2.get_upload_session("/tmp/big.mp4", "hhh") is None
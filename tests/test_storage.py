@@ -0,0 +1,158 @@
+import errno
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from server import storage as storage_module
+from server.cache import ReadCache
+from server.hashing import HashMismatchError, HashVerifyingReader
+from server.storage import LocalStorage, ObjectInfo, copy_file_data
+
+
+@pytest.fixture
+def local(tmp_path):
+    store = LocalStorage(str(tmp_path / "objects"), fsync=False)
+    store.connect()
+    return store
+
+
+def test_objects_are_sharded_by_hash(local):
+    content = b"hello"
+    object_name = hashlib.sha256(content).hexdigest() + ".txt"
+
+    local.put_stream(object_name, io.BytesIO(content), "text/plain")
+
+    path = local.path(object_name)
+    assert path == os.path.join(local.root, object_name[:2], object_name[2:4], object_name)
+    assert b"".join(local.iter_chunks(object_name)) == content
+    assert os.listdir(os.path.join(local.root, "tmp")) == []
+
+
+def test_hash_mismatch_stores_nothing(local):
+    reader = HashVerifyingReader(io.BytesIO(b"real content"), "sha256", "a" * 64)
+
+    with pytest.raises(HashMismatchError):
+        local.put_stream("a" * 64, reader, "application/octet-stream")
+
+    assert not os.path.exists(local.path("a" * 64))
+    assert os.listdir(os.path.join(local.root, "tmp")) == []
+
+
+def test_import_file_links_or_copies(local, tmp_path):
+    source = tmp_path / "spooled.bin"
+    source.write_bytes(b"x" * 10000)
+
+    local.import_file("linked", str(source))
+    assert os.stat(local.path("linked")).st_ino == os.stat(source).st_ino
+
+    local.import_file("copied", str(source), link=False)
+    with open(local.path("copied"), "rb") as f:
+        assert f.read() == b"x" * 10000
+
+
+def test_copy_falls_back_when_copy_file_range_fails(monkeypatch, tmp_path):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, "cross-device")
+
+    monkeypatch.setattr(storage_module, "_copy_file_range", unsupported)
+    source = tmp_path / "src"
+    source.write_bytes(os.urandom(300000))
+
+    with open(source, "rb") as src, open(tmp_path / "dst", "wb") as dst:
+        copy_file_data(src.fileno(), dst.fileno(), 300000)
+
+    assert (tmp_path / "dst").read_bytes() == source.read_bytes()
+
+
+def test_multipart_parts_are_joined_in_order(local):
+    upload_id = local.create_multipart("big.bin", "application/octet-stream")
+    etags = [None, None, None]
+    for number, data in ((3, b"cc"), (1, b"aaaa"), (2, b"bbbb")):
+        etags[number - 1] = local.upload_part("big.bin", upload_id, number, data)
+
+    local.complete_multipart("big.bin", upload_id, etags)
+
+    assert b"".join(local.iter_chunks("big.bin")) == b"aaaabbbbcc"
+    assert os.listdir(os.path.join(local.root, "uploads")) == []
+
+    # Renamed into place once checked; whatever was there is replaced
+    local.put_bytes("final.bin", b"old", "application/octet-stream")
+    local.rename("big.bin", "final.bin", "application/octet-stream")
+    assert b"".join(local.iter_chunks("final.bin")) == b"aaaabbbbcc"
+    assert not os.path.exists(local.path("big.bin"))
+
+
+
+class FakeMinio:
+    # Only the private multipart helpers MinioMultipart relies on
+    def __init__(self, *args, **kwargs):
+        self.calls = []
+
+    def _create_multipart_upload(self, bucket, object_name, headers):
+        self.calls.append(("create", bucket, object_name, headers["Content-Type"]))
+        return "m-1"
+
+    def _upload_part(self, bucket, object_name, data, headers, upload_id, part_number):
+        self.calls.append(("part", upload_id, part_number, data))
+        return f"etag-{part_number}"
+
+    def _complete_multipart_upload(self, bucket, object_name, upload_id, parts):
+        self.calls.append(("complete", upload_id, [(p.part_number, p.etag) for p in parts]))
+
+    def _abort_multipart_upload(self, bucket, object_name, upload_id):
+        self.calls.append(("abort", upload_id))
+
+
+def test_minio_multipart_goes_through_one_adapter(monkeypatch):
+    monkeypatch.setattr(storage_module, "Minio", FakeMinio)
+    minio = storage_module.MinioStorage("localhost:9000", "key", "secret", "assets")
+
+    upload_id = minio.create_multipart("a.iso", "application/octet-stream")
+    assert minio.upload_part("a.iso", upload_id, 1, b"abc") == "etag-1"
+    minio.complete_multipart("a.iso", upload_id, ["etag-1"])
+    minio.abort_multipart("a.iso", upload_id)
+    assert minio.client.calls == [
+        ("create", "assets", "a.iso", "application/octet-stream"),
+        ("part", "m-1", 1, b"abc"),
+        ("complete", "m-1", [(1, "etag-1")]),
+        ("abort", "m-1"),
+    ]
+
+    # A minio without the helpers: resumable uploads fail as storage errors
+    monkeypatch.delattr(FakeMinio, "_upload_part")
+    minio = storage_module.MinioStorage("localhost:9000", "key", "secret", "assets")
+    with pytest.raises(storage_module.StorageError):
+        minio.upload_part("a.iso", "m-1", 1, b"abc")
+
+def test_read_cache_memory_lru_and_interrupted_disk_fill(tmp_path):
+    cache = ReadCache(
+        str(tmp_path / "cache"), memory_max_bytes=250, memory_max_object_size=100,
+        disk_max_bytes=10_000, disk_max_object_size=10_000,
+    )
+    chunks = lambda data: lambda start, length: iter([data[start:start + length]])
+
+    # memory tier: least recently used out first
+    for key in ("a", "b", "c"):
+        cache.read_through(key, key, ObjectInfo(100, "text/plain"), chunks(key.encode() * 100))
+    assert cache.get("a", "a") is None
+    assert cache.get("b", "b").data == b"b" * 100
+
+    # disk tier: a download that stops early leaves nothing behind
+    info = ObjectInfo(1000, "application/octet-stream")
+    read = cache.read_through("d" * 64, "d" * 64 + ".bin", info, lambda start, length: iter([b"x" * 500] * 2))
+    body = read(0, 1000)
+    next(body)
+    body.close()
+    assert cache.get("d" * 64, "d" * 64 + ".bin") is None
+    assert os.listdir(tmp_path / "cache" / "tmp") == []
+
+    b"".join(read(0, 1000))
+    assert cache.get("d" * 64, "d" * 64 + ".bin").path.endswith(".bin")
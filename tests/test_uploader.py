@@ -0,0 +1,148 @@
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+# מוסיפים את תיקיית הפרויקט (התיקייה שמעל tests) ל־sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import pytest
+from flask import Flask, request
+from werkzeug.serving import make_server
+
+from client.scheduler import Scheduler
+from client.uploader import Uploader
+
+
+@pytest.fixture
+def fake_server():
+    """
+    A tiny HTTP server in a background thread that accepts PUT /assets/<hash>
+    and remembers how many uploads were running at the same time.
+    """
+    app = Flask(__name__)
+    stats = {"received": {}, "running": 0, "max_running": 0}
+    lock = threading.Lock()
+
+    @app.route("/assets/<file_hash>", methods=["PUT"])
+    def put_asset(file_hash):
+        with lock:
+            stats["running"] += 1
+            stats["max_running"] = max(stats["max_running"], stats["running"])
+        time.sleep(0.05)
+        stats["received"][file_hash] = request.get_data()
+        with lock:
+            stats["running"] -= 1
+        if file_hash == "bad":
+            return {"error": "hash_mismatch"}, 400
+        return {"status": "ok"}, 200
+
+    @app.route("/upload/batch", methods=["POST"])
+    def upload_batch():
+        stats["batches"] = stats.get("batches", 0) + 1
+        body, results = request.get_data(), []
+        if len(body) > stats.get("max_batch_bytes", len(body)):
+            return {"error": "batch too big"}, 413
+        offset = 0
+        while offset < len(body):
+            (header_length,) = struct.unpack_from(">I", body, offset)
+            header = json.loads(body[offset + 4:offset + 4 + header_length])
+            offset += 4 + header_length
+            stats["received"][header["hash"]] = body[offset:offset + header["size"]]
+            offset += header["size"]
+            results.append({"hash": header["hash"], "status": "hash_mismatch" if header["hash"] == "bad" else "ok"})
+        return {"results": results}, 200
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", stats
+    server.shutdown()
+
+
+def test_upload_many_reports_every_file_and_limits_concurrency(tmp_path, fake_server):
+    server_url, stats = fake_server
+    items = []
+    for i in range(8):
+        path = tmp_path / f"f{i}.txt"
+        path.write_text(f"content {i}", encoding="utf-8")
+        items.append((str(path), "bad" if i == 0 else f"hash{i}"))
+
+    # batch_file_size=0: every file is its own request
+    uploader = Uploader(server_url, max_in_flight=3, batch_file_size=0)
+    reported = []
+    results = uploader.upload_many(items, on_result=reported.append)
+    uploader.close()
+
+    assert sorted(results) == sorted(reported)
+    assert {r.file_path: r.success for r in results} == {path: h != "bad" for path, h in items}
+    assert stats["received"]["hash3"] == b"content 3"
+    assert 1 < stats["max_running"] <= 3
+
+
+def test_upload_many_with_a_shared_scheduler_respects_the_bandwidth_limit(tmp_path, fake_server):
+    server_url, stats = fake_server
+    items = []
+    for i in range(3):
+        path = tmp_path / f"f{i}.bin"
+        path.write_bytes(bytes([i]) * 100_000)
+        items.append((str(path), f"hash{i}"))
+
+    # 300 KB at 1 MB/s with a 100 KB burst: at least 0.2 s
+    scheduler = Scheduler(upload_workers=2, bandwidth_limit=1_000_000, burst=100_000)
+    uploader = Uploader(server_url, batch_file_size=0, scheduler=scheduler)
+    started = time.monotonic()
+    results = uploader.upload_many(items, root=str(tmp_path))
+    elapsed = time.monotonic() - started
+    uploader.close()
+    scheduler.shutdown()
+
+    assert all(result.success for result in results)
+    assert stats["received"]["hash2"] == bytes([2]) * 100_000
+    assert stats["max_running"] <= 2
+    assert elapsed >= 0.18
+
+
+def test_upload_many_packs_small_files_into_batches(tmp_path, fake_server):
+    server_url, stats = fake_server
+    items = []
+    for i in range(5):
+        path = tmp_path / f"small{i}.txt"
+        path.write_text(f"small {i}", encoding="utf-8")
+        items.append((str(path), "bad" if i == 0 else f"small{i}"))
+    big = tmp_path / "big.bin"
+    big.write_bytes(b"b" * 1000)
+    items.append((str(big), "big"))
+
+    uploader = Uploader(server_url, batch_file_size=100, batch_max_files=3)
+    results = uploader.upload_many(items)
+    uploader.close()
+
+    # 5 small files -> 2 batch requests (3 + 2), the big file on its own
+    assert stats["batches"] == 2
+    assert stats["received"]["big"] == b"b" * 1000
+    assert stats["received"]["small4"] == b"small 4"
+    assert {r.file_path: r.success for r in results} == {path: h != "bad" for path, h in items}
+
+
+def test_upload_batch_splits_a_batch_the_server_finds_too_big(tmp_path, fake_server):
+    server_url, stats = fake_server
+    stats["max_batch_bytes"] = 150
+    items = []
+    for i in range(4):
+        path = tmp_path / f"small{i}.txt"
+        path.write_bytes(b"%d" % i * 40)
+        items.append((str(path), f"small{i}"))
+
+    uploader = Uploader(server_url, batch_file_size=100, compression=False)
+    results = uploader.upload_batch(items)
+    uploader.close()
+
+    # 4 files refused, 2 + 2 refused, 1 + 1 + 1 + 1 refused, then PUT one by one
+    assert stats["batches"] == 7
+    assert all(r.success for r in results)
+    assert stats["received"]["small3"] == b"3" * 40